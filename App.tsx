@@ -11,7 +11,7 @@ import { MECHANIC_REGISTRY } from './mechanics/registry';
 import { MechanicProvider } from './mechanics/MechanicContext';
 import { MechanicDispatchAction, OfficeState } from './mechanics/types';
 import { compareExpectedVsActual } from './services/ComparisonEngine';
-import { buildSessionExport } from './services/sessionExport';
+import { buildSessionExport, pushSessionSnapshot, SessionSyncState } from './services/sessionExport';
 import { useMechanicLogSync } from './hooks/useMechanicLogSync';
 import { clampReputation, resolveGlobalEffects } from './services/globalEffects';
 
@@ -106,6 +106,7 @@ const resolveMechanics = (config: SimulatorConfig | null): ResolvedMechanicConfi
 export default function App(): React.ReactElement {
   const sessionIdRef = useRef<string>(crypto.randomUUID());
   const sessionStartRef = useRef<number | null>(null);
+  const sessionSyncRef = useRef<SessionSyncState | null>(null);
   const sessionEndRef = useRef<number | null>(null);
   const [appStep, setAppStep] = useState<AppStep>('version_selection');
   const [config, setConfig] = useState<SimulatorConfig | null>(null);
@@ -482,19 +483,16 @@ export default function App(): React.ReactElement {
         
         console.log(`[Backend] Attempting to connect to ${API_BASE_URL}`);
         
-        const firstResp = await fetch(`${API_BASE_URL.replace(/\/$/, '')}/sessions`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(exportPayload)
-        });
+        const firstResp = await pushSessionSnapshot(API_BASE_URL, exportPayload, sessionSyncRef.current);
+        sessionSyncRef.current = firstResp.syncState;
 
         if (!firstResp.ok) {
-          console.warn(`[Backend] POST /sessions failed with status ${firstResp.status}`);
+          console.warn(`[Backend] session sync failed with status ${firstResp.status}`);
           return;
         }
 
         const resp = await fetch(
-          `${API_BASE_URL.replace(/\/$/, '')}/sessions/${exportPayload.session_metadata.session_id}/resolve_day_effects?day=${completedDay}`,
+          `${API_BASE_URL.replace(/\/$/, '')}/sessions/${exportPayload.session_metadata.session_id}/resolve_day_effects?day=${completedDay}&wait_ingest=true`,
           { method: 'POST' }
         );
         
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.benchmarks.synthetic import make_session
+
+
+def _request(base_url: str, method: str, path: str, body: dict | None = None, timeout: float = 60.0):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method)
+    if data is not None:
+        req.add_header("Content-Type", "application/json")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as exc:
+        status = exc.code
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        status = 0
+    return status, time.perf_counter() - started
+
+
+def _get_json(base_url: str, path: str, timeout: float = 10.0):
+    try:
+        with urllib.request.urlopen(base_url + path, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except (urllib.error.URLError, TimeoutError, ConnectionError, ValueError):
+        return None
+
+
+def _wait_ingested(base_url: str, session_ids: list, timeout: float = 120.0):
+    # INGEST_MODE=queue answers the seeding uploads with 202: wait until the worker stored them.
+    deadline = time.time() + timeout
+    pending = list(session_ids)
+    while pending:
+        still = []
+        for sid in pending:
+            info = _get_json(base_url, f"/sessions/{sid}/ingest")
+            if info and info["status"] == "failed":
+                raise RuntimeError(f"seeding {sid} failed to ingest: {info['last_error']}")
+            if not info or info["status"] != "done":
+                still.append(sid)
+        pending = still
+        if pending:
+            if time.time() >= deadline:
+                raise RuntimeError(f"{len(pending)} seeded session(s) still not ingested")
+            time.sleep(0.2)
+
+
+def _wait_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, _ = _request(base_url, "GET", "/health", timeout=1.0)
+        if status == 200:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not become ready")
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run_load(base_url: str, sessions: int, requests: int, concurrency: int, days: int, seed: int) -> dict:
+    payloads = [make_session(f"bench-{seed}-{i}", days=days, seed=seed) for i in range(sessions)]
+    queued = []
+    for payload in payloads:
+        status, _ = _request(base_url, "POST", "/sessions", payload)
+        if status == 202:
+            queued.append(payload["session_metadata"]["session_id"])
+        elif status != 200:
+            raise RuntimeError(f"seeding POST /sessions failed with status {status}")
+    _wait_ingested(base_url, queued)
+
+    rng = random.Random(seed)
+    plan = []
+    for _ in range(requests):
+        payload = rng.choice(payloads)
+        sid = payload["session_metadata"]["session_id"]
+        kind = rng.choices(
+            ["create_session", "resolve_day_effects", "get_session", "get_session_normalized", "health"],
+            weights=[2, 2, 2, 2, 2],
+        )[0]
+        if kind == "create_session":
+            plan.append((kind, "POST", "/sessions", payload))
+        elif kind == "resolve_day_effects":
+            plan.append((kind, "POST", f"/sessions/{sid}/resolve_day_effects?day={rng.randint(1, days)}", None))
+        elif kind == "get_session":
+            plan.append((kind, "GET", f"/sessions/{sid}", None))
+        elif kind == "get_session_normalized":
+            plan.append((kind, "GET", f"/sessions/{sid}/normalized", None))
+        else:
+            plan.append((kind, "GET", "/health", None))
+
+    latencies = {}
+    errors = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            (kind, executor.submit(_request, base_url, method, path, body))
+            for kind, method, path, body in plan
+        ]
+        for kind, future in futures:
+            status, elapsed = future.result()
+            latencies.setdefault(kind, []).append(elapsed)
+            if not 200 <= status < 300:  # 202 = upload queued (INGEST_MODE=queue)
+                errors[kind] = errors.get(kind, 0) + 1
+    wall = time.perf_counter() - started
+
+    endpoints = {}
+    for kind, values in sorted(latencies.items()):
+        endpoints[kind] = {
+            "count": len(values),
+            "errors": errors.get(kind, 0),
+            "mean_ms": statistics.fmean(values) * 1000,
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p95_ms": _percentile(values, 95) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+        }
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "throughput_rps": requests / wall if wall else None,
+        "endpoints": endpoints,
+    }
+
+
+def run_mode(mode: str, port: int, args) -> dict:
+    env = {**os.environ, "DB_ASYNC": "1" if mode == "async" else "0"}
+    base_url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        _wait_ready(base_url)
+        return run_load(base_url, args.sessions, args.requests, args.concurrency, args.days, args.seed)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def _print_report(results: dict):
+    for mode, result in results.items():
+        print(f"== {mode}: {result['requests']} requests, concurrency {result['concurrency']}, "
+              f"{result['throughput_rps']:.1f} req/s")
+        for kind, stats in result["endpoints"].items():
+            print(f"  {kind:<24} n={stats['count']:<5} err={stats['errors']:<4} "
+                  f"p50={stats['p50_ms']:8.1f}ms p95={stats['p95_ms']:8.1f}ms p99={stats['p99_ms']:8.1f}ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the sync (threadpool) and async data paths under concurrent load.")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    parser.add_argument("--base-url", help="Benchmark an already running server instead of spawning uvicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.base_url:
+        results = {"external": run_load(args.base_url.rstrip("/"), args.sessions, args.requests, args.concurrency, args.days, args.seed)}
+    else:
+        modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+        results = {mode: run_mode(mode, args.port, args) for mode in modes}
+
+    _print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import random
+import time
+
+if __name__ == "__main__":
+    # Pure CPU benchmark: backend.main is loaded with the SQLite backend so it imports without
+    # DATABASE_URL (no connection is ever opened). Not when imported, e.g. by the tests.
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["INGEST_MODE"] = "sync"
+
+from backend.main import _build_canonical_index, _find_best_match, resolve_day  # noqa: E402
+
+ACTION_TYPES = ["visit_stakeholder", "schedule_meeting", "send_email", "assign_training", "approve_document"]
+MECHANICS = ["map", "inbox", "documents", "calendar", "office"]
+
+
+def make_actions(expected_count: int, canonical_count: int, targets: int = 200, days: int = 5, seed: int = 0):
+    rng = random.Random(seed)
+    day_ms = 86_400_000
+    expected = []
+    for n in range(expected_count):
+        day = rng.randint(1, days)
+        expected.append({
+            "expected_action_id": f"exp:{n}",
+            "action_type": rng.choice(ACTION_TYPES),
+            "target_ref": f"target:{rng.randrange(targets)}",
+            "mechanic_id": rng.choice(MECHANICS) if rng.random() < 0.8 else None,
+            "constraints": {"day": day},
+            "rule_id": "default_rule",
+            "created_at": day * day_ms + rng.randrange(day_ms),
+            "effects": {},
+        })
+    canonical = []
+    for n in range(canonical_count):
+        canonical.append({
+            "canonical_action_id": f"can:{n}",
+            "action_type": rng.choice(ACTION_TYPES),
+            "target_ref": f"target:{rng.randrange(targets)}",
+            "mechanic_id": rng.choice(MECHANICS),
+            "value_final": {},
+            # Coarse timestamps so ties show up and tie-breaking gets exercised.
+            "committed_at": rng.randint(1, days + 1) * day_ms + rng.randrange(24) * 3_600_000,
+        })
+    return expected, canonical
+
+
+def _linear_match(expected: dict, canonical_actions: list):
+    # Reference implementation: the per-expected scan the index replaced.
+    if expected.get("mechanic_id"):
+        matches = [a for a in canonical_actions if a["action_type"] == expected["action_type"] and a["target_ref"] == expected["target_ref"] and a["mechanic_id"] == expected["mechanic_id"]]
+    else:
+        matches = [a for a in canonical_actions if a["action_type"] == expected["action_type"] and a["target_ref"] == expected["target_ref"]]
+    if not matches:
+        return None
+    created_at = expected.get("created_at") or 0
+    after = [m for m in matches if (m.get("committed_at") or 0) >= created_at]
+    after.sort(key=lambda a: a.get("committed_at") or 0)
+    if after:
+        return after[0]
+    return sorted(matches, key=lambda a: a.get("committed_at") or 0)[0]
+
+
+def _timed(fn, repeat: int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(expected_count: int, canonical_count: int, targets: int, days: int, repeat: int, seed: int) -> dict:
+    expected, canonical = make_actions(expected_count, canonical_count, targets, days, seed)
+
+    linear_s, linear = _timed(lambda: [_linear_match(e, canonical) for e in expected], repeat)
+    build_s, index = _timed(lambda: _build_canonical_index(canonical), repeat)
+    lookup_s, indexed = _timed(lambda: [_find_best_match(index, e) for e in expected], repeat)
+
+    mismatches = sum(
+        1 for a, b in zip(linear, indexed)
+        if (a and a["canonical_action_id"]) != (b and b["canonical_action_id"])
+    )
+    if mismatches:
+        raise AssertionError(f"indexed matcher disagrees with linear scan on {mismatches} expected actions")
+
+    resolve_s, _ = _timed(lambda: [resolve_day(expected, index, day) for day in range(1, days + 1)], repeat)
+
+    return {
+        "expected_actions": expected_count,
+        "canonical_actions": canonical_count,
+        "matched": sum(1 for m in indexed if m is not None),
+        "linear_ms": linear_s * 1000,
+        "index_build_ms": build_s * 1000,
+        "index_lookup_ms": lookup_s * 1000,
+        "speedup": linear_s / max(build_s + lookup_s, 1e-9),
+        "resolve_all_days_ms": resolve_s * 1000,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the indexed expected/canonical matcher against a linear scan.")
+    parser.add_argument("--expected", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--canonical", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for expected_count in args.expected:
+        for canonical_count in args.canonical:
+            result = run(expected_count, canonical_count, args.targets, args.days, args.repeat, args.seed)
+            results.append(result)
+            print(f"expected={expected_count:<6} canonical={canonical_count:<7} "
+                  f"linear={result['linear_ms']:9.1f}ms index={result['index_build_ms'] + result['index_lookup_ms']:8.1f}ms "
+                  f"(build {result['index_build_ms']:.1f}ms) x{result['speedup']:.0f} "
+                  f"resolve/{args.days}d={result['resolve_all_days_ms']:.1f}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# backend.main only imports with a DATABASE_URL under the postgres backend. --skip-db never opens
+# a connection, so it loads main with the SQLite backend (and inline ingest, the only mode that
+# backend takes) and runs without one.
+if "--skip-db" in sys.argv[1:]:
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["INGEST_MODE"] = "sync"
+
+from backend.benchmarks.concurrency import run_mode  # noqa: E402
+from backend.benchmarks.synthetic import make_session  # noqa: E402
+from backend.main import (  # noqa: E402
+    STORAGE_BACKEND,
+    _build_canonical_index,
+    _child_rows,
+    _json_dump,
+    _json_load,
+    close_pool,
+    current_rules,
+    encode_payload,
+    get_conn,
+    migrate_schema,
+    normalize_session,
+    resolve_day,
+)
+
+# Regression suite: microbenchmarks of the hot paths on a synthetic SessionExport plus the
+# end-to-end HTTP load from concurrency.py. Results are written as JSON; --compare checks a
+# run against a previous file and exits 1 when a benchmark got slower than --threshold.
+# The normalize_session benchmark needs DATABASE_URL (each run is rolled back), the HTTP one
+# spawns uvicorn against the same database.
+
+# JSON columns as _child_rows/_canonical_action_row store them.
+JSON_FIELDS = {
+    "explicit_decisions": ("consequences",),
+    "expected_actions": ("constraints", "effects"),
+    "canonical_actions": ("value_final", "context"),
+    "mechanic_events": ("payload",),
+    "process_log": ("events",),
+    "player_actions_log": ("metadata",),
+}
+
+
+def _bench(fn, repeat: int, number: int = 1) -> dict:
+    # best/median of `repeat` timings, each the mean of `number` calls
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "best_ms": min(timings) * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+    }
+
+
+def _json_values(session: dict) -> list:
+    return [
+        item.get(field)
+        for key, fields in JSON_FIELDS.items()
+        for item in session.get(key) or []
+        for field in fields
+    ]
+
+
+def bench_json(session: dict, repeat: int) -> dict:
+    values = _json_values(session)
+    dumped = [_json_dump(v) for v in values]
+    document = json.dumps(session, ensure_ascii=False).encode("utf-8")
+    return {
+        "json_dump": {**_bench(lambda: [_json_dump(v) for v in values], repeat), "values": len(values)},
+        "json_load": {**_bench(lambda: [_json_load(v) for v in dumped], repeat), "values": len(dumped)},
+        "encode_payload": {
+            **_bench(lambda: encode_payload(json.dumps(session, ensure_ascii=False).encode("utf-8")), repeat),
+            "bytes": len(document),
+        },
+    }
+
+
+def bench_matching(session: dict, days: int, repeat: int) -> dict:
+    # Same shapes _expected_from_row/_canonical_from_row hand to resolve_day.
+    expected = [{"effects": {}, **action} for action in session["expected_actions"]]
+    canonical = [{"context": None, **action} for action in session["canonical_actions"]]
+    rules = current_rules()
+    index = _build_canonical_index(list(canonical))
+    return {
+        "child_rows": _bench(lambda: _child_rows(session, {a["expected_action_id"] for a in expected}), repeat),
+        "canonical_index": {**_bench(lambda: _build_canonical_index(list(canonical)), repeat), "actions": len(canonical)},
+        "resolve_day": {
+            **_bench(lambda: [resolve_day(expected, index, day, rules) for day in range(1, days + 1)], repeat),
+            "expected": len(expected),
+            "days": days,
+        },
+    }
+
+
+def bench_normalize(sessions: list, repeat: int) -> dict:
+    # First upload (all inserts) and an unchanged re-upload (diff finds nothing to write),
+    # each inside a transaction that is rolled back, so the database is left untouched.
+    created_at = datetime.now(timezone.utc).isoformat()
+    with get_conn() as conn:
+        migrate_schema(conn)
+        conn.commit()
+
+        def first():
+            for session in sessions:
+                normalize_session(conn, session["session_metadata"]["session_id"], session, created_at)
+
+        insert = []
+        reupload = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            first()
+            insert.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            first()
+            reupload.append(time.perf_counter() - started)
+            conn.rollback()
+
+    def summary(timings):
+        return {
+            "repeat": repeat,
+            "sessions": len(sessions),
+            "best_ms": min(timings) * 1000,
+            "median_ms": statistics.median(timings) * 1000,
+            "mean_ms": statistics.fmean(timings) * 1000,
+        }
+
+    return {"normalize_session": summary(insert), "normalize_session_unchanged": summary(reupload)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args) -> dict:
+    shape = {
+        "days": args.days,
+        "decisions_per_day": args.decisions,
+        "events_per_day": args.events,
+        "stakeholders": args.stakeholders,
+        "questions_per_stakeholder": args.questions,
+        "questions_per_day": args.questions_per_day,
+    }
+    session = make_session("bench-suite-0", seed=args.seed, client_comparisons=True, **shape)
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "session": {**shape, "seed": args.seed},
+        },
+        "micro": {},
+    }
+    results["micro"].update(bench_json(session, args.repeat))
+    results["micro"].update(bench_matching(session, args.days, args.repeat))
+    if not args.skip_db:
+        sessions = [
+            make_session(f"bench-suite-{n}", seed=args.seed, **shape) for n in range(args.normalize_sessions)
+        ]
+        results["micro"].update(bench_normalize(sessions, args.repeat))
+    if args.http:
+        modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+        results["http"] = {mode: run_mode(mode, args.port, args) for mode in modes}
+    return results
+
+
+def _flatten(results: dict) -> dict:
+    # comparable timings: micro best_ms, HTTP p50/p95 per endpoint
+    flat = {f"micro.{name}": stats["best_ms"] for name, stats in results.get("micro", {}).items()}
+    for mode, run in (results.get("http") or {}).items():
+        for kind, stats in run["endpoints"].items():
+            flat[f"http.{mode}.{kind}.p50"] = stats["p50_ms"]
+            flat[f"http.{mode}.{kind}.p95"] = stats["p95_ms"]
+    return flat
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    base = _flatten(baseline)
+    regressions = []
+    for name, value in sorted(_flatten(current).items()):
+        before = base.get(name)
+        if before is None:
+            print(f"  {name:<48} {value:10.2f}ms (new)")
+            continue
+        ratio = value / before if before else float("inf")
+        flag = " REGRESSION" if ratio > 1 + threshold else ""
+        print(f"  {name:<48} {before:10.2f}ms -> {value:10.2f}ms  x{ratio:.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def _print_report(results: dict):
+    print(f"== micro (best of {next(iter(results['micro'].values()))['repeat']})")
+    for name, stats in results["micro"].items():
+        print(f"  {name:<30} best={stats['best_ms']:9.3f}ms median={stats['median_ms']:9.3f}ms")
+    for mode, run in (results.get("http") or {}).items():
+        print(f"== http {mode}: {run['requests']} requests, concurrency {run['concurrency']}, "
+              f"{run['throughput_rps']:.1f} req/s")
+        for kind, stats in run["endpoints"].items():
+            print(f"  {kind:<24} n={stats['count']:<5} err={stats['errors']:<4} "
+                  f"p50={stats['p50_ms']:8.1f}ms p95={stats['p95_ms']:8.1f}ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark normalize, matching/rules, JSON and HTTP on synthetic sessions.")
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--decisions", type=int, default=20, help="Decisions per day")
+    parser.add_argument("--events", type=int, default=500, help="Mechanic events per day")
+    parser.add_argument("--stakeholders", type=int, default=5)
+    parser.add_argument("--questions", type=int, default=4, help="Questions per stakeholder")
+    parser.add_argument("--questions-per-day", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--normalize-sessions", type=int, default=1, help="Sessions per normalize_session run")
+    parser.add_argument("--skip-db", action="store_true", help="Only the benchmarks that do not need Postgres")
+    parser.add_argument("--http", action="store_true", help="Also run the end-to-end HTTP load (spawns uvicorn)")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both", help="DB_ASYNC mode(s) for --http")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sessions", type=int, default=20, help="Sessions seeded for --http")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON from a previous run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown before flagging (0.10 = 10%%)")
+    args = parser.parse_args()
+    if args.skip_db and args.http:
+        parser.error("--http needs the database (drop --skip-db)")
+    if not args.skip_db and STORAGE_BACKEND != "postgres":
+        parser.error("normalize_session needs STORAGE_BACKEND=postgres and DATABASE_URL (or use --skip-db)")
+
+    try:
+        results = run_suite(args)
+    finally:
+        close_pool()
+
+    _print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        print(f"== compared to {args.compare} (commit {baseline.get('meta', {}).get('commit')})")
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than +{args.threshold:.0%}.", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,163 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+STAKEHOLDERS = ["director", "jefa_enfermeria", "medico_jefe", "administrativo", "comunidad"]
+MECHANICS = ["map", "inbox", "documents", "calendar", "office", "dialogue"]
+TIME_SLOTS = ["mañana", "tarde"]
+
+
+# Synthetic SessionExport (services/sessionExport.ts): `days` days with `decisions_per_day`
+# decisions (explicit decision + expected action + process log entry, ~70% of them carried out
+# as a canonical action) and `events_per_day` mechanic events / player actions per day.
+# Catalogs: `stakeholders` stakeholders in final_state, each with `questions_per_stakeholder`
+# question definitions (and requirements), and `questions_per_day` question_log entries.
+# `client_comparisons` fills `comparisons` the way the front does on export (includeNotDone).
+# Same arguments -> same document; the catalog knobs default to the original payload shape.
+def stakeholder_catalog(count: int = len(STAKEHOLDERS)) -> list:
+    return STAKEHOLDERS[:count] + [f"stakeholder_{n}" for n in range(len(STAKEHOLDERS), count)]
+
+
+def make_session(session_id: str, days: int = 5, decisions_per_day: int = 4, events_per_day: int = 50, seed: int = 0,
+                 stakeholders: int = len(STAKEHOLDERS), questions_per_stakeholder: int = 0, questions_per_day: int = 0,
+                 client_comparisons: bool = False) -> dict:
+    rng = random.Random(f"{session_id}:{seed}")
+    # catalogs draw from their own stream so the core lists do not depend on them
+    catalog_rng = random.Random(f"{session_id}:{seed}:catalog")
+    start = datetime(2026, 3, 2, 9, 0, tzinfo=timezone.utc)
+    base_ms = int(start.timestamp() * 1000)
+    stakeholder_ids = stakeholder_catalog(stakeholders)
+    questions = {
+        sid: [
+            {
+                "question_id": f"{sid}_q{q}",
+                "text": f"Pregunta {q} para {sid}",
+                "answer": f"Respuesta {q} de {sid}",
+                "requirements": {"trust_min": catalog_rng.choice([0, 20, 40, 60])} if q % 2 else {},
+                "tags": ["bench"],
+                "time_cost": 1,
+            }
+            for q in range(questions_per_stakeholder)
+        ]
+        for sid in stakeholder_ids
+    }
+
+    explicit_decisions = []
+    expected_actions = []
+    canonical_actions = []
+    mechanic_events = []
+    process_log = []
+    player_actions_log = []
+    question_log = []
+
+    for day in range(1, days + 1):
+        day_ms = base_ms + (day - 1) * 86_400_000
+        for n in range(decisions_per_day):
+            node_id = f"node_d{day}_{n}"
+            option_id = f"opt_{rng.randint(1, 3)}"
+            stakeholder = rng.choice(stakeholder_ids)
+            slot = rng.choice(TIME_SLOTS)
+            created_at = day_ms + n * 600_000
+            explicit_decisions.append({
+                "nodeId": node_id,
+                "choiceId": option_id,
+                "choiceText": f"Opcion {option_id} en {node_id}",
+                "stakeholder": stakeholder,
+                "day": day,
+                "timeSlot": slot,
+                "consequences": {"trustChange": rng.randint(-5, 5)},
+            })
+            expected_actions.append({
+                "expected_action_id": f"{session_id}:exp:{day}:{n}",
+                "source": {"node_id": node_id, "option_id": option_id},
+                "mechanic_id": "map",
+                "action_type": "visit_stakeholder",
+                "target_ref": f"stakeholder:{stakeholder}",
+                "constraints": {"day": day, "time_window": slot},
+                "rule_id": "visit_stakeholder_rule_v1",
+                "created_at": created_at,
+            })
+            if rng.random() < 0.7:
+                canonical_actions.append({
+                    "canonical_action_id": f"{session_id}:can:{day}:{n}",
+                    "mechanic_id": "map",
+                    "action_type": "visit_stakeholder",
+                    "target_ref": f"stakeholder:{stakeholder}",
+                    "value_final": {"day": day, "time_slot": slot, "location_id": "box_1", "arrived_at": created_at + 60_000},
+                    "committed_at": created_at + 60_000,
+                })
+            process_log.append({
+                "nodeId": node_id,
+                "startTime": created_at,
+                "endTime": created_at + 15_000,
+                "totalDuration": 15_000,
+                "finalChoice": option_id,
+                "events": [{"type": "hover", "t": 1200}],
+            })
+        for n in range(events_per_day):
+            mechanic_id = rng.choice(MECHANICS)
+            mechanic_events.append({
+                "event_id": f"{session_id}:evt:{day}:{n}",
+                "mechanic_id": mechanic_id,
+                "event_type": "staff_clicked" if mechanic_id == "map" else "opened",
+                "timestamp": day_ms + n * 1000,
+                "payload": {"day": day, "time_slot": rng.choice(TIME_SLOTS)},
+            })
+            player_actions_log.append({
+                "event": f"{mechanic_id}_click",
+                "metadata": {"n": n},
+                "day": day,
+                "timeSlot": rng.choice(TIME_SLOTS),
+                "timestamp": day_ms + n * 1000,
+            })
+        for n in range(questions_per_day if questions_per_stakeholder else 0):
+            stakeholder = catalog_rng.choice(stakeholder_ids)
+            question = catalog_rng.choice(questions[stakeholder])
+            question_log.append({
+                "day": day,
+                "timeSlot": catalog_rng.choice(TIME_SLOTS),
+                "stakeholder_id": stakeholder,
+                "question_id": question["question_id"],
+                "was_locked": bool(question["requirements"]) and catalog_rng.random() < 0.3,
+                "trust_at_ask": catalog_rng.randint(0, 100),
+                "support_at_ask": catalog_rng.randint(0, 100),
+                "reputation_at_ask": catalog_rng.randint(0, 100),
+                "timestamp": day_ms + 3_600_000 + n * 60_000,
+            })
+
+    comparisons = []
+    if client_comparisons:
+        done = {action["canonical_action_id"].replace(":can:", ":exp:"): action for action in canonical_actions}
+        for expected in expected_actions:
+            actual = done.get(expected["expected_action_id"])
+            comparisons.append({
+                "expected_action_id": expected["expected_action_id"],
+                "canonical_action_id": actual["canonical_action_id"] if actual else None,
+                "outcome": "DONE_OK" if actual else "NOT_DONE",
+            })
+
+    end = start + timedelta(days=days)
+    return {
+        "session_metadata": {
+            "session_id": session_id,
+            "simulator_version_id": "CESFAM_BENCH",
+            "user_id": f"bench_{session_id}",
+            "start_time": start.isoformat(),
+            "end_time": end.isoformat(),
+        },
+        "explicit_decisions": explicit_decisions,
+        "expected_actions": expected_actions,
+        "mechanic_events": mechanic_events,
+        "canonical_actions": canonical_actions,
+        "comparisons": comparisons,
+        "process_log": process_log,
+        "player_actions_log": player_actions_log,
+        "question_log": question_log,
+        "final_state": {
+            "stakeholders": [
+                {"id": sid, "name": sid.replace("_", " ").title(), "role": sid, "trust": 50, "support": 50,
+                 "questions": questions[sid]}
+                for sid in stakeholder_ids
+            ],
+            "global": {"day": days, "timeSlot": "tarde", "budget": 1000, "reputation": 50, "projectProgress": 0},
+        },
+    }
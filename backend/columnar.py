@@ -0,0 +1,265 @@
+import argparse
+import csv
+import gzip
+import json
+import struct
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+
+from psycopg.rows import tuple_row
+
+from backend.main import close_pool, export_query, get_conn
+
+# Column-oriented export of the normalized tables for the analysis side.
+#
+# npy (default): one .npy file per column, uncompressed so it can be opened with
+#   numpy.load(path, mmap_mode="r"). Written with the stdlib (numpy is only needed to read):
+#   - int64   -> <col>.npy (int64) + <col>.null.npy (bool, True where NULL)
+#   - float64 -> <col>.npy (float64, NaN where NULL)
+#   - category-> <col>.codes.npy (int32, -1 where NULL) + <col>.dict.json (code -> string)
+#   - text    -> <col>.offsets.npy (int64, n + 1) + <col>.utf8 (concatenated bytes)
+#                + <col>.null.npy
+# csv: one single-column CSV per field (gzip with --gzip); categories are written as codes
+#   with the same <col>.dict.json, NULL is an empty field.
+# manifest.json lists row count, columns, kinds and files.
+COLUMNAR_TABLES = {
+    "mechanic_events": (
+        ("session_id", "category"),
+        ("event_id", "text"),
+        ("mechanic_id", "category"),
+        ("event_type", "category"),
+        ("timestamp", "int64"),
+        ("payload", "text"),
+    ),
+    "comparisons": (
+        ("session_id", "category"),
+        ("day", "int64"),
+        ("expected_action_id", "text"),
+        ("canonical_action_id", "text"),
+        ("outcome", "category"),
+        ("rule_id", "category"),
+        ("deviation", "text"),
+    ),
+    "process_logs": (
+        ("session_id", "category"),
+        ("node_id", "category"),
+        ("start_time", "float64"),
+        ("end_time", "float64"),
+        ("total_duration", "float64"),
+        ("final_choice", "category"),
+        ("events", "text"),
+    ),
+    "explicit_decisions": (
+        ("session_id", "category"),
+        ("node_id", "category"),
+        ("option_id", "category"),
+        ("option_text", "text"),
+        ("stakeholder", "category"),
+        ("day", "int64"),
+        ("time_slot", "category"),
+        ("consequences", "text"),
+    ),
+}
+
+NPY_HEADER_LEN = 128
+_ENDIAN = "<" if sys.byteorder == "little" else ">"
+
+
+class _NpyFile:
+    # .npy written incrementally: a fixed-size header is reserved and rewritten with the final
+    # row count on close.
+    def __init__(self, path: Path, descr: str):
+        self.path = path
+        self.descr = descr
+        self.count = 0
+        self.fh = open(path, "wb")
+        self.fh.write(self._header(0))
+
+    def _header(self, count: int) -> bytes:
+        header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (self.descr, count)
+        header = header.ljust(NPY_HEADER_LEN - 10 - 1) + "\n"
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+    def write(self, values: array):
+        values.tofile(self.fh)
+        self.count += len(values)
+
+    def close(self):
+        self.fh.seek(0)
+        self.fh.write(self._header(self.count))
+        self.fh.close()
+
+
+class _NpyColumn:
+    def __init__(self, out_dir: Path, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.files = {}
+        if kind == "int64":
+            self.values = self._open(out_dir, "values", f"{name}.npy", f"{_ENDIAN}i8")
+            self.nulls = self._open(out_dir, "nulls", f"{name}.null.npy", "|b1")
+        elif kind == "float64":
+            self.values = self._open(out_dir, "values", f"{name}.npy", f"{_ENDIAN}f8")
+        elif kind == "category":
+            self.values = self._open(out_dir, "codes", f"{name}.codes.npy", f"{_ENDIAN}i4")
+            self.dict_path = out_dir / f"{name}.dict.json"
+            self.codes = {}
+        else:
+            self.offsets = self._open(out_dir, "offsets", f"{name}.offsets.npy", f"{_ENDIAN}i8")
+            self.nulls = self._open(out_dir, "nulls", f"{name}.null.npy", "|b1")
+            self.blob = open(out_dir / f"{name}.utf8", "wb")
+            self.position = 0
+            self.offsets.write(array("q", [0]))
+            self.files["data"] = f"{name}.utf8"
+
+    def _open(self, out_dir: Path, role: str, filename: str, descr: str) -> _NpyFile:
+        self.files[role] = filename
+        return _NpyFile(out_dir / filename, descr)
+
+    def write(self, column: list):
+        if self.kind == "int64":
+            self.values.write(array("q", [0 if v is None else int(v) for v in column]))
+            self.nulls.write(array("b", [v is None for v in column]))
+        elif self.kind == "float64":
+            self.values.write(array("d", [float("nan") if v is None else float(v) for v in column]))
+        elif self.kind == "category":
+            codes = self.codes
+            self.values.write(array("i", [-1 if v is None else codes.setdefault(v, len(codes)) for v in column]))
+        else:
+            offsets = array("q")
+            chunks = []
+            for v in column:
+                if v is not None:
+                    data = str(v).encode("utf-8")
+                    chunks.append(data)
+                    self.position += len(data)
+                offsets.append(self.position)
+            self.blob.write(b"".join(chunks))
+            self.offsets.write(offsets)
+            self.nulls.write(array("b", [v is None for v in column]))
+
+    def close(self):
+        for attr in ("values", "nulls", "offsets"):
+            if hasattr(self, attr):
+                getattr(self, attr).close()
+        if self.kind == "category":
+            with open(self.dict_path, "w", encoding="utf-8") as fh:
+                json.dump(list(self.codes), fh, ensure_ascii=False)
+            self.files["dict"] = self.dict_path.name
+        elif self.kind == "text":
+            self.blob.close()
+
+
+class _CsvColumn:
+    def __init__(self, out_dir: Path, name: str, kind: str, compress: bool):
+        self.name = name
+        self.kind = kind
+        filename = f"{name}.csv.gz" if compress else f"{name}.csv"
+        self.fh = gzip.open(out_dir / filename, "wt", encoding="utf-8", newline="") if compress else open(
+            out_dir / filename, "w", encoding="utf-8", newline=""
+        )
+        self.writer = csv.writer(self.fh)
+        self.writer.writerow([name])
+        self.files = {"values": filename}
+        if kind == "category":
+            self.codes = {}
+            self.dict_path = out_dir / f"{name}.dict.json"
+
+    def write(self, column: list):
+        if self.kind == "category":
+            codes = self.codes
+            column = [None if v is None else codes.setdefault(v, len(codes)) for v in column]
+        self.writer.writerows([["" if v is None else v] for v in column])
+
+    def close(self):
+        self.fh.close()
+        if self.kind == "category":
+            with open(self.dict_path, "w", encoding="utf-8") as fh:
+                json.dump(list(self.codes), fh, ensure_ascii=False)
+            self.files["dict"] = self.dict_path.name
+
+
+def export_table(conn, table: str, out_dir: Path, fmt: str = "npy", compress: bool = False,
+                 chunk_size: int = 50_000, progress: bool = True, **filters) -> dict:
+    spec = COLUMNAR_TABLES[table]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if fmt == "npy":
+        columns = [_NpyColumn(out_dir, name, kind) for name, kind in spec]
+    else:
+        columns = [_CsvColumn(out_dir, name, kind, compress) for name, kind in spec]
+
+    sql, params = export_query(table, columns=[name for name, _ in spec], **filters)
+    rows_total = 0
+    started = time.perf_counter()
+    try:
+        with conn.cursor(name=f"columnar_{table}", row_factory=tuple_row) as cur:
+            cur.itersize = chunk_size
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for column, values in zip(columns, zip(*rows)):
+                    column.write(list(values))
+                rows_total += len(rows)
+                if progress:
+                    print(f"{table}: {rows_total} rows", file=sys.stderr)
+        conn.rollback()
+    finally:
+        for column in columns:
+            column.close()
+
+    manifest = {
+        "table": table,
+        "format": fmt,
+        "rows": rows_total,
+        "filters": {k: v for k, v in filters.items() if v is not None},
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "seconds": round(time.perf_counter() - started, 3),
+        "columns": [{"name": c.name, "kind": c.kind, "files": c.files} for c in columns],
+    }
+    with open(out_dir / "manifest.json", "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export normalized tables as per-column files (npy or CSV).")
+    parser.add_argument("tables", nargs="*", help=f"Tables to export (default: all of {', '.join(COLUMNAR_TABLES)})")
+    parser.add_argument("-o", "--output", required=True, help="Output directory (one subdirectory per table)")
+    parser.add_argument("--format", choices=["npy", "csv"], default="npy")
+    parser.add_argument("--gzip", action="store_true", help="gzip the CSV column files")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Rows fetched per round trip")
+    parser.add_argument("--version-id")
+    parser.add_argument("--user-id")
+    parser.add_argument("--created-from", help="sessions.created_at >= this ISO timestamp")
+    parser.add_argument("--created-to", help="sessions.created_at < this ISO timestamp")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    unknown = [t for t in args.tables if t not in COLUMNAR_TABLES]
+    if unknown:
+        parser.error(f"unknown table(s): {', '.join(unknown)}")
+    filters = {
+        "version_id": args.version_id,
+        "user_id": args.user_id,
+        "created_from": args.created_from,
+        "created_to": args.created_to,
+    }
+    try:
+        with get_conn() as conn:
+            for table in args.tables or list(COLUMNAR_TABLES):
+                manifest = export_table(
+                    conn, table, Path(args.output) / table, args.format, args.gzip,
+                    max(1, args.chunk_size), not args.quiet, **filters,
+                )
+                print(f"Exported {table}: {manifest['rows']} rows in {manifest['seconds']}s.")
+    finally:
+        close_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
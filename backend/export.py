@@ -0,0 +1,51 @@
+import argparse
+import sys
+
+from backend.main import EXPORT_KINDS, close_pool, get_conn, iter_export, iter_gzip
+
+
+def export(kind: str, output: str | None, compress: bool, batch_size: int, **filters) -> int:
+    out = open(output, "wb") if output and output != "-" else sys.stdout.buffer
+    written = 0
+    try:
+        with get_conn() as conn:
+            chunks = iter_export(conn, kind, batch_size=batch_size, **filters)
+            for chunk in iter_gzip(chunks) if compress else chunks:
+                out.write(chunk)
+                written += len(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"Exported {kind}: {written} bytes{' (gzip)' if compress else ''}.", file=sys.stderr)
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Stream sessions or a normalized table as NDJSON.")
+    parser.add_argument("kind", choices=EXPORT_KINDS)
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser.add_argument("--version-id")
+    parser.add_argument("--user-id")
+    parser.add_argument("--created-from", help="sessions.created_at >= this ISO timestamp")
+    parser.add_argument("--created-to", help="sessions.created_at < this ISO timestamp")
+    parser.add_argument("--batch-size", type=int, default=2000, help="Rows fetched per round trip")
+    args = parser.parse_args()
+    compress = args.gzip or bool(args.output and args.output.endswith(".gz"))
+    try:
+        return export(
+            args.kind,
+            args.output,
+            compress,
+            max(1, args.batch_size),
+            version_id=args.version_id,
+            user_id=args.user_id,
+            created_from=args.created_from,
+            created_to=args.created_to,
+        )
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
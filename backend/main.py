@@ -1,30 +1,464 @@
+import asyncio
+import base64
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timezone
+from functools import lru_cache
+import hashlib
 import json
+import logging
 import os
 from pathlib import Path
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
 
 import psycopg
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from psycopg import sql
 from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for PAYLOAD_CODEC=zstd
+    zstandard = None
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(BASE_DIR / ".env.local")
 load_dotenv(BASE_DIR / ".env")
 
+# postgres (default) or sqlite: an embedded database file for single-node / offline deployments
+# (SQLITE_PATH), pushed to Postgres later with python -m backend.sync_local.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").strip().lower()
+if STORAGE_BACKEND not in ("postgres", "sqlite"):
+    raise RuntimeError(f"STORAGE_BACKEND must be postgres or sqlite, got {STORAGE_BACKEND!r}")
+SQLITE_PATH = os.getenv("SQLITE_PATH") or str(BASE_DIR / "simulator.sqlite3")
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
+if not DATABASE_URL and STORAGE_BACKEND == "postgres":
     raise RuntimeError("DATABASE_URL is required. Set it to your Postgres connection string.")
 
 
-def get_conn():
-    conn = psycopg.connect(DATABASE_URL)
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_MAX_WAITING = int(os.getenv("DB_POOL_MAX_WAITING", "0"))
+# DB_ASYNC=1 serves the session data path from the event loop with async connections;
+# DB_ASYNC=0 runs the same steps on sync connections in the threadpool.
+DB_ASYNC = os.getenv("DB_ASYNC", "1").strip().lower() not in ("0", "false", "no", "off")
+# sessions.payload_bytes codec: zlib (default), zstd (needs the zstandard package) or identity.
+PAYLOAD_CODEC = os.getenv("PAYLOAD_CODEC", "zlib").strip().lower()
+PAYLOAD_COMPRESSION_LEVEL = int(os.getenv("PAYLOAD_COMPRESSION_LEVEL") or (3 if PAYLOAD_CODEC == "zstd" else 6))
+if PAYLOAD_CODEC not in ("zlib", "zstd", "identity"):
+    raise RuntimeError(f"PAYLOAD_CODEC must be zlib, zstd or identity, got {PAYLOAD_CODEC!r}")
+if PAYLOAD_CODEC == "zstd" and zstandard is None:
+    raise RuntimeError("PAYLOAD_CODEC=zstd requires the zstandard package")
+# Normalized documents kept in memory, keyed by (session_id, revision).
+NORMALIZED_CACHE_SIZE = int(os.getenv("NORMALIZED_CACHE_SIZE", "128"))
+# Max (session_id, day) items per POST /sessions/resolve_day_effects.
+MAX_RESOLVE_BATCH = int(os.getenv("RESOLVE_BATCH_MAX_ITEMS", "1000"))
+# INGEST_MODE=queue: POST /sessions stores the payload in ingest_queue and answers 202; a
+# background worker normalizes it (the newest upload per session wins). sync = inline (default).
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").strip().lower()
+if INGEST_MODE not in ("sync", "queue"):
+    raise RuntimeError(f"INGEST_MODE must be sync or queue, got {INGEST_MODE!r}")
+if INGEST_MODE == "queue" and STORAGE_BACKEND != "postgres":
+    raise RuntimeError("INGEST_MODE=queue requires STORAGE_BACKEND=postgres")
+INGEST_BATCH = int(os.getenv("INGEST_BATCH", "8"))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1"))
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "300"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+INGEST_WAIT_TIMEOUT = float(os.getenv("INGEST_WAIT_TIMEOUT", "30"))
+# Analytics deltas folded into the rollup totals per transaction, and the applier's idle interval.
+ROLLUP_APPLY_BATCH = int(os.getenv("ROLLUP_APPLY_BATCH", "5000"))
+ROLLUP_APPLY_INTERVAL = float(os.getenv("ROLLUP_APPLY_INTERVAL", "1"))
+# How long an Idempotency-Key on POST /sessions replays its first response.
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+# In-process metrics for GET /metrics; METRICS_ENABLED=0 turns recording off.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+
+_pool: ConnectionPool | None = None
+_async_pool: AsyncConnectionPool | None = None
+
+
+def _configure_conn(conn):
     conn.row_factory = dict_row
-    return conn
 
 
-def create_schema(conn):
+async def _configure_async_conn(conn):
+    conn.row_factory = dict_row
+
+
+def _require_postgres():
+    if STORAGE_BACKEND != "postgres":
+        raise HTTPException(status_code=501, detail=f"not available with STORAGE_BACKEND={STORAGE_BACKEND}")
+
+
+def open_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        _require_postgres()
+        _pool = ConnectionPool(
+            DATABASE_URL,
+            min_size=POOL_MIN_SIZE,
+            max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+            max_idle=POOL_MAX_IDLE,
+            timeout=POOL_TIMEOUT,
+            max_waiting=POOL_MAX_WAITING,
+            configure=_configure_conn,
+            check=ConnectionPool.check_connection,
+            name="simulator",
+            open=False,
+        )
+        _pool.open(wait=True, timeout=POOL_TIMEOUT)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def get_conn():
+    # Context manager: the connection goes back to the pool when the `with` block exits
+    # (commit on success, rollback on error).
+    return open_pool().connection()
+
+
+async def open_async_pool() -> AsyncConnectionPool:
+    global _async_pool
+    if _async_pool is None:
+        _require_postgres()
+        _async_pool = AsyncConnectionPool(
+            DATABASE_URL,
+            min_size=POOL_MIN_SIZE,
+            max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+            max_idle=POOL_MAX_IDLE,
+            timeout=POOL_TIMEOUT,
+            max_waiting=POOL_MAX_WAITING,
+            configure=_configure_async_conn,
+            check=AsyncConnectionPool.check_connection,
+            name="simulator-async",
+            open=False,
+        )
+        await _async_pool.open(wait=True, timeout=POOL_TIMEOUT)
+    return _async_pool
+
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+def _stats_for(pool) -> dict:
+    if pool is None:
+        return {"open": False}
+    stats = pool.get_stats()
+    stats.update({
+        "open": True,
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "max_idle": pool.max_idle,
+        "timeout": pool.timeout,
+    })
+    return stats
+
+
+def pool_stats() -> dict:
+    stats = _stats_for(_pool)
+    stats["async"] = _stats_for(_async_pool)
+    return stats
+
+
+# ---- Metrics (GET /metrics, Prometheus text format) ----
+# Recording is a dict update under an uncontended lock; nothing is aggregated or formatted
+# until /metrics is scraped. Gauges (pools, caches) are read at scrape time only.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Request latency by route template, method and status.", LATENCY_BUCKETS),
+    "http_request_size_bytes": ("histogram", "Request body size (Content-Length) by route template.", SIZE_BUCKETS),
+    "http_response_size_bytes": ("histogram", "Response body size by route template.", SIZE_BUCKETS),
+    "stage_duration_seconds": ("histogram", "Wall time of each stage of normalize and resolve, DB work included.", LATENCY_BUCKETS),
+    "session_payload_bytes": ("histogram", "Uploaded session documents: raw JSON and stored (compressed) size.", SIZE_BUCKETS),
+    "db_round_trips_total": ("counter", "DB operations issued by the steps drivers (executemany/COPY count once)."),
+    "db_rows_written_total": ("counter", "Rows written by the data path per table and operation."),
+    "ingest_jobs_total": ("counter", "Queued uploads: enqueued, coalesced into a pending one, normalized, failed or lease_lost."),
+    "background_errors_total": ("counter", "Unexpected errors caught by a background worker loop, by worker."),
+    "session_uploads_skipped_total": ("counter", "POST /sessions answered without writing: same content hash or replayed idempotency key."),
+    "rollup_deltas_applied_total": ("counter", "Analytics deltas folded into the rollup totals by the applier."),
+}
+
+_metrics_lock = threading.Lock()
+_metric_counters = {}
+_metric_histograms = {}
+
+
+def metric_inc(name: str, labels: tuple = (), value: float = 1):
+    if not METRICS_ENABLED or not value:
+        return
+    key = (name, labels)
+    with _metrics_lock:
+        _metric_counters[key] = _metric_counters.get(key, 0) + value
+
+
+def metric_observe(name: str, labels: tuple, value: float):
+    if not METRICS_ENABLED:
+        return
+    buckets = METRICS[name][2]
+    index = bisect_left(buckets, value)
+    key = (name, labels)
+    with _metrics_lock:
+        counts = _metric_histograms.get(key)
+        if counts is None:
+            # one slot per bucket, +Inf, then the running sum
+            counts = _metric_histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[index] += 1
+        counts[-1] += value
+
+
+@contextmanager
+def metric_stage(path: str, stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric_observe("stage_duration_seconds", (("path", path), ("stage", stage)), time.perf_counter() - started)
+
+
+def _metric_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{k}="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _metric_gauges() -> list:
+    gauges = []
+    for pool_name, pool in (("sync", _pool), ("async", _async_pool)):
+        stats = pool.get_stats() if pool is not None else {}
+        labels = (("pool", pool_name),)
+        gauges.append(("db_pool_size", "Connections in the pool (in use or idle).", labels, stats.get("pool_size", 0)))
+        gauges.append(("db_pool_available", "Idle connections in the pool.", labels, stats.get("pool_available", 0)))
+        gauges.append(("db_pool_requests_waiting", "Callers queued for a connection.", labels, stats.get("requests_waiting", 0)))
+    gauges.append(("normalized_cache_entries", "Documents in the normalized view LRU.", (), len(_normalized_cache)))
+    return gauges
+
+
+def render_metrics() -> str:
+    with _metrics_lock:
+        counters = dict(_metric_counters)
+        histograms = {key: list(counts) for key, counts in _metric_histograms.items()}
+    lines = []
+    for name, (kind, help_text, *rest) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_metric_labels(labels)} {value}")
+            continue
+        buckets = rest[0]
+        for (metric, labels), counts in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_metric_labels((*labels, ('le', bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_metric_labels(labels)} {counts[-1]}")
+            lines.append(f"{name}_count{_metric_labels(labels)} {cumulative}")
+    seen = set()
+    for name, help_text, labels, value in _metric_gauges():
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_metric_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    # Plain ASGI (no BaseHTTPMiddleware) so streaming responses are not buffered. Routes are
+    # labelled by their template (/sessions/{session_id}), unmatched paths as "unmatched".
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        response = {"status": 500, "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            route_labels = (("route", template),)
+            metric_observe(
+                "http_request_duration_seconds",
+                (*route_labels, ("method", scope["method"]), ("status", response["status"])),
+                time.perf_counter() - started,
+            )
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    metric_observe("http_request_size_bytes", route_labels, int(value or 0))
+                    break
+            metric_observe("http_response_size_bytes", route_labels, response["size"])
+
+
+# ---- DB steps (sync/async) ----
+# Data-path logic is written as generators that yield DB operations and receive their
+# results (`row = yield _fetchone(...)`, `_exec` sends back the rowcount), so the same
+# code runs on a sync connection (threadpool, rebuild_db.py) and on an async connection
+# from the event loop. CPU-heavy pure work (row building, hashing, compression, matching) is
+# yielded as `_compute(fn, *args)` so the async driver runs it in the threadpool instead of
+# blocking the loop between round trips.
+def _exec(sql, params=None):
+    return ("exec", sql, params)
+
+
+def _fetchone(sql, params=None):
+    return ("one", sql, params)
+
+
+def _fetchall(sql, params=None):
+    return ("all", sql, params)
+
+
+def _executemany(sql, params_seq):
+    return ("many", sql, params_seq)
+
+
+def _copy(sql, rows):
+    return ("copy", sql, rows)
+
+
+def _commit():
+    return ("commit", None, None)
+
+
+def _compute(fn, *args):
+    return ("compute", fn, args)
+
+
+def run_sync(conn, steps):
+    result = None
+    while True:
+        try:
+            kind, sql, params = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        if kind == "compute":
+            result = sql(*params)
+            continue
+        result = None
+        metric_inc("db_round_trips_total", (("driver", "sync"), ("op", kind)))
+        if kind == "commit":
+            conn.commit()
+            continue
+        if kind == "many":
+            if params:
+                conn.cursor().executemany(sql, params)
+            continue
+        if kind == "copy":
+            if params:
+                with conn.cursor().copy(sql) as copy:
+                    for row in params:
+                        copy.write_row(row)
+            continue
+        cur = conn.execute(sql, params)
+        if kind == "one":
+            result = cur.fetchone()
+        elif kind == "all":
+            result = cur.fetchall()
+        else:
+            result = cur.rowcount
+
+
+async def run_async(aconn, steps):
+    result = None
+    while True:
+        try:
+            kind, sql, params = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        if kind == "compute":
+            # asyncio.to_thread, not run_in_threadpool: the anyio call shields the awaiting task
+            # and would swallow the ingest worker's cancellation at shutdown
+            result = await asyncio.to_thread(sql, *params)
+            continue
+        result = None
+        metric_inc("db_round_trips_total", (("driver", "async"), ("op", kind)))
+        if kind == "commit":
+            await aconn.commit()
+            continue
+        if kind == "many":
+            if params:
+                await aconn.cursor().executemany(sql, params)
+            continue
+        if kind == "copy":
+            if params:
+                async with aconn.cursor().copy(sql) as copy:
+                    for row in params:
+                        await copy.write_row(row)
+            continue
+        cur = await aconn.execute(sql, params)
+        if kind == "one":
+            result = await cur.fetchone()
+        elif kind == "all":
+            result = await cur.fetchall()
+        else:
+            result = cur.rowcount
+
+
+def _run_steps_sync(steps):
+    with get_conn() as conn:
+        return run_sync(conn, steps)
+
+
+async def run_db(steps):
+    if DB_ASYNC:
+        pool = await open_async_pool()
+        async with pool.connection() as aconn:
+            return await run_async(aconn, steps)
+    return await run_in_threadpool(_run_steps_sync, steps)
+
+
+# ---- Schema migrations ----
+# Ordered, idempotent steps recorded in schema_version. Warm starts only read the
+# current version; pending steps run under an advisory lock so a single worker applies them.
+SCHEMA_LOCK_KEY = 5_117_001
+ROLLUP_LOCK_KEY = 5_117_002
+
+
+def _migration_base_schema(conn):
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -240,66 +674,6 @@ def create_schema(conn):
         )
         """
     )
-    # Drop legacy FKs, clean orphans, then add FK with ON DELETE SET NULL (so Supabase shows relationships)
-    conn.execute("ALTER TABLE comparisons DROP CONSTRAINT IF EXISTS comparisons_expected_action_id_fkey CASCADE")
-    conn.execute("ALTER TABLE comparisons DROP CONSTRAINT IF EXISTS comparisons_canonical_action_id_fkey CASCADE")
-    conn.execute(
-        """
-        UPDATE comparisons c
-        SET expected_action_id = NULL
-        WHERE expected_action_id IS NOT NULL
-          AND NOT EXISTS (
-                SELECT 1 FROM expected_actions ea
-                WHERE ea.expected_action_id = c.expected_action_id
-          )
-        """
-    )
-    conn.execute(
-        """
-        UPDATE comparisons c
-        SET canonical_action_id = NULL
-        WHERE canonical_action_id IS NOT NULL
-          AND NOT EXISTS (
-                SELECT 1 FROM canonical_actions ca
-                WHERE ca.canonical_action_id = c.canonical_action_id
-          )
-        """
-    )
-    # Recreate FKs with ON DELETE SET NULL (guarded to avoid duplicate creation)
-    conn.execute(
-        """
-        DO $$
-        BEGIN
-            IF NOT EXISTS (
-                SELECT 1 FROM pg_constraint
-                WHERE conname = 'comparisons_expected_action_id_fkey'
-            ) THEN
-                ALTER TABLE comparisons
-                ADD CONSTRAINT comparisons_expected_action_id_fkey
-                FOREIGN KEY (expected_action_id)
-                REFERENCES expected_actions(expected_action_id)
-                ON DELETE SET NULL;
-            END IF;
-        END$$;
-        """
-    )
-    conn.execute(
-        """
-        DO $$
-        BEGIN
-            IF NOT EXISTS (
-                SELECT 1 FROM pg_constraint
-                WHERE conname = 'comparisons_canonical_action_id_fkey'
-            ) THEN
-                ALTER TABLE comparisons
-                ADD CONSTRAINT comparisons_canonical_action_id_fkey
-                FOREIGN KEY (canonical_action_id)
-                REFERENCES canonical_actions(canonical_action_id)
-                ON DELETE SET NULL;
-            END IF;
-        END$$;
-        """
-    )
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS daily_effects (
@@ -398,43 +772,669 @@ def create_schema(conn):
     conn.execute("CREATE INDEX IF NOT EXISTS idx_decision_nodes_escenario ON decision_nodes(escenario_id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_scenarios_version ON scenarios(version_id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_effects_session_day ON daily_effects(session_id, day)")
-    conn.commit()
 
 
-def init_db():
-    with get_conn() as conn:
-        create_schema(conn)
+def _migration_comparisons_fk_set_null(conn):
+    # Drop legacy FKs, clean orphans, then add FK with ON DELETE SET NULL (so Supabase shows relationships)
+    conn.execute("ALTER TABLE comparisons DROP CONSTRAINT IF EXISTS comparisons_expected_action_id_fkey CASCADE")
+    conn.execute("ALTER TABLE comparisons DROP CONSTRAINT IF EXISTS comparisons_canonical_action_id_fkey CASCADE")
+    conn.execute(
+        """
+        UPDATE comparisons c
+        SET expected_action_id = NULL
+        WHERE expected_action_id IS NOT NULL
+          AND NOT EXISTS (
+                SELECT 1 FROM expected_actions ea
+                WHERE ea.expected_action_id = c.expected_action_id
+          )
+        """
+    )
+    conn.execute(
+        """
+        UPDATE comparisons c
+        SET canonical_action_id = NULL
+        WHERE canonical_action_id IS NOT NULL
+          AND NOT EXISTS (
+                SELECT 1 FROM canonical_actions ca
+                WHERE ca.canonical_action_id = c.canonical_action_id
+          )
+        """
+    )
+    # Recreate FKs with ON DELETE SET NULL (guarded to avoid duplicate creation)
+    conn.execute(
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conname = 'comparisons_expected_action_id_fkey'
+            ) THEN
+                ALTER TABLE comparisons
+                ADD CONSTRAINT comparisons_expected_action_id_fkey
+                FOREIGN KEY (expected_action_id)
+                REFERENCES expected_actions(expected_action_id)
+                ON DELETE SET NULL;
+            END IF;
+        END$$;
+        """
+    )
+    conn.execute(
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conname = 'comparisons_canonical_action_id_fkey'
+            ) THEN
+                ALTER TABLE comparisons
+                ADD CONSTRAINT comparisons_canonical_action_id_fkey
+                FOREIGN KEY (canonical_action_id)
+                REFERENCES canonical_actions(canonical_action_id)
+                ON DELETE SET NULL;
+            END IF;
+        END$$;
+        """
+    )
 
 
-def _get_allowed_origins():
-    raw = os.getenv("ALLOWED_ORIGINS")
-    if not raw:
-        return ["*"]
-    return [origin.strip().rstrip("/") for origin in raw.split(",") if origin.strip()]
+def _migration_ingest_cursor(conn):
+    conn.execute(
+        """
+        ALTER TABLE sessions
+        ADD COLUMN IF NOT EXISTS ingest_cursor TEXT
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_payload_deltas (
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            delta TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (session_id, seq),
+            FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+        )
+        """
+    )
 
 
-app = FastAPI(title="Simulator Backend", version="0.3.0")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=_get_allowed_origins(),
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+def _migration_row_hashes(conn):
+    for table in ("explicit_decisions", "comparisons", "process_logs", "player_actions_log"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_key TEXT")
+    for table in (
+        "explicit_decisions",
+        "expected_actions",
+        "canonical_actions",
+        "mechanic_events",
+        "comparisons",
+        "process_logs",
+        "player_actions_log",
+        "session_state",
+        "session_stakeholders",
+    ):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_hash TEXT")
+
+
+# Migrations carry their own copy of the SQL and row logic they need (never the live helpers),
+# so a versioned step does the same thing on a fresh database however the application changes.
+_M5_DAY_NAMES = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+    "lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6,
+}
+# expected_actions columns as of migration 5, in row_hash order (day_index goes last)
+_M5_EXPECTED_COLUMNS = (
+    "source_node_id", "source_option_id", "action_type", "target_ref", "constraints", "rule_id",
+    "created_at", "mechanic_id", "effects",
 )
 
 
-@app.on_event("startup")
-def startup_event():
-    init_db()
+def _m5_day_index(constraints):
+    if isinstance(constraints, str):
+        try:
+            constraints = json.loads(constraints)
+        except json.JSONDecodeError:
+            return None
+    value = constraints.get("day") if isinstance(constraints, dict) else None
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return (value - 1) % 7 if value > 0 else None
+    text = unicodedata.normalize("NFKD", str(value))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower().strip()
+    if text.isdigit():
+        return (int(text) - 1) % 7 if int(text) > 0 else None
+    return _M5_DAY_NAMES.get(text)
 
 
-@app.get("/health")
-def health():
-    return {"ok": True}
+def _m5_row_hash(values) -> str:
+    encoded = json.dumps(values, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
 
 
-def _json_dump(value):
-    return json.dumps(value, ensure_ascii=False) if value is not None else None
+def _migration_day_columns(conn):
+    # Day resolved in Python (same parsing the rules use) so resolve_day_effects can filter
+    # expected actions by day in SQL. Backfilled rows get their row_hash recomputed with the new
+    # column. Canonical actions are not filtered by their own day, so they get no day columns
+    # (databases that got them from an earlier version of this step lose them in migration 16).
+    # Read through a server-side cursor and written per batch.
+    conn.execute("ALTER TABLE expected_actions ADD COLUMN IF NOT EXISTS day_index SMALLINT")
+    with conn.cursor(name="migration_day_columns") as rows:
+        rows.itersize = 2000
+        rows.execute(f"SELECT expected_action_id, {', '.join(_M5_EXPECTED_COLUMNS)}, row_hash FROM expected_actions")
+        while True:
+            batch = rows.fetchmany(2000)
+            if not batch:
+                break
+            updates = []
+            for r in batch:
+                day_index = _m5_day_index(r["constraints"])
+                row_hash = _m5_row_hash((*[r[c] for c in _M5_EXPECTED_COLUMNS], day_index)) if r["row_hash"] else None
+                updates.append((day_index, row_hash, r["expected_action_id"]))
+            with conn.cursor() as cur:
+                cur.executemany(
+                    "UPDATE expected_actions SET day_index = %s, row_hash = %s WHERE expected_action_id = %s", updates
+                )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expected_session_day ON expected_actions(session_id, day_index)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_canonical_session_match ON canonical_actions(session_id, action_type, target_ref)"
+    )
+
+
+def _migration_comparisons_day(conn):
+    # Day of the resolve_day_effects run that produced the row (NULL for payload comparisons),
+    # so a forced re-resolve can replace that day's comparisons.
+    conn.execute("ALTER TABLE comparisons ADD COLUMN IF NOT EXISTS day INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comparisons_session_day ON comparisons(session_id, day)")
+
+
+def _migration_normalize_checkpoints(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS normalize_runs (
+            run_id TEXT PRIMARY KEY,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            chunk_size INTEGER
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS normalize_checkpoints (
+            run_id TEXT NOT NULL REFERENCES normalize_runs(run_id) ON DELETE CASCADE,
+            session_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            finished_at TEXT NOT NULL,
+            PRIMARY KEY (run_id, session_id)
+        )
+        """
+    )
+
+
+# Migration 8 compresses with this fixed codec and level (the defaults it shipped with), not
+# with PAYLOAD_CODEC: stored rows are tagged with their codec, so later writes may use another.
+_M8_CODEC = "zlib"
+_M8_LEVEL = 6
+
+
+def _migration_compressed_payloads(conn):
+    # payload TEXT -> payload_bytes BYTEA (zlib). The TEXT column stays (nullable) so rows
+    # written by an older server are still readable; it is cleared here.
+    conn.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS payload_bytes BYTEA")
+    conn.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS payload_codec TEXT")
+    conn.execute("ALTER TABLE sessions ALTER COLUMN payload DROP NOT NULL")
+    while True:
+        rows = conn.execute(
+            "SELECT session_id, payload FROM sessions WHERE payload_bytes IS NULL AND payload IS NOT NULL LIMIT 500"
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for r in rows:
+            updates.append((zlib.compress(r["payload"].encode("utf-8"), _M8_LEVEL), _M8_CODEC, r["session_id"]))
+        with conn.cursor() as cur:
+            cur.executemany(
+                "UPDATE sessions SET payload_bytes = %s, payload_codec = %s, payload = NULL WHERE session_id = %s",
+                updates,
+            )
+        # batches commit on their own (still under the migration lock) to keep transactions short
+        conn.commit()
+
+
+def _migration_session_revisions(conn):
+    # Global sequence, so a session's revision is unique and MAX(revision) changes on any write.
+    conn.execute("CREATE SEQUENCE IF NOT EXISTS session_revision_seq")
+    conn.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS revision BIGINT")
+    conn.execute("UPDATE sessions SET revision = nextval('session_revision_seq') WHERE revision IS NULL")
+    conn.execute("ALTER TABLE sessions ALTER COLUMN revision SET DEFAULT nextval('session_revision_seq')")
+    conn.execute("ALTER TABLE sessions ALTER COLUMN revision SET NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_revision ON sessions(revision)")
+
+
+def _migration_session_listing_indexes(conn):
+    # Keyset order of GET /sessions and /sessions/latest, overall and under each equality filter.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions(created_at DESC, session_id DESC)")
+    for column in ("version_id", "user_id", "estado"):
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_sessions_{column}_created "
+            f"ON sessions({column}, created_at DESC, session_id DESC)"
+        )
+
+
+def _migration_daily_effects_fingerprint(conn):
+    # Rows cached before fingerprints existed have NULL and are recomputed on their next request.
+    conn.execute("ALTER TABLE daily_effects ADD COLUMN IF NOT EXISTS fingerprint TEXT")
+
+
+def _migration_analytics_rollups(conn):
+    # Per-session contributions plus their running totals (see "Said vs did analytics").
+    # No FK to sessions: a contribution must outlive a manually deleted session until
+    # rebuild_analytics() runs, or the totals would drift without it.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_comparison_counts (
+            session_id TEXT NOT NULL,
+            version_id TEXT NOT NULL,
+            rule_id TEXT NOT NULL,
+            target_ref TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            outcome TEXT NOT NULL,
+            n BIGINT NOT NULL,
+            PRIMARY KEY (session_id, version_id, rule_id, target_ref, day, outcome)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS comparison_rollup (
+            version_id TEXT NOT NULL,
+            rule_id TEXT NOT NULL,
+            target_ref TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            outcome TEXT NOT NULL,
+            n BIGINT NOT NULL,
+            PRIMARY KEY (version_id, rule_id, target_ref, day, outcome)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_decision_latency (
+            session_id TEXT NOT NULL,
+            version_id TEXT NOT NULL,
+            node_id TEXT NOT NULL,
+            n BIGINT NOT NULL,
+            total DOUBLE PRECISION NOT NULL,
+            total_sq DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (session_id, version_id, node_id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS decision_latency_rollup (
+            version_id TEXT NOT NULL,
+            node_id TEXT NOT NULL,
+            n BIGINT NOT NULL,
+            total DOUBLE PRECISION NOT NULL,
+            total_sq DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (version_id, node_id)
+        )
+        """
+    )
+    # backfill: every session's contribution, then the totals over them
+    conn.execute(
+        "TRUNCATE session_comparison_counts, comparison_rollup, session_decision_latency, decision_latency_rollup"
+    )
+    conn.execute(
+        """
+        INSERT INTO session_comparison_counts (session_id, version_id, rule_id, target_ref, day, outcome, n)
+        SELECT c.session_id, COALESCE(s.version_id, ''), COALESCE(c.rule_id, e.rule_id, ''),
+               COALESCE(e.target_ref, ''), COALESCE(c.day, 0), COALESCE(c.outcome, ''), COUNT(*)
+        FROM comparisons c
+        JOIN sessions s ON s.session_id = c.session_id
+        LEFT JOIN expected_actions e ON e.expected_action_id = c.expected_action_id
+        GROUP BY 1, 2, 3, 4, 5, 6
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO comparison_rollup (version_id, rule_id, target_ref, day, outcome, n)
+        SELECT version_id, rule_id, target_ref, day, outcome, SUM(n) FROM session_comparison_counts
+        GROUP BY 1, 2, 3, 4, 5
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO session_decision_latency (session_id, version_id, node_id, n, total, total_sq)
+        SELECT p.session_id, COALESCE(s.version_id, ''), COALESCE(p.node_id, ''), COUNT(*),
+               SUM(p.total_duration), SUM(p.total_duration * p.total_duration)
+        FROM process_logs p
+        JOIN sessions s ON s.session_id = p.session_id
+        WHERE p.total_duration IS NOT NULL
+        GROUP BY 1, 2, 3
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO decision_latency_rollup (version_id, node_id, n, total, total_sq)
+        SELECT version_id, node_id, SUM(n), SUM(total), SUM(total_sq) FROM session_decision_latency
+        GROUP BY 1, 2
+        """
+    )
+
+
+def _migration_session_trajectory(conn):
+    # Cumulative effect of resolved days (see "Session trajectories"); rows go away with their
+    # daily_effects row, e.g. when a full upload clears the session's days.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_trajectory (
+            session_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            entity TEXT NOT NULL,
+            attribute TEXT NOT NULL,
+            delta DOUBLE PRECISION NOT NULL,
+            value DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (session_id, day, scope, entity, attribute),
+            FOREIGN KEY (session_id, day) REFERENCES daily_effects(session_id, day) ON DELETE CASCADE
+        )
+        """
+    )
+    # backfill: the full series of every session with resolved days
+    conn.execute("TRUNCATE session_trajectory")
+    conn.execute(
+        """
+        WITH deltas AS (
+            SELECT de.session_id, de.day, 'global' AS scope, '' AS entity, g.key AS attribute,
+                   g.value::text::double precision AS delta
+            FROM daily_effects de
+            CROSS JOIN LATERAL jsonb_each(COALESCE(de.global_deltas, '{}')::jsonb) g
+            WHERE jsonb_typeof(g.value) = 'number'
+            UNION ALL
+            SELECT de.session_id, de.day, 'stakeholder', sh.key, a.key, a.value::text::double precision
+            FROM daily_effects de
+            CROSS JOIN LATERAL jsonb_each(COALESCE(de.stakeholder_deltas, '{}')::jsonb) sh
+            CROSS JOIN LATERAL jsonb_each(CASE WHEN jsonb_typeof(sh.value) = 'object' THEN sh.value ELSE '{}' END) a
+            WHERE jsonb_typeof(a.value) = 'number'
+        ), keys AS (
+            SELECT session_id, scope, entity, attribute, MIN(day) AS first_day FROM deltas GROUP BY 1, 2, 3, 4
+        )
+        INSERT INTO session_trajectory (session_id, day, scope, entity, attribute, delta, value)
+        SELECT k.session_id, de.day, k.scope, k.entity, k.attribute, COALESCE(x.delta, 0),
+               SUM(COALESCE(x.delta, 0)) OVER (
+                   PARTITION BY k.session_id, k.scope, k.entity, k.attribute ORDER BY de.day
+               )
+        FROM keys k
+        JOIN daily_effects de ON de.session_id = k.session_id AND de.day >= k.first_day
+        LEFT JOIN deltas x ON x.session_id = k.session_id AND x.day = de.day AND x.scope = k.scope
+                          AND x.entity = k.entity AND x.attribute = k.attribute
+        """
+    )
+
+
+def _migration_ingest_queue(conn):
+    # One row per session with an upload waiting to be normalized (see "Write-behind ingest").
+    # claimed_until is the worker lease, not_before the retry backoff.
+    conn.execute("CREATE SEQUENCE IF NOT EXISTS ingest_seq")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_queue (
+            session_id TEXT PRIMARY KEY,
+            seq BIGINT NOT NULL,
+            payload_bytes BYTEA NOT NULL,
+            payload_codec TEXT NOT NULL,
+            received_at TEXT NOT NULL,
+            uploads INTEGER NOT NULL DEFAULT 1,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            failed BOOLEAN NOT NULL DEFAULT FALSE,
+            claimed_until TIMESTAMPTZ,
+            not_before TIMESTAMPTZ
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_queue_seq ON ingest_queue(seq) WHERE NOT failed")
+
+
+def _migration_drop_canonical_day_columns(conn):
+    # Written on every ingest but never read (canonical actions are matched on action_type +
+    # target_ref, not on their own day). Stored canonical row hashes covered these columns, so
+    # each row is rewritten once, on its session's next full upload.
+    conn.execute("DROP INDEX IF EXISTS idx_canonical_session_day")
+    conn.execute("ALTER TABLE canonical_actions DROP COLUMN IF EXISTS day_index, DROP COLUMN IF EXISTS time_slot")
+
+
+def _migration_upload_dedupe(conn):
+    # payload_hash is the content hash of the full upload the session rows were built from (NULL
+    # once an append or a resolve payload changed them); ingest_counts are the counts it returned.
+    conn.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS payload_hash TEXT")
+    conn.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS ingest_counts JSONB")
+    conn.execute("ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS payload_hash TEXT")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            idempotency_key TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            payload_hash TEXT NOT NULL,
+            status_code INTEGER NOT NULL,
+            response JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at)")
+
+
+def _migration_rollup_deltas(conn):
+    # Pending changes to comparison_rollup / decision_latency_rollup, queued by the writers and
+    # folded in by apply_rollup_deltas (see "Said vs did analytics"). The totals written by
+    # migration 12 already hold everything stored so far, so the queues start empty.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS comparison_rollup_deltas (
+            id BIGSERIAL PRIMARY KEY,
+            version_id TEXT NOT NULL,
+            rule_id TEXT NOT NULL,
+            target_ref TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            outcome TEXT NOT NULL,
+            n BIGINT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS decision_latency_rollup_deltas (
+            id BIGSERIAL PRIMARY KEY,
+            version_id TEXT NOT NULL,
+            node_id TEXT NOT NULL,
+            n BIGINT NOT NULL,
+            total DOUBLE PRECISION NOT NULL,
+            total_sq DOUBLE PRECISION NOT NULL
+        )
+        """
+    )
+
+
+def _migration_session_deletions(conn):
+    # MAX(revision) cannot see a deleted session (it may even go down), so deletes and truncates
+    # take a fresh revision too; GET /sessions builds its ETag from the larger of both.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_deletions (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            revision BIGINT NOT NULL
+        )
+        """
+    )
+    conn.execute("INSERT INTO session_deletions (id, revision) VALUES (TRUE, 0) ON CONFLICT DO NOTHING")
+    conn.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_session_deletions() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE session_deletions SET revision = nextval('session_revision_seq');
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    conn.execute("DROP TRIGGER IF EXISTS sessions_deleted ON sessions")
+    conn.execute(
+        "CREATE TRIGGER sessions_deleted AFTER DELETE OR TRUNCATE ON sessions "
+        "FOR EACH STATEMENT EXECUTE FUNCTION bump_session_deletions()"
+    )
+
+
+def _migration_ingest_claim_token(conn):
+    # Token of the claim holding the lease: a worker that outlived INGEST_LEASE_SECONDS finds
+    # another token there once the row was claimed again, and drops its result.
+    conn.execute("ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS claim_token TEXT")
+
+
+SCHEMA_MIGRATIONS = [
+    (1, "base schema", _migration_base_schema),
+    (2, "comparisons FKs with ON DELETE SET NULL", _migration_comparisons_fk_set_null),
+    (3, "session ingest cursor and payload deltas", _migration_ingest_cursor),
+    (4, "row identity and content hashes", _migration_row_hashes),
+    (5, "expected_actions.day_index (canonical day columns: dropped by 16)", _migration_day_columns),
+    (6, "comparisons.day", _migration_comparisons_day),
+    (7, "bulk normalize runs and checkpoints", _migration_normalize_checkpoints),
+    (8, "compressed session payloads", _migration_compressed_payloads),
+    (9, "session revisions", _migration_session_revisions),
+    (10, "session listing indexes", _migration_session_listing_indexes),
+    (11, "daily_effects input fingerprints", _migration_daily_effects_fingerprint),
+    (12, "said vs did analytics rollups", _migration_analytics_rollups),
+    (13, "session trajectories", _migration_session_trajectory),
+    (14, "write-behind ingest queue", _migration_ingest_queue),
+    (15, "payload content hashes and idempotency keys", _migration_upload_dedupe),
+    (16, "drop unused canonical_actions day columns", _migration_drop_canonical_day_columns),
+    (17, "analytics rollup delta queues", _migration_rollup_deltas),
+    (18, "session deletion revision", _migration_session_deletions),
+    (19, "ingest lease owner", _migration_ingest_claim_token),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def current_schema_version(conn) -> int:
+    try:
+        row = conn.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version").fetchone()
+    except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        return 0
+    conn.commit()
+    return row["version"]
+
+
+def migrate_schema(conn) -> list:
+    if current_schema_version(conn) >= SCHEMA_VERSION:
+        return []
+
+    applied = []
+    conn.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_KEY,))
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.commit()
+        # another worker may have migrated while we waited for the lock
+        done = {r["version"] for r in conn.execute("SELECT version FROM schema_version").fetchall()}
+        for version, description, migration in SCHEMA_MIGRATIONS:
+            if version in done:
+                continue
+            migration(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)",
+                (version, description, datetime.now(timezone.utc).isoformat()),
+            )
+            conn.commit()
+            applied.append(version)
+    finally:
+        conn.rollback()
+        conn.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+        conn.commit()
+    return applied
+
+
+def init_db():
+    with get_conn() as conn:
+        migrate_schema(conn)
+
+
+def _get_allowed_origins():
+    raw = os.getenv("ALLOWED_ORIGINS")
+    if not raw:
+        return ["*"]
+    return [origin.strip().rstrip("/") for origin in raw.split(",") if origin.strip()]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    current_rules(force=True)  # refuse to start without a valid rules spec
+    if STORAGE_BACKEND == "sqlite":
+        open_local_db()
+        try:
+            yield
+        finally:
+            close_local_db()
+        return
+    open_pool()
+    init_db()
+    if DB_ASYNC:
+        await open_async_pool()
+    workers = [asyncio.create_task(_rollup_worker())]
+    if INGEST_MODE == "queue":
+        workers.append(asyncio.create_task(_ingest_worker()))
+    try:
+        yield
+    finally:
+        for worker in workers:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        await close_async_pool()
+        close_pool()
+
+
+app = FastAPI(title="Simulator Backend", version="0.3.0", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=_get_allowed_origins(),
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["ETag", "Link", "X-Next-Cursor", "X-Total-Count", "X-Total-Count-Kind"],
+)
+
+
+@app.get("/health")
+def health():
+    return {"ok": True}
+
+
+@app.get("/health/pool")
+def health_pool():
+    return pool_stats()
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _json_dump(value):
+    return json.dumps(value, ensure_ascii=False) if value is not None else None
 
 
 def _json_load(value):
@@ -449,14 +1449,20 @@ def _json_load(value):
 
 
 # ---- Helpers for comparison rules ----
-import unicodedata
+# Text/time parsing is memoized on the normalized string: the same handful of day
+# names and time windows are parsed for every expected/canonical pair.
 from typing import Any
 
+@lru_cache(maxsize=4096)
+def _normalize_str(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch)).lower().strip()
+
+
 def _normalize_text(value) -> str:
     if value is None:
         return ""
-    normalized = unicodedata.normalize("NFKD", str(value))
-    return "".join(ch for ch in normalized if not unicodedata.combining(ch)).lower().strip()
+    return _normalize_str(str(value))
 
 
 DAY_INDEX = {
@@ -465,16 +1471,20 @@ DAY_INDEX = {
 }
 
 
+@lru_cache(maxsize=1024)
+def _day_index_from_text(text: str):
+    if text.isdigit():
+        num = int(text)
+        return (num - 1) % 7 if num > 0 else None
+    return DAY_INDEX.get(text)
+
+
 def _day_index_from_value(value):
     if value is None:
         return None
     if isinstance(value, int):
         return (value - 1) % 7 if value > 0 else None
-    text = _normalize_text(value)
-    if text.isdigit():
-        num = int(text)
-        return (num - 1) % 7 if num > 0 else None
-    return DAY_INDEX.get(text)
+    return _day_index_from_text(_normalize_text(value))
 
 
 def _parse_time_to_minutes(raw: str):
@@ -490,10 +1500,8 @@ def _parse_time_to_minutes(raw: str):
         return None
 
 
-def _parse_time_window(value):
-    if value is None:
-        return None
-    text = _normalize_text(value)
+@lru_cache(maxsize=1024)
+def _parse_time_window_text(text: str):
     if text in ("am", "morning", "manana", "mañana"):
         return {"slot": "AM"}
     if text in ("pm", "tarde", "afternoon", "evening", "noche"):
@@ -508,6 +1516,13 @@ def _parse_time_window(value):
     return None
 
 
+def _parse_time_window(value):
+    # Cached result is shared: callers must not mutate it.
+    if value is None:
+        return None
+    return _parse_time_window_text(_normalize_text(value))
+
+
 def _normalize_slot(value):
     if value is None:
         return None
@@ -552,806 +1567,3068 @@ def _extract_actual_time_info(actual: dict):
     return {"weekday_index": weekday_index, "slot": slot, "minute_of_day": minute_of_day}
 
 
-# Rule handlers
-def _default_rule(expected: dict, actual: dict):
-    constraints = expected.get("constraints") or {}
+# Rule kinds: each one compiles an expected action (its constraints plus the rule's
+# params from the spec) into a predicate actual -> bool. Constraints are parsed once
+# per expected action instead of once per evaluation.
+def _compile_constraints_match(constraints: dict, params: dict):
     if not constraints:
-        return {"outcome": "TRUE"}
-    vf = _json_load(actual.get("value_final")) or {}
-    ctx = _json_load(actual.get("context")) or {}
-    merged = {**ctx, **vf}
-    for k, v in constraints.items():
-        if merged.get(k) != v:
-            return {"outcome": "FALSE"}
-    return {"outcome": "TRUE"}
+        return lambda actual: True
+    items = list(constraints.items())
+
+    def check(actual: dict):
+        vf = _json_load(actual.get("value_final")) or {}
+        ctx = _json_load(actual.get("context")) or {}
+        merged = {**ctx, **vf}
+        return all(merged.get(k) == v for k, v in items)
+    return check
 
 
-def _rule_time_and_day(expected: dict, actual: dict):
-    constraints = expected.get("constraints") or {}
+def _compile_time_and_day(constraints: dict, params: dict):
     exp_day = _day_index_from_value(constraints.get("day"))
     exp_window = _parse_time_window(constraints.get("time_window"))
-    grace_days = int(constraints.get("grace_days") or 0)
-    info = _extract_actual_time_info(actual)
-    actual_day = info.get("weekday_index")
-    if exp_day is not None:
-        if actual_day is None:
-            return {"outcome": "FALSE"}
-        delta = actual_day - exp_day
-        if delta < 0 or delta > grace_days:
-            return {"outcome": "FALSE"}
-    # Only enforce time window if estamos en el día de la expected; si se usa gracia al día siguiente, aceptamos sin ventana de slot
-    if exp_window and exp_day is not None and actual_day == exp_day:
-        if "slot" in exp_window:
-            if info.get("slot") != exp_window["slot"]:
-                return {"outcome": "FALSE"}
-        else:
-            m = info.get("minute_of_day")
-            if m is None or not (exp_window["start"] <= m <= exp_window["end"]):
-                return {"outcome": "FALSE"}
-    return {"outcome": "TRUE"}
+    # an explicit grace_days (0 included) in the constraints wins over the rule's default
+    grace_days = int((constraints["grace_days"] if "grace_days" in constraints else params.get("grace_days")) or 0)
 
+    def check(actual: dict):
+        info = _extract_actual_time_info(actual)
+        actual_day = info.get("weekday_index")
+        if exp_day is not None:
+            if actual_day is None:
+                return False
+            delta = actual_day - exp_day
+            if delta < 0 or delta > grace_days:
+                return False
+        # Only enforce time window if estamos en el día de la expected; si se usa gracia al día siguiente, aceptamos sin ventana de slot
+        if exp_window and exp_day is not None and actual_day == exp_day:
+            if "slot" in exp_window:
+                if info.get("slot") != exp_window["slot"]:
+                    return False
+            else:
+                m = info.get("minute_of_day")
+                if m is None or not (exp_window["start"] <= m <= exp_window["end"]):
+                    return False
+        return True
+    return check
 
-RULE_HANDLERS = {
-    "default_rule": _default_rule,
-    "meeting_time_rule_v1": _rule_time_and_day,
-    "visit_stakeholder_rule_v1": _rule_time_and_day,
-    "research_hours_rule_v1": _rule_time_and_day,
-}
 
-RULE_EFFECTS = {
-    # Valores por defecto si el expected no define sus propios efectos.
-    "meeting_time_rule_v1": {
-        "TRUE": {"global": {"reputation": 10}},
-        "FALSE": {"global": {"reputation": -10}},
-    },
-    "visit_stakeholder_rule_v1": {
-        "TRUE": {"stakeholder": {"trust": 10}},
-        "FALSE": {"stakeholder": {"trust": -10}},
-    },
-    "research_hours_rule_v1": {
-        "TRUE": {"global": {"reputation": 10}},
-        "FALSE": {"global": {"reputation": -10}},
-    },
-    "default_rule": {
-        "TRUE": {},
-        "FALSE": {},
-    },
+RULE_KINDS = {
+    "constraints_match": _compile_constraints_match,
+    "time_and_day": _compile_time_and_day,
+    "pass": lambda constraints, params: (lambda actual: True),
 }
 
+# Rules not in the spec (or an unknown kind) behave like default_rule without default effects.
+FALLBACK_RULE = {"kind": "constraints_match", "params": {}, "effects": {}}
 
-def _pick_best_match(expected: dict, matches: list):
-    created_at = expected.get("created_at") or 0
-    after = [m for m in matches if (m.get("committed_at") or 0) >= created_at]
-    after.sort(key=lambda a: a.get("committed_at") or 0)
-    if after:
-        return after[0]
-    return sorted(matches, key=lambda a: a.get("committed_at") or 0)[0]
+# Rule definitions and default effects live in a JSON spec, reloaded when the file changes.
+RULES_SPEC_PATH = Path(os.getenv("COMPARISON_RULES_PATH") or Path(__file__).with_name("comparison_rules.json"))
+_rules_state = {"mtime": None, "version": None, "rules": {}, "error": None}
 
 
-def _extract_stakeholder_id(target_ref: str):
-    if target_ref and target_ref.startswith("stakeholder:"):
-        return target_ref.split(":", 1)[1]
-    return None
+def _load_rules_spec(path: Path) -> dict:
+    with open(path, "rb") as fh:
+        raw = fh.read()
+    spec = json.loads(raw)
+    if not isinstance(spec, dict):
+        raise ValueError("rules spec must be a JSON object")
+    rules = {}
+    for rule_id, rule in (spec.get("rules") or {}).items():
+        kind = rule.get("kind") or "constraints_match"
+        if kind not in RULE_KINDS:
+            raise ValueError(f"rule {rule_id}: unknown kind {kind!r}")
+        rules[rule_id] = {
+            "kind": kind,
+            "params": rule.get("params") or {},
+            "effects": rule.get("effects") or {},
+        }
+    return {"version": hashlib.blake2b(raw, digest_size=8).hexdigest(), "rules": rules}
 
 
-def _apply_effects(global_deltas: dict, stakeholder_deltas: dict, effect: dict, expected: dict):
-    if not effect:
-        return
-    for k, v in (effect.get("global") or {}).items():
-        global_deltas[k] = global_deltas.get(k, 0) + v
-    stakeholder_effects = effect.get("stakeholder") or {}
-    if stakeholder_effects:
-        sid = _extract_stakeholder_id(expected.get("target_ref"))
-        if sid:
-            curr = stakeholder_deltas.get(sid, {})
-            for k, v in stakeholder_effects.items():
-                curr[k] = curr.get(k, 0) + v
-            stakeholder_deltas[sid] = curr
+def current_rules_version() -> str | None:
+    current_rules()
+    return _rules_state["version"]
 
 
-def normalize_session(conn, session_id: str, session: dict, created_at: str):
-    metadata = session.get("session_metadata", {})
-    version_id = metadata.get("simulator_version_id")
-    user_id = metadata.get("user_id")
-    start_time = metadata.get("start_time")
-    end_time = metadata.get("end_time")
-    payload = json.dumps(session, ensure_ascii=False)
-
-    explicit_decisions = session.get("explicit_decisions", [])
-    expected_actions = session.get("expected_actions", [])
-    canonical_actions = session.get("canonical_actions", [])
-    mechanic_events = session.get("mechanic_events", [])
-    comparisons = session.get("comparisons", [])
-    process_log = session.get("process_log", [])
-    player_actions_log = session.get("player_actions_log", [])
-    final_state = session.get("final_state", {})
-    stakeholders_state = final_state.get("stakeholders") if isinstance(final_state, dict) else None
+def current_rules(force: bool = False) -> dict:
+    # One stat() per call; the spec is re-read only when its mtime changes. A broken
+    # spec keeps the last good rules loaded and is reported by GET /rules. Without any
+    # good load there is nothing to keep: matching every rule with FALLBACK_RULE would
+    # cache wrong results, so callers fail instead (the lifespan loads it at startup).
+    try:
+        mtime = RULES_SPEC_PATH.stat().st_mtime_ns
+    except OSError as exc:
+        _rules_state["error"] = str(exc)
+    else:
+        if force or mtime != _rules_state["mtime"]:
+            try:
+                loaded = _load_rules_spec(RULES_SPEC_PATH)
+            except (OSError, ValueError) as exc:
+                _rules_state["error"] = str(exc)
+            else:
+                _rules_state.update(loaded, error=None)
+            _rules_state["mtime"] = mtime
+    if _rules_state["version"] is None:
+        raise RuntimeError(f"comparison rules spec {RULES_SPEC_PATH} could not be loaded: {_rules_state['error']}")
+    return _rules_state["rules"]
 
-    mechanic_ids = set()
-    for item in canonical_actions:
-        if item.get("mechanic_id"):
-            mechanic_ids.add(item.get("mechanic_id"))
-    for item in mechanic_events:
-        if item.get("mechanic_id"):
-            mechanic_ids.add(item.get("mechanic_id"))
 
-    if user_id:
-        conn.execute(
-            "INSERT INTO users (user_id, name) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING",
-            (user_id, user_id),
-        )
-
-    if version_id:
-        conn.execute(
-            "INSERT INTO versions (version_id, created_at) VALUES (%s, %s) ON CONFLICT (version_id) DO NOTHING",
-            (version_id, created_at),
-        )
+def compile_expected_rule(expected: dict, rules: dict):
+    rule = rules.get(expected.get("rule_id") or "default_rule") or FALLBACK_RULE
+    compiler = RULE_KINDS.get(rule["kind"], _compile_constraints_match)
+    return compiler(expected.get("constraints") or {}, rule["params"]), rule["effects"]
 
-    for mechanic_id in mechanic_ids:
-        conn.execute(
-            "INSERT INTO mechanics (mechanic_id, version_id) VALUES (%s, %s) ON CONFLICT (mechanic_id) DO NOTHING",
-            (mechanic_id, version_id),
-        )
 
-    conn.execute(
-        """
-        INSERT INTO sessions (session_id, user_id, version_id, start_time, end_time, created_at, payload)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (session_id) DO UPDATE SET
-            user_id = EXCLUDED.user_id,
-            version_id = EXCLUDED.version_id,
-            start_time = EXCLUDED.start_time,
-            end_time = EXCLUDED.end_time,
-            created_at = EXCLUDED.created_at,
-            payload = EXCLUDED.payload
-        """,
-        (session_id, user_id, version_id, start_time, end_time, created_at, payload),
-    )
+@app.get("/rules")
+def get_rules():
+    rules = current_rules()
+    return {
+        "path": str(RULES_SPEC_PATH),
+        "version": _rules_state["version"],
+        "error": _rules_state["error"],
+        "rules": rules,
+    }
 
-    conn.execute("DELETE FROM comparisons WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM daily_effects WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM mechanic_events WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM canonical_actions WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM explicit_decisions WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM process_logs WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM player_actions_log WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM session_state WHERE session_id = %s", (session_id,))
-    conn.execute("DELETE FROM session_stakeholders WHERE session_id = %s", (session_id,))
 
-    for decision in explicit_decisions:
-        conn.execute(
-            """
-            INSERT INTO explicit_decisions (session_id, node_id, option_id, option_text, stakeholder, day, time_slot, consequences)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                session_id,
-                decision.get("nodeId"),
-                decision.get("choiceId"),
-                decision.get("choiceText"),
-                decision.get("stakeholder"),
-                decision.get("day"),
-                decision.get("timeSlot"),
-                _json_dump(decision.get("consequences")),
-            ),
-        )
+@app.post("/rules/reload")
+def reload_rules():
+    current_rules(force=True)
+    if _rules_state["error"]:
+        raise HTTPException(status_code=422, detail=_rules_state["error"])
+    return {"ok": True, "version": _rules_state["version"], "rules": sorted(_rules_state["rules"])}
 
-    expected_ids = set()
-    for action in expected_actions:
-        source = action.get("source", {})
-        if action.get("expected_action_id"):
-            expected_ids.add(action.get("expected_action_id"))
-        conn.execute(
-            """
-            INSERT INTO expected_actions (expected_action_id, session_id, source_node_id, source_option_id, action_type, target_ref, constraints, rule_id, created_at, mechanic_id, effects)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (expected_action_id) DO UPDATE SET
-                session_id = EXCLUDED.session_id,
-                source_node_id = EXCLUDED.source_node_id,
-                source_option_id = EXCLUDED.source_option_id,
-                action_type = EXCLUDED.action_type,
-                target_ref = EXCLUDED.target_ref,
-                constraints = EXCLUDED.constraints,
-                rule_id = EXCLUDED.rule_id,
-                created_at = EXCLUDED.created_at,
-                mechanic_id = EXCLUDED.mechanic_id,
-                effects = EXCLUDED.effects
-            """,
-            (
-                action.get("expected_action_id"),
-                session_id,
-                source.get("node_id"),
-                source.get("option_id"),
-                action.get("action_type"),
-                action.get("target_ref"),
-                _json_dump(action.get("constraints")),
-                action.get("rule_id"),
-                action.get("created_at"),
-                action.get("mechanic_id"),
-                _json_dump(action.get("effects")),
-            ),
-        )
 
-    for action in canonical_actions:
-        conn.execute(
-            """
-            INSERT INTO canonical_actions (canonical_action_id, session_id, mechanic_id, action_type, target_ref, value_final, committed_at, context)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (canonical_action_id) DO UPDATE SET
-                session_id = EXCLUDED.session_id,
-                mechanic_id = EXCLUDED.mechanic_id,
-                action_type = EXCLUDED.action_type,
-                target_ref = EXCLUDED.target_ref,
-                value_final = EXCLUDED.value_final,
-                committed_at = EXCLUDED.committed_at,
-                context = EXCLUDED.context
-            """,
-            (
-                action.get("canonical_action_id"),
-                session_id,
-                action.get("mechanic_id"),
-                action.get("action_type"),
-                action.get("target_ref"),
-                _json_dump(action.get("value_final")),
-                action.get("committed_at"),
-                _json_dump(action.get("context")),
-            ),
-        )
+def _build_canonical_index(canonical_actions: list) -> dict:
+    # Buckets canonical actions by (action_type, target_ref, mechanic_id) and by
+    # (action_type, target_ref) for expected actions without mechanic_id. Each bucket is
+    # sorted by committed_at (stable, so ties keep row order) next to its sort keys.
+    buckets = {}
+    for act in canonical_actions:
+        pair = (act["action_type"], act["target_ref"])
+        buckets.setdefault(pair, []).append(act)
+        buckets.setdefault((*pair, act["mechanic_id"]), []).append(act)
+    index = {}
+    for key, acts in buckets.items():
+        acts.sort(key=lambda a: a.get("committed_at") or 0)
+        index[key] = ([a.get("committed_at") or 0 for a in acts], acts)
+    return index
 
-    for event in mechanic_events:
-        conn.execute(
-            """
-            INSERT INTO mechanic_events (event_id, session_id, mechanic_id, event_type, timestamp, payload)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (event_id) DO UPDATE SET
-                session_id = EXCLUDED.session_id,
-                mechanic_id = EXCLUDED.mechanic_id,
-                event_type = EXCLUDED.event_type,
-                timestamp = EXCLUDED.timestamp,
-                payload = EXCLUDED.payload
-            """,
-            (
-                event.get("event_id"),
-                session_id,
-                event.get("mechanic_id"),
-                event.get("event_type"),
-                event.get("timestamp"),
-                _json_dump(event.get("payload")),
-            ),
-        )
 
-    for comparison in comparisons:
-        exp_id = comparison.get("expected_action_id")
-        safe_expected_id = exp_id if exp_id in expected_ids else None
-        conn.execute(
-            """
-            INSERT INTO comparisons (session_id, expected_action_id, canonical_action_id, outcome, deviation, rule_id)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """,
-            (
-                session_id,
-                safe_expected_id,
-                comparison.get("canonical_action_id"),
-                comparison.get("outcome"),
-                _json_dump(comparison.get("deviation")),
-                comparison.get("rule_id"),
-            ),
-        )
+def _find_best_match(index: dict, expected: dict):
+    # First canonical action committed at or after the expected was created;
+    # if there is none, the earliest one.
+    if expected.get("mechanic_id"):
+        key = (expected["action_type"], expected["target_ref"], expected["mechanic_id"])
+    else:
+        key = (expected["action_type"], expected["target_ref"])
+    bucket = index.get(key)
+    if not bucket:
+        return None
+    committed, acts = bucket
+    pos = bisect_left(committed, expected.get("created_at") or 0)
+    return acts[pos] if pos < len(acts) else acts[0]
 
-    for log in process_log:
-        conn.execute(
-            """
-            INSERT INTO process_logs (session_id, node_id, start_time, end_time, total_duration, final_choice, events)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                session_id,
-                log.get("nodeId"),
-                log.get("startTime"),
-                log.get("endTime"),
-                log.get("totalDuration"),
-                log.get("finalChoice"),
-                _json_dump(log.get("events")),
-            ),
-        )
 
-    for log in player_actions_log:
-        conn.execute(
-            """
-            INSERT INTO player_actions_log (session_id, event, metadata, day, time_slot, timestamp)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """,
-            (
-                session_id,
-                log.get("event"),
-                _json_dump(log.get("metadata")),
-                log.get("day"),
-                log.get("timeSlot"),
-                log.get("timestamp"),
-            ),
-        )
+def _expected_from_row(r) -> dict:
+    return {
+        "expected_action_id": r["expected_action_id"],
+        "source": {"node_id": r["source_node_id"], "option_id": r["source_option_id"]},
+        "action_type": r["action_type"],
+        "target_ref": r["target_ref"],
+        "constraints": _json_load(r["constraints"]) or {},
+        "rule_id": r["rule_id"] or "default_rule",
+        "created_at": r["created_at"] or 0,
+        "mechanic_id": r["mechanic_id"],
+        "effects": _json_load(r.get("effects")) or {},
+    }
 
-    if final_state:
-        conn.execute(
-            """
-            INSERT INTO session_state (session_id, stakeholders, global_state)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (session_id) DO UPDATE SET
-                stakeholders = EXCLUDED.stakeholders,
-                global_state = EXCLUDED.global_state
-            """,
-            (
-                session_id,
-                _json_dump(final_state.get("stakeholders")),
-                _json_dump(final_state.get("global")),
-            ),
-        )
-    if isinstance(stakeholders_state, list):
-        for stakeholder in stakeholders_state:
-            stakeholder_id = stakeholder.get("id") or stakeholder.get("shortId") or stakeholder.get("name")
-            if not stakeholder_id:
-                continue
-            conn.execute(
-                "INSERT INTO stakeholders (stakeholder_id, name, role) VALUES (%s, %s, %s) ON CONFLICT (stakeholder_id) DO NOTHING",
-                (
-                    stakeholder_id,
-                    stakeholder.get("name"),
-                    stakeholder.get("role"),
-                ),
-            )
-            conn.execute(
-                """
-                INSERT INTO session_stakeholders (session_id, stakeholder_id, state)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (session_id, stakeholder_id) DO UPDATE SET
-                    state = EXCLUDED.state
-                """,
-                (
-                    session_id,
-                    stakeholder_id,
-                    _json_dump(stakeholder),
-                ),
-            )
-            # Persist question definitions for this stakeholder
-            questions = stakeholder.get("questions") or []
-            if isinstance(questions, list):
-                for q in questions:
-                    q_id = q.get("question_id")
-                    if not q_id:
-                        continue
-                    conn.execute(
-                        """
-                        INSERT INTO questions (pregunta_id, stakeholder_id, texto_pregunta, texto_respuesta, atributo_global_min, acciones_requeridas)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (pregunta_id) DO UPDATE SET
-                            stakeholder_id = EXCLUDED.stakeholder_id,
-                            texto_pregunta = EXCLUDED.texto_pregunta,
-                            texto_respuesta = EXCLUDED.texto_respuesta,
-                            atributo_global_min = EXCLUDED.atributo_global_min,
-                            acciones_requeridas = EXCLUDED.acciones_requeridas
-                        """,
-                        (
-                            q_id,
-                            stakeholder_id,
-                            q.get("text"),
-                            q.get("answer"),
-                            _json_dump(q.get("requirements")),
-                            _json_dump(q.get("actions_required")),
-                        ),
-                    )
-                    # reset requirements entries for this question to avoid duplicates
-                    conn.execute("DELETE FROM question_requirements WHERE pregunta_id = %s", (q_id,))
-                    req = q.get("requirements") or {}
-                    if req:
-                        conn.execute(
-                            """
-                            INSERT INTO question_requirements (pregunta_id, trust_min, support_min, reputation_min)
-                            VALUES (%s, %s, %s, %s)
-                            """,
-                            (
-                                q_id,
-                                req.get("trust_min"),
-                                req.get("support_min"),
-                                req.get("reputation_min"),
-                            ),
-                        )
 
+def _canonical_from_row(r) -> dict:
     return {
-        "explicit_decisions": len(explicit_decisions),
-        "expected_actions": len(expected_actions),
-        "canonical_actions": len(canonical_actions),
-        "mechanic_events": len(mechanic_events),
-        "comparisons": len(comparisons),
-        "process_log": len(process_log),
-        "player_actions_log": len(player_actions_log),
+        "canonical_action_id": r["canonical_action_id"],
+        "mechanic_id": r["mechanic_id"],
+        "action_type": r["action_type"],
+        "target_ref": r["target_ref"],
+        "value_final": _json_load(r["value_final"]),
+        "committed_at": r["committed_at"] or 0,
+        "context": _json_load(r["context"]),
     }
 
 
-@app.post("/sessions")
-def create_session(session: dict = Body(...)):
-    metadata = session.get("session_metadata", {})
-    session_id = metadata.get("session_id")
-    if not session_id:
-        raise HTTPException(status_code=400, detail="session_metadata.session_id missing")
+def _resolve_effect(exp: dict, default_effects: dict, outcome: str):
+    custom = (exp.get("effects") or {}).get(outcome)
+    if custom is not None:
+        return custom
+    return default_effects.get(outcome)
 
-    created_at = datetime.now(timezone.utc).isoformat()
 
-    with get_conn() as conn:
-        conn.execute("BEGIN")
-        counts = normalize_session(conn, session_id, session, created_at)
-        conn.commit()
+def resolve_day(expected_actions: list, canonical_index: dict, day: int, rules: dict | None = None):
+    expected_ids = {exp["expected_action_id"] for exp in expected_actions}
+    if rules is None:
+        rules = current_rules()
 
-    return {"ok": True, "session_id": session_id, "counts": counts}
+    # Filter expected by day constraint if present
+    day_index = _day_index_from_value(day)
+    def applies_to_day(exp: dict):
+        constraints = exp.get("constraints") or {}
+        if "day" not in constraints:
+            return True
+        exp_day = _day_index_from_value(constraints.get("day"))
+        return exp_day is None or exp_day == day_index
 
+    comparisons = []
+    global_deltas = {"budget": 0, "reputation": 0}
+    stakeholder_deltas = {}
 
-@app.post("/sessions/{session_id}/normalize")
-def normalize_existing_session(session_id: str):
-    with get_conn() as conn:
-        row = conn.execute(
-            "SELECT payload, created_at FROM sessions WHERE session_id = %s",
-            (session_id,),
-        ).fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="session not found")
+    for exp in expected_actions:
+        if not applies_to_day(exp):
+            continue
+        best = _find_best_match(canonical_index, exp)
+        predicate, default_effects = compile_expected_rule(exp, rules)
+        if best is None:
+            comparisons.append({
+                "expected_action_id": exp["expected_action_id"] if exp["expected_action_id"] in expected_ids else None,
+                "canonical_action_id": None,
+                "outcome": "FALSE",
+                "deviation": None,
+                "rule_id": exp["rule_id"],
+            })
+            effect = _resolve_effect(exp, default_effects, "FALSE")
+            _apply_effects(global_deltas, stakeholder_deltas, effect, exp)
+            continue
 
-        session = json.loads(row["payload"])
-        conn.execute("BEGIN")
-        counts = normalize_session(conn, session_id, session, row["created_at"])
-        conn.commit()
+        outcome = "TRUE" if predicate(best) else "FALSE"
+        comparisons.append({
+            "expected_action_id": exp["expected_action_id"] if exp["expected_action_id"] in expected_ids else None,
+            "canonical_action_id": best["canonical_action_id"],
+            "outcome": outcome,
+            "deviation": None,
+            "rule_id": exp["rule_id"],
+        })
+        effect = _resolve_effect(exp, default_effects, outcome)
+        _apply_effects(global_deltas, stakeholder_deltas, effect, exp)
 
-    return {"ok": True, "session_id": session_id, "counts": counts}
+    # Final safety: drop FK values if the referenced id is not present
+    for cmp in comparisons:
+        if cmp.get("expected_action_id") and cmp["expected_action_id"] not in expected_ids:
+            cmp["expected_action_id"] = None
+    comparisons = [c for c in comparisons if (not c.get("expected_action_id")) or c["expected_action_id"] in expected_ids]
+    return comparisons, global_deltas, stakeholder_deltas
 
 
-@app.post("/sessions/normalize")
-def normalize_all_sessions():
-    with get_conn() as conn:
-        rows = conn.execute(
-            "SELECT session_id, payload, created_at FROM sessions"
-        ).fetchall()
-        results = []
-        conn.execute("BEGIN")
-        for row in rows:
-            session = json.loads(row["payload"])
-            counts = normalize_session(conn, row["session_id"], session, row["created_at"])
-            results.append({"session_id": row["session_id"], "counts": counts})
-        conn.commit()
+def _extract_stakeholder_id(target_ref: str):
+    if target_ref and target_ref.startswith("stakeholder:"):
+        return target_ref.split(":", 1)[1]
+    return None
 
-    return {"ok": True, "processed": len(results), "results": results}
 
+def _apply_effects(global_deltas: dict, stakeholder_deltas: dict, effect: dict, expected: dict):
+    if not effect:
+        return
+    for k, v in (effect.get("global") or {}).items():
+        global_deltas[k] = global_deltas.get(k, 0) + v
+    stakeholder_effects = effect.get("stakeholder") or {}
+    if stakeholder_effects:
+        sid = _extract_stakeholder_id(expected.get("target_ref"))
+        if sid:
+            curr = stakeholder_deltas.get(sid, {})
+            for k, v in stakeholder_effects.items():
+                curr[k] = curr.get(k, 0) + v
+            stakeholder_deltas[sid] = curr
 
-@app.post("/sessions/{session_id}/resolve_day_effects")
-def resolve_day_effects(session_id: str, day: int, payload: dict | None = Body(default=None)):
-    if day is None:
-        raise HTTPException(status_code=400, detail="day is required")
 
-    with get_conn() as conn:
-        # ensure session exists
-        exists = conn.execute("SELECT 1 FROM sessions WHERE session_id = %s", (session_id,)).fetchone()
-        if not exists:
-            raise HTTPException(status_code=404, detail="session not found")
+# Normalized child tables: (identity column, data columns, ON CONFLICT target).
+# Tables without a conflict target have surrogate keys, so their identity is `row_key`,
+# the position of the row in its payload list (those lists only grow on the client).
+CHILD_TABLES = {
+    "explicit_decisions": (
+        "row_key",
+        ("node_id", "option_id", "option_text", "stakeholder", "day", "time_slot", "consequences"),
+        None,
+    ),
+    "expected_actions": (
+        "expected_action_id",
+        ("source_node_id", "source_option_id", "action_type", "target_ref", "constraints", "rule_id", "created_at", "mechanic_id", "effects", "day_index"),
+        "expected_action_id",
+    ),
+    "canonical_actions": (
+        "canonical_action_id",
+        ("mechanic_id", "action_type", "target_ref", "value_final", "committed_at", "context"),
+        "canonical_action_id",
+    ),
+    "mechanic_events": (
+        "event_id",
+        ("mechanic_id", "event_type", "timestamp", "payload"),
+        "event_id",
+    ),
+    "comparisons": (
+        "row_key",
+        ("expected_action_id", "canonical_action_id", "outcome", "deviation", "rule_id"),
+        None,
+    ),
+    "process_logs": (
+        "row_key",
+        ("node_id", "start_time", "end_time", "total_duration", "final_choice", "events"),
+        None,
+    ),
+    "player_actions_log": (
+        "row_key",
+        ("event", "metadata", "day", "time_slot", "timestamp"),
+        None,
+    ),
+    "session_stakeholders": (
+        "stakeholder_id",
+        ("state",),
+        "session_id, stakeholder_id",
+    ),
+}
 
-        existing_effect = conn.execute(
-            "SELECT comparisons, global_deltas, stakeholder_deltas FROM daily_effects WHERE session_id = %s AND day = %s",
-            (session_id, day),
-        ).fetchone()
-        if existing_effect:
-            return {
-                "ok": True,
-                "session_id": session_id,
-                "day": day,
-                "comparisons": _json_load(existing_effect["comparisons"]) or [],
-                "global_deltas": _json_load(existing_effect["global_deltas"]) or {},
-                "stakeholder_deltas": _json_load(existing_effect["stakeholder_deltas"]) or {},
-                "cached": True,
-            }
-
-        # Optional upsert for expected/canonical provided in payload of the day (only the ones realmente elegidas)
-        if payload:
-            expected_payload = payload.get("expected_actions") or []
-            canonical_payload = payload.get("canonical_actions") or []
-            # Upsert expected first (no deletes)
-            for action in expected_payload:
-                source = action.get("source", {}) or {}
-                conn.execute(
-                    """
-                    INSERT INTO expected_actions (expected_action_id, session_id, source_node_id, source_option_id, action_type, target_ref, constraints, rule_id, created_at, mechanic_id, effects)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (expected_action_id) DO UPDATE SET
-                        session_id = EXCLUDED.session_id,
-                        source_node_id = EXCLUDED.source_node_id,
-                        source_option_id = EXCLUDED.source_option_id,
-                        action_type = EXCLUDED.action_type,
-                        target_ref = EXCLUDED.target_ref,
-                        constraints = EXCLUDED.constraints,
-                        rule_id = EXCLUDED.rule_id,
-                        created_at = EXCLUDED.created_at,
-                        mechanic_id = EXCLUDED.mechanic_id,
-                        effects = EXCLUDED.effects
-                    """,
-                    (
-                        action.get("expected_action_id"),
-                        session_id,
-                        source.get("node_id"),
-                        source.get("option_id"),
-                        action.get("action_type"),
-                        action.get("target_ref"),
-                        _json_dump(action.get("constraints")),
-                        action.get("rule_id"),
-                        action.get("created_at"),
-                        action.get("mechanic_id"),
-                        _json_dump(action.get("effects")),
-                    ),
-                )
-            # Upsert canonical actions sent for this day
-            for action in canonical_payload:
-                conn.execute(
-                    """
-                    INSERT INTO canonical_actions (canonical_action_id, session_id, mechanic_id, action_type, target_ref, value_final, committed_at, context)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (canonical_action_id) DO UPDATE SET
-                        session_id = EXCLUDED.session_id,
-                        mechanic_id = EXCLUDED.mechanic_id,
-                        action_type = EXCLUDED.action_type,
-                        target_ref = EXCLUDED.target_ref,
-                        value_final = EXCLUDED.value_final,
-                        committed_at = EXCLUDED.committed_at,
-                        context = EXCLUDED.context
-                    """,
-                    (
-                        action.get("canonical_action_id"),
-                        session_id,
-                        action.get("mechanic_id"),
-                        action.get("action_type"),
-                        action.get("target_ref"),
-                        _json_dump(action.get("value_final")),
-                        action.get("committed_at"),
-                        _json_dump(action.get("context")),
-                    ),
-                )
-            conn.commit()
+COMPARISONS_COPY_SQL = "COPY comparisons (session_id, day, expected_action_id, canonical_action_id, outcome, deviation, rule_id) FROM STDIN"
 
-        expected_rows = conn.execute(
-            """
-            SELECT expected_action_id, source_node_id, source_option_id, action_type, target_ref,
-                   constraints, rule_id, created_at, mechanic_id, effects
-            FROM expected_actions
-            WHERE session_id = %s
-            """,
-            (session_id,),
-        ).fetchall()
-        canonical_rows = conn.execute(
-            """
-            SELECT canonical_action_id, mechanic_id, action_type, target_ref, value_final, committed_at, context
-            FROM canonical_actions
-            WHERE session_id = %s
-            """,
-            (session_id,),
-        ).fetchall()
 
-        expected_ids = {r["expected_action_id"] for r in expected_rows}
-        if len(expected_ids) == 0:
-            return {
-                "ok": False,
-                "reason": "missing_expected_actions",
-                "message": "No expected_actions found in DB for this session. Send session payload before resolving day.",
-                "session_id": session_id,
-                "day": day
-            }
-
-        expected_actions = [
-            {
-                "expected_action_id": r["expected_action_id"],
-                "source": {"node_id": r["source_node_id"], "option_id": r["source_option_id"]},
-                "action_type": r["action_type"],
-                "target_ref": r["target_ref"],
-                "constraints": _json_load(r["constraints"]) or {},
-                "rule_id": r["rule_id"] or "default_rule",
-                "created_at": r["created_at"] or 0,
-                "mechanic_id": r["mechanic_id"],
-                "effects": _json_load(r.get("effects")) or {},
-            }
-            for r in expected_rows
-        ]
-        canonical_actions = [
-            {
-                "canonical_action_id": r["canonical_action_id"],
-                "mechanic_id": r["mechanic_id"],
-                "action_type": r["action_type"],
-                "target_ref": r["target_ref"],
-                "value_final": _json_load(r["value_final"]),
-                "committed_at": r["committed_at"] or 0,
-                "context": _json_load(r["context"]),
-            }
-            for r in canonical_rows
-        ]
-
-        # Filter expected by day constraint if present
-        day_index = _day_index_from_value(day)
-        def applies_to_day(exp: dict):
-            constraints = exp.get("constraints") or {}
-            if "day" not in constraints:
-                return True
-            exp_day = _day_index_from_value(constraints.get("day"))
-            return exp_day is None or exp_day == day_index
-
-        comparisons = []
-        global_deltas = {"budget": 0, "reputation": 0}
-        stakeholder_deltas = {}
-
-        def resolve_effect(exp: dict, outcome: str):
-            custom = (exp.get("effects") or {}).get(outcome)
-            if custom is not None:
-                return custom
-            return RULE_EFFECTS.get(exp.get("rule_id") or "default_rule", {}).get(outcome)
-
-        for exp in expected_actions:
-            if not applies_to_day(exp):
-                continue
-            matches = [
-                act for act in canonical_actions
-                if act["action_type"] == exp["action_type"]
-                and act["target_ref"] == exp["target_ref"]
-                and (not exp.get("mechanic_id") or act["mechanic_id"] == exp["mechanic_id"])
-            ]
-            if not matches:
-                comparisons.append({
-                    "expected_action_id": exp["expected_action_id"] if exp["expected_action_id"] in expected_ids else None,
-                    "canonical_action_id": None,
-                    "outcome": "FALSE",
-                    "deviation": None,
-                    "rule_id": exp["rule_id"],
-                })
-                effect = resolve_effect(exp, "FALSE")
-                _apply_effects(global_deltas, stakeholder_deltas, effect, exp)
-                continue
+def _row_hash(values) -> str:
+    encoded = json.dumps(values, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
 
-            best = _pick_best_match(exp, matches)
-            handler = RULE_HANDLERS.get(exp["rule_id"] or "default_rule", _default_rule)
-            result = handler(exp, best)
-            outcome = "TRUE" if result.get("outcome") == "TRUE" else "FALSE"
-            comparisons.append({
-                "expected_action_id": exp["expected_action_id"] if exp["expected_action_id"] in expected_ids else None,
-                "canonical_action_id": best["canonical_action_id"],
-                "outcome": outcome,
-                "deviation": None,
-                "rule_id": exp["rule_id"],
-            })
-            effect = resolve_effect(exp, outcome)
-            _apply_effects(global_deltas, stakeholder_deltas, effect, exp)
 
-        # Final safety: drop FK values if the referenced id is not present
-        for cmp in comparisons:
-            if cmp.get("expected_action_id") and cmp["expected_action_id"] not in expected_ids:
-                cmp["expected_action_id"] = None
-        comparisons = [c for c in comparisons if (not c.get("expected_action_id")) or c["expected_action_id"] in expected_ids]
-        if len(comparisons) == 0:
-            return {
-                "ok": False,
-                "reason": "missing_expected_actions",
-                "message": "No valid comparisons to persist because expected_actions are missing.",
-                "session_id": session_id,
-                "day": day
-            }
+# Columns computed from the row's own JSON (not sent by the client); always last in CHILD_TABLES.
+DERIVED_COLUMNS = ("day_index",)
 
-        created_at = datetime.now(timezone.utc).isoformat()
-        conn.execute("BEGIN")
-        for cmp in comparisons:
-            conn.execute(
-                """
-                INSERT INTO comparisons (session_id, expected_action_id, canonical_action_id, outcome, deviation, rule_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    session_id,
-                    cmp["expected_action_id"],
-                    cmp["canonical_action_id"],
-                    cmp["outcome"],
-                    _json_dump(cmp.get("deviation")),
-                    cmp.get("rule_id"),
-                ),
-            )
-        conn.execute(
-            """
-            INSERT INTO daily_effects (session_id, day, comparisons, global_deltas, stakeholder_deltas, created_at, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (session_id, day) DO UPDATE SET
-                comparisons = EXCLUDED.comparisons,
-                global_deltas = EXCLUDED.global_deltas,
-                stakeholder_deltas = EXCLUDED.stakeholder_deltas,
-                created_at = EXCLUDED.created_at,
-                status = EXCLUDED.status
-            """,
-            (
-                session_id,
-                day,
-                _json_dump(comparisons),
-                _json_dump(global_deltas),
-                _json_dump(stakeholder_deltas),
-                created_at,
-                "applied",
-            ),
-        )
-        conn.commit()
 
+def _hashed_rows(rows: list) -> dict:
+    return {key: (values, _row_hash(values)) for key, values in rows}
+
+
+def _payload_hash(session: dict) -> str:
+    # Canonical form (sorted keys, no whitespace): the same document hashes the same whatever
+    # key order or formatting the client serialized it with.
+    encoded = json.dumps(session, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def _expected_action_row(action: dict):
+    source = action.get("source", {}) or {}
+    constraints = _json_load(action.get("constraints"))
+    day_value = constraints.get("day") if isinstance(constraints, dict) else None
+    return (
+        action.get("expected_action_id"),
+        (
+            source.get("node_id"),
+            source.get("option_id"),
+            action.get("action_type"),
+            action.get("target_ref"),
+            _json_dump(action.get("constraints")),
+            action.get("rule_id"),
+            action.get("created_at"),
+            action.get("mechanic_id"),
+            _json_dump(action.get("effects")),
+            _day_index_from_value(day_value),
+        ),
+    )
+
+
+def _canonical_action_row(action: dict):
+    return (
+        action.get("canonical_action_id"),
+        (
+            action.get("mechanic_id"),
+            action.get("action_type"),
+            action.get("target_ref"),
+            _json_dump(action.get("value_final")),
+            action.get("committed_at"),
+            _json_dump(action.get("context")),
+        ),
+    )
+
+
+def _diff_rows(wanted: dict, existing: dict, prune: bool):
+    # Keys of `wanted` ({key: (values, row_hash)}) to insert and to update, and stored keys
+    # ({key: row_hash}) to delete, shared by the Postgres and the SQLite table writers.
+    inserts = [key for key in wanted if key not in existing]
+    updates = [key for key in wanted if key in existing and existing[key] != wanted[key][1]]
+    stale = [key for key in existing if key not in wanted] if prune else []
+    return inserts, updates, stale
+
+
+def _diff_changes(wanted: dict, inserts: list, updates: list, deleted: int) -> dict:
     return {
-        "ok": True,
-        "session_id": session_id,
-        "day": day,
-        "comparisons": comparisons,
-        "global_deltas": global_deltas,
-        "stakeholder_deltas": stakeholder_deltas,
-        "cached": False,
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": deleted,
+        "unchanged": len(wanted) - len(inserts) - len(updates),
     }
 
 
-@app.get("/sessions")
-def list_sessions(limit: int = 100):
-    with get_conn() as conn:
-        rows = conn.execute(
-            "SELECT session_id, user_id, version_id, start_time, end_time, created_at FROM sessions ORDER BY created_at DESC LIMIT %s",
-            (limit,),
-        ).fetchall()
+def _write_table_steps(session_id: str, table: str, rows: list, diff: bool = True, prune: bool = True):
+    # Applies `rows` ([(identity, values)]) to `table` for this session. With `diff`, rows whose
+    # content hash matches what is stored are skipped and stored rows missing from `rows` are
+    # deleted (unless `prune` is off); without it every row is written.
+    key_col, columns, conflict = CHILD_TABLES[table]
+    wanted = yield _compute(_hashed_rows, rows)
 
-    return [dict(row) for row in rows]
+    existing = {}
+    if diff:
+        found = yield _fetchall(f"SELECT {key_col} AS key, row_hash FROM {table} WHERE session_id = %s", (session_id,))
+        existing = {r["key"]: r["row_hash"] for r in found}
 
+    inserts, updates, stale = _diff_rows(wanted, existing, prune)
 
-@app.get("/sessions/{session_id}")
-def get_session(session_id: str):
-    with get_conn() as conn:
-        row = conn.execute(
-            "SELECT payload FROM sessions WHERE session_id = %s",
-            (session_id,),
-        ).fetchone()
+    deleted = 0
+    if stale:
+        stale_keys = [key for key in stale if key is not None]
+        deleted = yield _exec(
+            f"DELETE FROM {table} WHERE session_id = %s AND ({key_col} = ANY(%s) OR (%s AND {key_col} IS NULL))",
+            (session_id, stale_keys, len(stale_keys) != len(stale)),
+        )
 
-    if not row:
-        raise HTTPException(status_code=404, detail="session not found")
+    if conflict is None:
+        yield _copy(
+            f"COPY {table} (session_id, {key_col}, {', '.join(columns)}, row_hash) FROM STDIN",
+            [(session_id, key, *wanted[key][0], wanted[key][1]) for key in inserts],
+        )
+        assignments = ", ".join(f"{col} = %s" for col in columns)
+        yield _executemany(
+            f"UPDATE {table} SET {assignments}, row_hash = %s WHERE session_id = %s AND {key_col} = %s",
+            [(*wanted[key][0], wanted[key][1], session_id, key) for key in updates],
+        )
+    else:
+        set_cols = (["session_id"] if conflict == key_col else []) + list(columns) + ["row_hash"]
+        placeholders = ", ".join(["%s"] * (len(columns) + 3))
+        yield _executemany(
+            f"""
+            INSERT INTO {table} ({key_col}, session_id, {', '.join(columns)}, row_hash)
+            VALUES ({placeholders})
+            ON CONFLICT ({conflict}) DO UPDATE SET
+                {', '.join(f'{col} = EXCLUDED.{col}' for col in set_cols)}
+            """,
+            [(key, session_id, *wanted[key][0], wanted[key][1]) for key in inserts + updates],
+        )
 
-    return json.loads(row["payload"])
+    metric_inc("db_rows_written_total", (("table", table), ("op", "insert")), len(inserts))
+    metric_inc("db_rows_written_total", (("table", table), ("op", "update")), len(updates))
+    metric_inc("db_rows_written_total", (("table", table), ("op", "delete")), deleted)
+    return _diff_changes(wanted, inserts, updates, deleted)
 
 
-@app.get("/sessions/{session_id}/normalized")
-def get_session_normalized(session_id: str):
-    with get_conn() as conn:
-        session_row = conn.execute(
-            "SELECT session_id, user_id, version_id, start_time, end_time, created_at FROM sessions WHERE session_id = %s",
-            (session_id,),
-        ).fetchone()
-        if not session_row:
-            raise HTTPException(status_code=404, detail="session not found")
+# Client-side lists that only ever grow during a session; the ingest cursor is the
+# length of each one already stored for the session.
+APPEND_LISTS = (
+    "explicit_decisions",
+    "expected_actions",
+    "canonical_actions",
+    "mechanic_events",
+    "process_log",
+    "player_actions_log",
+    "question_log",
+)
 
-        data = {"session": dict(session_row)}
-        data["explicit_decisions"] = [dict(r) for r in conn.execute("SELECT * FROM explicit_decisions WHERE session_id = %s", (session_id,)).fetchall()]
-        data["expected_actions"] = [dict(r) for r in conn.execute("SELECT * FROM expected_actions WHERE session_id = %s", (session_id,)).fetchall()]
-        data["canonical_actions"] = [dict(r) for r in conn.execute("SELECT * FROM canonical_actions WHERE session_id = %s", (session_id,)).fetchall()]
-        data["mechanic_events"] = [dict(r) for r in conn.execute("SELECT * FROM mechanic_events WHERE session_id = %s", (session_id,)).fetchall()]
-        data["comparisons"] = [dict(r) for r in conn.execute("SELECT * FROM comparisons WHERE session_id = %s", (session_id,)).fetchall()]
-        data["process_logs"] = [dict(r) for r in conn.execute("SELECT * FROM process_logs WHERE session_id = %s", (session_id,)).fetchall()]
-        data["player_actions_log"] = [dict(r) for r in conn.execute("SELECT * FROM player_actions_log WHERE session_id = %s", (session_id,)).fetchall()]
-        data["session_stakeholders"] = [dict(r) for r in conn.execute("SELECT * FROM session_stakeholders WHERE session_id = %s", (session_id,)).fetchall()]
-        state_row = conn.execute("SELECT * FROM session_state WHERE session_id = %s", (session_id,)).fetchone()
-        data["session_state"] = dict(state_row) if state_row else None
+SESSION_PAYLOAD_SELECT = """
+    SELECT s.session_id, s.payload, s.payload_bytes, s.payload_codec, s.created_at, s.revision,
+           (SELECT json_agg(d.delta ORDER BY d.seq) FROM session_payload_deltas d
+            WHERE d.session_id = s.session_id) AS deltas
+    FROM sessions s
+"""
 
-    return data
 
+def _payload_cursor(session: dict) -> dict:
+    return {key: len(session.get(key) or []) for key in APPEND_LISTS}
 
-@app.get("/sessions/latest")
-def get_latest_session():
-    with get_conn() as conn:
-        row = conn.execute(
-            "SELECT session_id, user_id, version_id, start_time, end_time, created_at FROM sessions ORDER BY created_at DESC LIMIT 1"
-        ).fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="session not found")
 
-    return dict(row)
+def _merge_payload_deltas(session: dict, deltas) -> dict:
+    for delta in deltas or []:
+        if isinstance(delta, str):
+            delta = json.loads(delta)
+        for key in APPEND_LISTS + ("comparisons",):
+            items = delta.get(key)
+            if items:
+                session[key] = (session.get(key) or []) + items
+        if delta.get("final_state"):
+            session["final_state"] = delta["final_state"]
+        end_time = (delta.get("session_metadata") or {}).get("end_time")
+        if end_time:
+            session.setdefault("session_metadata", {})["end_time"] = end_time
+    return session
 
 
-@app.get("/sessions/latest/normalized")
-def get_latest_session_normalized():
-    with get_conn() as conn:
-        row = conn.execute(
-            "SELECT session_id FROM sessions ORDER BY created_at DESC LIMIT 1"
-        ).fetchone()
+# HTTP Content-Encoding for each storage codec (HTTP "deflate" is the zlib format).
+PAYLOAD_CONTENT_ENCODING = {"zlib": "deflate", "zstd": "zstd"}
+
+
+def encode_payload(data: bytes):
+    if PAYLOAD_CODEC == "zlib":
+        return "zlib", zlib.compress(data, PAYLOAD_COMPRESSION_LEVEL)
+    if PAYLOAD_CODEC == "zstd":
+        return "zstd", zstandard.ZstdCompressor(level=PAYLOAD_COMPRESSION_LEVEL).compress(data)
+    return "identity", data
+
+
+def decode_payload(codec: str | None, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("payload stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data)
+
+
+def _payload_bytes(row) -> bytes:
+    # Raw JSON document of the stored (base) payload.
+    if row.get("payload_bytes") is not None:
+        return decode_payload(row.get("payload_codec"), row["payload_bytes"])
+    return row["payload"].encode("utf-8")
+
+
+def session_payload(row) -> dict:
+    return _merge_payload_deltas(json.loads(_payload_bytes(row)), row.get("deltas"))
+
+
+def _mechanic_ids(session: dict):
+    mechanic_ids = set()
+    for item in session.get("canonical_actions") or []:
+        if item.get("mechanic_id"):
+            mechanic_ids.add(item.get("mechanic_id"))
+    for item in session.get("mechanic_events") or []:
+        if item.get("mechanic_id"):
+            mechanic_ids.add(item.get("mechanic_id"))
+    return mechanic_ids
+
+
+def _child_rows(session: dict, expected_ids: set, offsets: dict | None = None) -> dict:
+    offsets = offsets or {}
+
+    def keyed(table, items):
+        start = offsets.get(table, 0)
+        return [(str(start + i), values) for i, values in enumerate(items)]
+
+    return {
+        "explicit_decisions": keyed("explicit_decisions", [
+            (
+                decision.get("nodeId"),
+                decision.get("choiceId"),
+                decision.get("choiceText"),
+                decision.get("stakeholder"),
+                decision.get("day"),
+                decision.get("timeSlot"),
+                _json_dump(decision.get("consequences")),
+            )
+            for decision in session.get("explicit_decisions") or []
+        ]),
+        "expected_actions": [_expected_action_row(action) for action in session.get("expected_actions") or []],
+        "canonical_actions": [_canonical_action_row(action) for action in session.get("canonical_actions") or []],
+        "mechanic_events": [
+            (
+                event.get("event_id"),
+                (
+                    event.get("mechanic_id"),
+                    event.get("event_type"),
+                    event.get("timestamp"),
+                    _json_dump(event.get("payload")),
+                ),
+            )
+            for event in session.get("mechanic_events") or []
+        ],
+        "comparisons": keyed("comparisons", [
+            (
+                comparison.get("expected_action_id") if comparison.get("expected_action_id") in expected_ids else None,
+                comparison.get("canonical_action_id"),
+                comparison.get("outcome"),
+                _json_dump(comparison.get("deviation")),
+                comparison.get("rule_id"),
+            )
+            for comparison in session.get("comparisons") or []
+        ]),
+        "process_logs": keyed("process_logs", [
+            (
+                log.get("nodeId"),
+                log.get("startTime"),
+                log.get("endTime"),
+                log.get("totalDuration"),
+                log.get("finalChoice"),
+                _json_dump(log.get("events")),
+            )
+            for log in session.get("process_log") or []
+        ]),
+        "player_actions_log": keyed("player_actions_log", [
+            (
+                log.get("event"),
+                _json_dump(log.get("metadata")),
+                log.get("day"),
+                log.get("timeSlot"),
+                log.get("timestamp"),
+            )
+            for log in session.get("player_actions_log") or []
+        ]),
+    }
+
+
+def _write_child_rows_steps(session_id: str, session: dict, expected_ids: set, diff: bool, offsets: dict | None = None):
+    rows = yield _compute(_child_rows, session, expected_ids, offsets)
+    changes = {}
+    for table, table_rows in rows.items():
+        # expected_actions are seeded once per session and never pruned here
+        changes[table] = yield from _write_table_steps(
+            session_id, table, table_rows, diff=diff, prune=table != "expected_actions"
+        )
+
+    return _ingest_counts(session), changes
+
+
+def _ingest_counts(session: dict) -> dict:
+    return {
+        "explicit_decisions": len(session.get("explicit_decisions") or []),
+        "expected_actions": len(session.get("expected_actions") or []),
+        "canonical_actions": len(session.get("canonical_actions") or []),
+        "mechanic_events": len(session.get("mechanic_events") or []),
+        "comparisons": len(session.get("comparisons") or []),
+        "process_log": len(session.get("process_log") or []),
+        "player_actions_log": len(session.get("player_actions_log") or []),
+    }
+
+
+def _upsert_final_state_steps(session_id: str, final_state, diff: bool):
+    if not final_state:
+        if diff:
+            yield _exec("DELETE FROM session_state WHERE session_id = %s", (session_id,))
+            return (yield from _write_table_steps(session_id, "session_stakeholders", [], diff=True))
+        return None
+    stakeholders_state = final_state.get("stakeholders") if isinstance(final_state, dict) else None
+    state_values = (_json_dump(final_state.get("stakeholders")), _json_dump(final_state.get("global")))
+    yield _exec(
+        """
+        INSERT INTO session_state (session_id, stakeholders, global_state, row_hash)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (session_id) DO UPDATE SET
+            stakeholders = EXCLUDED.stakeholders,
+            global_state = EXCLUDED.global_state,
+            row_hash = EXCLUDED.row_hash
+        WHERE session_state.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+        """,
+        (session_id, *state_values, _row_hash(state_values)),
+    )
+    if not isinstance(stakeholders_state, list):
+        if diff:
+            return (yield from _write_table_steps(session_id, "session_stakeholders", [], diff=True))
+        return None
+
+    stakeholder_rows = []
+    session_stakeholder_rows = []
+    question_rows = []
+    requirements = {}
+    for stakeholder in stakeholders_state:
+        stakeholder_id = stakeholder.get("id") or stakeholder.get("shortId") or stakeholder.get("name")
+        if not stakeholder_id:
+            continue
+        stakeholder_rows.append((stakeholder_id, stakeholder.get("name"), stakeholder.get("role")))
+        session_stakeholder_rows.append((stakeholder_id, (_json_dump(stakeholder),)))
+        # Persist question definitions for this stakeholder
+        questions = stakeholder.get("questions") or []
+        if isinstance(questions, list):
+            for q in questions:
+                q_id = q.get("question_id")
+                if not q_id:
+                    continue
+                question_rows.append(
+                    (
+                        q_id,
+                        stakeholder_id,
+                        q.get("text"),
+                        q.get("answer"),
+                        _json_dump(q.get("requirements")),
+                        _json_dump(q.get("actions_required")),
+                    )
+                )
+                # one requirements entry per question; the last definition wins
+                requirements[q_id] = q.get("requirements") or {}
+
+    yield _executemany(
+        "INSERT INTO stakeholders (stakeholder_id, name, role) VALUES (%s, %s, %s) ON CONFLICT (stakeholder_id) DO NOTHING",
+        stakeholder_rows,
+    )
+    changes = yield from _write_table_steps(session_id, "session_stakeholders", session_stakeholder_rows, diff=diff)
+    yield _executemany(
+        """
+        INSERT INTO questions (pregunta_id, stakeholder_id, texto_pregunta, texto_respuesta, atributo_global_min, acciones_requeridas)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (pregunta_id) DO UPDATE SET
+            stakeholder_id = EXCLUDED.stakeholder_id,
+            texto_pregunta = EXCLUDED.texto_pregunta,
+            texto_respuesta = EXCLUDED.texto_respuesta,
+            atributo_global_min = EXCLUDED.atributo_global_min,
+            acciones_requeridas = EXCLUDED.acciones_requeridas
+        """,
+        question_rows,
+    )
+    if requirements:
+        # reset requirements entries for these questions to avoid duplicates
+        yield _exec("DELETE FROM question_requirements WHERE pregunta_id = ANY(%s)", (list(requirements),))
+        yield _executemany(
+            """
+            INSERT INTO question_requirements (pregunta_id, trust_min, support_min, reputation_min)
+            VALUES (%s, %s, %s, %s)
+            """,
+            [
+                (q_id, req.get("trust_min"), req.get("support_min"), req.get("reputation_min"))
+                for q_id, req in requirements.items()
+                if req
+            ],
+        )
+    return changes
+
+
+def _upsert_mechanics_steps(mechanic_ids, version_id):
+    yield _executemany(
+        "INSERT INTO mechanics (mechanic_id, version_id) VALUES (%s, %s) ON CONFLICT (mechanic_id) DO NOTHING",
+        [(mechanic_id, version_id) for mechanic_id in sorted(mechanic_ids)],
+    )
+
+
+def _encode_session(session: dict, payload_hash: str | None = None):
+    raw = json.dumps(session, ensure_ascii=False).encode("utf-8")
+    payload_codec, payload_bytes = encode_payload(raw)
+    return len(raw), payload_codec, payload_bytes, payload_hash or _payload_hash(session)
+
+
+def _normalize_session_steps(session_id: str, session: dict, created_at: str, payload_hash: str | None = None):
+    metadata = session.get("session_metadata", {})
+    version_id = metadata.get("simulator_version_id")
+    user_id = metadata.get("user_id")
+    start_time = metadata.get("start_time")
+    end_time = metadata.get("end_time")
+    with metric_stage("normalize", "encode_payload"):
+        raw_size, payload_codec, payload_bytes, payload_hash = yield _compute(_encode_session, session, payload_hash)
+    metric_observe("session_payload_bytes", (("kind", "raw"),), raw_size)
+    metric_observe("session_payload_bytes", (("kind", "stored"),), len(payload_bytes))
+
+    with metric_stage("normalize", "session_upsert"):
+        if user_id:
+            yield _exec(
+                "INSERT INTO users (user_id, name) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING",
+                (user_id, user_id),
+            )
+
+        if version_id:
+            yield _exec(
+                "INSERT INTO versions (version_id, created_at) VALUES (%s, %s) ON CONFLICT (version_id) DO NOTHING",
+                (version_id, created_at),
+            )
+
+        yield from _upsert_mechanics_steps(_mechanic_ids(session), version_id)
+
+        # A full payload supersedes any appended deltas, so the cursor restarts from it.
+        yield _exec(
+            """
+            INSERT INTO sessions (
+                session_id, user_id, version_id, start_time, end_time, created_at,
+                payload, payload_bytes, payload_codec, ingest_cursor, payload_hash, ingest_counts
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, NULL, %s, %s, %s, %s, %s)
+            ON CONFLICT (session_id) DO UPDATE SET
+                user_id = EXCLUDED.user_id,
+                version_id = EXCLUDED.version_id,
+                start_time = EXCLUDED.start_time,
+                end_time = EXCLUDED.end_time,
+                created_at = EXCLUDED.created_at,
+                payload = NULL,
+                payload_bytes = EXCLUDED.payload_bytes,
+                payload_codec = EXCLUDED.payload_codec,
+                ingest_cursor = EXCLUDED.ingest_cursor,
+                payload_hash = EXCLUDED.payload_hash,
+                ingest_counts = EXCLUDED.ingest_counts,
+                revision = nextval('session_revision_seq')
+            """,
+            (
+                session_id, user_id, version_id, start_time, end_time, created_at,
+                payload_bytes, payload_codec, _json_dump(_payload_cursor(session)),
+                payload_hash, _json_dump(_ingest_counts(session)),
+            ),
+        )
+
+        yield _exec("DELETE FROM session_payload_deltas WHERE session_id = %s", (session_id,))
+        # Day results are derived from the rows below, so they are recomputed after a full upload.
+        yield _exec("DELETE FROM daily_effects WHERE session_id = %s", (session_id,))
+
+    expected_ids = {
+        action.get("expected_action_id")
+        for action in session.get("expected_actions", [])
+        if action.get("expected_action_id")
+    }
+    with metric_stage("normalize", "child_rows"):
+        counts, changes = yield from _write_child_rows_steps(session_id, session, expected_ids, diff=True)
+    with metric_stage("normalize", "final_state"):
+        changes["session_stakeholders"] = yield from _upsert_final_state_steps(session_id, session.get("final_state", {}), diff=True)
+    with metric_stage("normalize", "analytics"):
+        yield from _refresh_analytics_steps([session_id])
+
+    return {"counts": counts, "changes": {table: stats for table, stats in changes.items() if stats}}
+
+
+def _append_session_steps(session_id: str, delta: dict):
+    cursor = delta.get("cursor")
+    if not isinstance(cursor, dict):
+        raise HTTPException(status_code=400, detail="cursor missing")
+
+    row = yield _fetchone(
+        "SELECT version_id, ingest_cursor FROM sessions WHERE session_id = %s FOR UPDATE",
+        (session_id,),
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="session not found")
+    # a queued full upload will replace whatever is appended now: the client must resend it
+    pending = yield _fetchone("SELECT 1 FROM ingest_queue WHERE session_id = %s", (session_id,))
+    if pending:
+        raise HTTPException(status_code=409, detail={"reason": "ingest_pending"})
+
+    stored = _json_load(row["ingest_cursor"])
+    if not isinstance(stored, dict):
+        # sessions stored before cursors existed: derive it from the payload once
+        payload_row = yield _fetchone(SESSION_PAYLOAD_SELECT + " WHERE s.session_id = %s", (session_id,))
+        stored = _payload_cursor((yield _compute(session_payload, payload_row)))
+    stored = {key: int(stored.get(key) or 0) for key in APPEND_LISTS}
+    try:
+        client_cursor = {key: int(cursor.get(key) or 0) for key in APPEND_LISTS}
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if client_cursor != stored:
+        raise HTTPException(status_code=409, detail={"reason": "cursor_mismatch", "cursor": stored})
+
+    new_cursor = {key: stored[key] + len(delta.get(key) or []) for key in APPEND_LISTS}
+    stored_delta = {key: delta[key] for key in APPEND_LISTS + ("comparisons",) if delta.get(key)}
+    if delta.get("final_state"):
+        stored_delta["final_state"] = delta["final_state"]
+    end_time = (delta.get("session_metadata") or {}).get("end_time")
+    if end_time:
+        stored_delta["session_metadata"] = {"end_time": end_time}
+
+    yield from _upsert_mechanics_steps(_mechanic_ids(delta), row["version_id"])
+
+    expected_ids = {
+        action.get("expected_action_id")
+        for action in delta.get("expected_actions") or []
+        if action.get("expected_action_id")
+    }
+    offsets = {
+        "explicit_decisions": stored["explicit_decisions"],
+        "process_logs": stored["process_log"],
+        "player_actions_log": stored["player_actions_log"],
+    }
+    if delta.get("comparisons"):
+        referenced = {
+            c.get("expected_action_id") for c in delta["comparisons"] if c.get("expected_action_id")
+        } - expected_ids
+        if referenced:
+            rows = yield _fetchall(
+                "SELECT expected_action_id FROM expected_actions WHERE expected_action_id = ANY(%s)",
+                (list(referenced),),
+            )
+            expected_ids |= {r["expected_action_id"] for r in rows}
+        count_row = yield _fetchone(
+            "SELECT COUNT(*) AS n FROM comparisons WHERE session_id = %s AND row_key IS NOT NULL",
+            (session_id,),
+        )
+        offsets["comparisons"] = count_row["n"]
+
+    counts, _ = yield from _write_child_rows_steps(session_id, delta, expected_ids, diff=False, offsets=offsets)
+    yield from _upsert_final_state_steps(session_id, delta.get("final_state"), diff=False)
+
+    if stored_delta:
+        yield _exec(
+            """
+            INSERT INTO session_payload_deltas (session_id, seq, delta, created_at)
+            SELECT %s, COALESCE(MAX(seq), 0) + 1, %s, %s
+            FROM session_payload_deltas WHERE session_id = %s
+            """,
+            (session_id, _json_dump(stored_delta), datetime.now(timezone.utc).isoformat(), session_id),
+        )
+    yield _exec(
+        """
+        UPDATE sessions SET ingest_cursor = %s, end_time = COALESCE(%s, end_time), payload_hash = NULL,
+            revision = nextval('session_revision_seq')
+        WHERE session_id = %s
+        """,
+        (_json_dump(new_cursor), end_time, session_id),
+    )
+    if counts["comparisons"] or counts["process_log"]:
+        yield from _refresh_analytics_steps([session_id])
+
+    return {"ok": True, "session_id": session_id, "cursor": new_cursor, "counts": counts}
+
+
+def normalize_session(conn, session_id: str, session: dict, created_at: str):
+    return run_sync(conn, _normalize_session_steps(session_id, session, created_at))
+
+
+async def normalize_session_async(aconn, session_id: str, session: dict, created_at: str):
+    return await run_async(aconn, _normalize_session_steps(session_id, session, created_at))
+
+
+def _upload_precheck_steps(session_id: str, payload_hash: str, idempotency_key: str | None):
+    # Read-only: what a repeated upload can be answered with without opening a write transaction.
+    return (yield _fetchone(
+        """
+        SELECT s.payload_hash, s.ingest_counts,
+               q.payload_hash AS queued_hash, q.failed AS queued_failed, q.uploads AS queued_uploads,
+               k.session_id AS key_session_id, k.payload_hash AS key_payload_hash, k.status_code, k.response
+        FROM (SELECT %s::text AS session_id) r
+        LEFT JOIN sessions s ON s.session_id = r.session_id
+        LEFT JOIN ingest_queue q ON q.session_id = r.session_id
+        LEFT JOIN idempotency_keys k ON k.idempotency_key = %s
+             AND k.created_at > now() - %s * interval '1 hour'
+        """,
+        (session_id, idempotency_key, IDEMPOTENCY_KEY_TTL_HOURS),
+    ))
+
+
+def _remember_idempotency_key_steps(idempotency_key: str, session_id: str, payload_hash: str, status_code: int, body: dict):
+    # Written in the upload's own transaction, so a key is only remembered for work that committed.
+    yield _exec(
+        """
+        INSERT INTO idempotency_keys (idempotency_key, session_id, payload_hash, status_code, response)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (idempotency_key) DO UPDATE SET
+            session_id = EXCLUDED.session_id,
+            payload_hash = EXCLUDED.payload_hash,
+            status_code = EXCLUDED.status_code,
+            response = EXCLUDED.response,
+            created_at = now()
+        """,
+        (idempotency_key, session_id, payload_hash, status_code, _json_dump(body)),
+    )
+    yield _exec(
+        """
+        DELETE FROM idempotency_keys WHERE idempotency_key IN (
+            SELECT idempotency_key FROM idempotency_keys
+            WHERE created_at < now() - %s * interval '1 hour'
+            LIMIT 100
+        )
+        """,
+        (IDEMPOTENCY_KEY_TTL_HOURS,),
+    )
+
+
+def _create_session_steps(session_id: str, session: dict, created_at: str, payload_hash: str, idempotency_key: str | None):
+    result = yield from _normalize_session_steps(session_id, session, created_at, payload_hash)
+    body = {"ok": True, "session_id": session_id, **result, "cursor": _payload_cursor(session)}
+    if idempotency_key is not None:
+        yield from _remember_idempotency_key_steps(idempotency_key, session_id, payload_hash, 200, body)
+    return body
+
+
+def _json_object_body(raw: bytes) -> dict:
+    # Session uploads are read as raw bytes and parsed here, in the threadpool: FastAPI's Body()
+    # decodes on the event loop, which stalls every other request for a multi-MB payload.
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid JSON body")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=422, detail="JSON object expected")
+    return body
+
+
+@app.post("/sessions")
+async def create_session(request: Request):
+    session = await run_in_threadpool(_json_object_body, await request.body())
+    metadata = session.get("session_metadata", {})
+    session_id = metadata.get("session_id")
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_metadata.session_id missing")
+
+    if STORAGE_BACKEND == "sqlite":
+        return await run_in_threadpool(local_save_session, session)
+
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 255 characters")
+    payload_hash = await run_in_threadpool(_payload_hash, session)
+    check = await run_db(_upload_precheck_steps(session_id, payload_hash, idempotency_key))
+    if check["key_session_id"] is not None:
+        if (check["key_session_id"], check["key_payload_hash"]) != (session_id, payload_hash):
+            raise HTTPException(status_code=422, detail={"reason": "idempotency_key_reused"})
+        metric_inc("session_uploads_skipped_total", (("reason", "idempotency_key"),))
+        return Response(
+            content=_json_bytes(check["response"]), status_code=check["status_code"],
+            media_type="application/json", headers={"Idempotent-Replayed": "true"},
+        )
+    if check["queued_hash"] == payload_hash and not check["queued_failed"]:
+        # the same document is already waiting in the ingest queue
+        metric_inc("session_uploads_skipped_total", (("reason", "queued_hash"),))
+        body = _queued_body(session_id, session, check["queued_uploads"])
+        return Response(content=_json_bytes({**body, "deduplicated": True}), status_code=202, media_type="application/json")
+    if check["queued_hash"] is None and check["payload_hash"] == payload_hash:
+        metric_inc("session_uploads_skipped_total", (("reason", "content_hash"),))
+        return {
+            "ok": True,
+            "session_id": session_id,
+            "counts": check["ingest_counts"],
+            "changes": {},
+            "cursor": _payload_cursor(session),
+            "deduplicated": True,
+        }
+
+    if INGEST_MODE == "queue":
+        return await enqueue_session(session_id, session, payload_hash, idempotency_key)
+
+    created_at = datetime.now(timezone.utc).isoformat()
+    return await run_db(_create_session_steps(session_id, session, created_at, payload_hash, idempotency_key))
+
+
+@app.post("/sessions/{session_id}/append")
+async def append_session(session_id: str, request: Request):
+    if STORAGE_BACKEND == "sqlite":
+        # the local store only takes full uploads (it hands out no cursor): the client resends one
+        raise HTTPException(status_code=409, detail={"reason": "append_unsupported"})
+    delta = await run_in_threadpool(_json_object_body, await request.body())
+    return await run_db(_append_session_steps(session_id, delta))
+
+
+@app.post("/sessions/{session_id}/normalize")
+def normalize_existing_session(session_id: str):
+    with get_conn() as conn:
+        row = conn.execute(SESSION_PAYLOAD_SELECT + " WHERE s.session_id = %s", (session_id,)).fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="session not found")
-    return get_session_normalized(row["session_id"])
+
+        session = session_payload(row)
+        conn.execute("BEGIN")
+        result = normalize_session(conn, session_id, session, row["created_at"])
+        conn.commit()
+
+    return {"ok": True, "session_id": session_id, **result}
+
+
+# ---- Write-behind ingest (INGEST_MODE=queue) ----
+# POST /sessions only stores the compressed payload in ingest_queue (one row per session, so a
+# newer upload replaces the pending one) and answers 202. The worker started by the lifespan
+# claims rows with a lease (FOR UPDATE SKIP LOCKED, so several app processes can run one),
+# normalizes each with the same steps as the inline path, and deletes the row only if no newer
+# upload arrived meanwhile; otherwise it releases the claim and the newest payload goes next.
+# Failures are retried with a linear backoff and kept as failed after INGEST_MAX_ATTEMPTS.
+_ingest_wakeup: asyncio.Event | None = None  # created by the worker, on the app's event loop
+
+
+def _wake_ingest_worker():
+    if _ingest_wakeup is not None:
+        _ingest_wakeup.set()
+
+
+def _queued_body(session_id: str, session: dict, uploads: int) -> dict:
+    return {
+        "ok": True,
+        "session_id": session_id,
+        "status": "queued",
+        "uploads": uploads,
+        "cursor": _payload_cursor(session),
+    }
+
+
+def _enqueue_session_steps(session_id: str, session: dict, received_at: str, payload_hash: str,
+                           idempotency_key: str | None = None):
+    _, payload_codec, payload_bytes, _ = yield _compute(_encode_session, session, payload_hash)
+    # the lease is kept on replace: a worker busy with the older payload still owns the session
+    row = yield _fetchone(
+        """
+        INSERT INTO ingest_queue (session_id, seq, payload_bytes, payload_codec, received_at, payload_hash)
+        VALUES (%s, nextval('ingest_seq'), %s, %s, %s, %s)
+        ON CONFLICT (session_id) DO UPDATE SET
+            seq = EXCLUDED.seq,
+            payload_bytes = EXCLUDED.payload_bytes,
+            payload_codec = EXCLUDED.payload_codec,
+            payload_hash = EXCLUDED.payload_hash,
+            received_at = EXCLUDED.received_at,
+            uploads = ingest_queue.uploads + 1,
+            attempts = 0,
+            last_error = NULL,
+            failed = FALSE,
+            not_before = NULL
+        RETURNING seq, uploads
+        """,
+        (session_id, payload_bytes, payload_codec, received_at, payload_hash),
+    )
+    body = _queued_body(session_id, session, row["uploads"])
+    if idempotency_key is not None:
+        yield from _remember_idempotency_key_steps(idempotency_key, session_id, payload_hash, 202, body)
+    yield _commit()
+    return body
+
+
+async def enqueue_session(session_id: str, session: dict, payload_hash: str, idempotency_key: str | None = None) -> Response:
+    received_at = datetime.now(timezone.utc).isoformat()
+    body = await run_db(_enqueue_session_steps(session_id, session, received_at, payload_hash, idempotency_key))
+    metric_inc("ingest_jobs_total", (("result", "enqueued"),))
+    if body["uploads"] > 1:
+        metric_inc("ingest_jobs_total", (("result", "coalesced"),))
+    _wake_ingest_worker()
+    return Response(content=_json_bytes(body), status_code=202, media_type="application/json")
+
+
+class IngestLeaseLost(Exception):
+    # The job's lease expired and another claim took the row: its work is rolled back.
+    pass
+
+
+def _claim_ingest_steps(limit: int):
+    rows = yield _fetchall(
+        """
+        UPDATE ingest_queue q SET claimed_until = now() + make_interval(secs => %s), claim_token = %s
+        WHERE q.session_id IN (
+            SELECT session_id FROM ingest_queue
+            WHERE NOT failed
+              AND (claimed_until IS NULL OR claimed_until < now())
+              AND (not_before IS NULL OR not_before <= now())
+            ORDER BY seq
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING q.session_id, q.seq, q.payload_bytes, q.payload_codec, q.received_at, q.payload_hash,
+                  q.claim_token
+        """,
+        (INGEST_LEASE_SECONDS, os.urandom(8).hex(), limit),
+    )
+    yield _commit()
+    return rows
+
+
+def _process_ingest_steps(job):
+    session = yield _compute(session_payload, job)
+    with metric_stage("ingest", "normalize"):
+        result = yield from _normalize_session_steps(
+            job["session_id"], session, job["received_at"], job["payload_hash"]
+        )
+    # Commit only while this claim still holds the lease. The row lock also keeps a claim that
+    # comes after an expired lease from taking the row until this transaction ends.
+    owner = yield _fetchone(
+        "SELECT seq FROM ingest_queue WHERE session_id = %s AND claim_token = %s FOR UPDATE",
+        (job["session_id"], job["claim_token"]),
+    )
+    if owner is None:
+        raise IngestLeaseLost(job["session_id"])
+    if owner["seq"] == job["seq"]:
+        yield _exec("DELETE FROM ingest_queue WHERE session_id = %s", (job["session_id"],))
+    else:
+        yield _exec(
+            "UPDATE ingest_queue SET claimed_until = NULL, claim_token = NULL WHERE session_id = %s",
+            (job["session_id"],),
+        )
+    yield _commit()
+    return result
+
+
+def _fail_ingest_steps(job, error: str):
+    # Backoff of 5s per attempt. A newer upload (other seq) already reset the counters: only the
+    # claim is released then. A row claimed again meanwhile belongs to the new claim: untouched.
+    yield _exec(
+        """
+        UPDATE ingest_queue SET
+            attempts = attempts + 1,
+            last_error = %s,
+            failed = attempts + 1 >= %s,
+            not_before = now() + make_interval(secs => 5 * (attempts + 1))
+        WHERE session_id = %s AND seq = %s AND claim_token = %s
+        """,
+        (error[:2000], INGEST_MAX_ATTEMPTS, job["session_id"], job["seq"], job["claim_token"]),
+    )
+    yield _exec(
+        "UPDATE ingest_queue SET claimed_until = NULL, claim_token = NULL WHERE session_id = %s AND claim_token = %s",
+        (job["session_id"], job["claim_token"]),
+    )
+    yield _commit()
+
+
+async def drain_ingest_queue(limit: int = INGEST_BATCH) -> int:
+    jobs = await run_db(_claim_ingest_steps(limit))
+    for job in jobs:
+        try:
+            await run_db(_process_ingest_steps(job))
+            metric_inc("ingest_jobs_total", (("result", "normalized"),))
+        except IngestLeaseLost:
+            logger.warning("ingest of session %s outlived its lease; result dropped", job["session_id"])
+            metric_inc("ingest_jobs_total", (("result", "lease_lost"),))
+        except Exception as exc:
+            logger.warning("ingest of session %s failed", job["session_id"], exc_info=True)
+            metric_inc("ingest_jobs_total", (("result", "failed"),))
+            await run_db(_fail_ingest_steps(job, f"{type(exc).__name__}: {exc}"))
+    return len(jobs)
+
+
+async def _ingest_worker():
+    global _ingest_wakeup
+    _ingest_wakeup = asyncio.Event()
+    while True:
+        try:
+            if await drain_ingest_queue():
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # e.g. database unavailable: rows stay queued, try again after the poll interval
+            logger.exception("ingest worker pass failed")
+            metric_inc("background_errors_total", (("worker", "ingest"),))
+        _ingest_wakeup.clear()
+        try:
+            await asyncio.wait_for(_ingest_wakeup.wait(), INGEST_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _ingest_pending_steps(session_ids: list):
+    return (yield _fetchall(
+        "SELECT session_id, failed, last_error FROM ingest_queue WHERE session_id = ANY(%s)", (session_ids,)
+    ))
+
+
+async def wait_for_ingest(session_ids: list):
+    # Blocks until none of the sessions has a queued upload, so a day is never resolved
+    # against rows the pending normalization is about to replace.
+    deadline = time.monotonic() + INGEST_WAIT_TIMEOUT
+    delay = 0.05
+    while True:
+        pending = await run_db(_ingest_pending_steps(session_ids))
+        if not pending:
+            return
+        failed = [r for r in pending if r["failed"]]
+        if failed:
+            raise HTTPException(status_code=409, detail={
+                "reason": "ingest_failed",
+                "sessions": {r["session_id"]: r["last_error"] for r in failed},
+            })
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=503,
+                detail={"reason": "ingest_pending", "sessions": [r["session_id"] for r in pending]},
+                headers={"Retry-After": "1"},
+            )
+        _wake_ingest_worker()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+
+def _ingest_status_steps(session_id: str):
+    row = yield _fetchone(
+        """
+        SELECT q.seq, q.received_at, q.uploads, q.attempts, q.last_error, q.failed,
+               q.claimed_until > now() AS processing, s.revision, s.created_at
+        FROM (SELECT %s::text AS session_id) k
+        LEFT JOIN ingest_queue q ON q.session_id = k.session_id
+        LEFT JOIN sessions s ON s.session_id = k.session_id
+        """,
+        (session_id,),
+    )
+    if row["seq"] is None and row["revision"] is None:
+        raise HTTPException(status_code=404, detail="session not found")
+    if row["seq"] is None:
+        status = "done"
+    elif row["failed"]:
+        status = "failed"
+    elif row["processing"]:
+        status = "processing"
+    else:
+        status = "queued"
+    return {
+        "session_id": session_id,
+        "status": status,
+        "received_at": row["received_at"],
+        "uploads": row["uploads"],
+        "attempts": row["attempts"],
+        "last_error": row["last_error"],
+        "created_at": row["created_at"],
+        "revision": row["revision"],
+    }
+
+
+@app.get("/sessions/{session_id}/ingest")
+async def get_ingest_status(session_id: str):
+    return await run_db(_ingest_status_steps(session_id))
+
+
+# ---- Bulk re-normalization (POST /sessions/normalize, rebuild_db.py) ----
+# A run walks the sessions with a server-side cursor and normalizes them in chunks, one
+# transaction per chunk. Each session is checkpointed (ok/failed) in the same transaction, so an
+# interrupted run resumes with the sessions that are not done yet; failed ones are retried.
+NORMALIZE_PENDING_SQL = """
+    FROM sessions s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM normalize_checkpoints c
+        WHERE c.run_id = %s AND c.session_id = s.session_id AND c.status = 'ok'
+    )
+"""
+NORMALIZE_DEADLOCK_RETRIES = 3
+
+
+def start_normalize_run(conn, chunk_size: int, run_id: str | None = None, restart: bool = False) -> dict:
+    # Resumes `run_id`, or the latest unfinished run unless `restart`; otherwise starts a new one.
+    row = None
+    if run_id:
+        row = conn.execute("SELECT run_id FROM normalize_runs WHERE run_id = %s", (run_id,)).fetchone()
+    elif not restart:
+        row = conn.execute(
+            "SELECT run_id FROM normalize_runs WHERE finished_at IS NULL ORDER BY started_at DESC LIMIT 1"
+        ).fetchone()
+    resumed = row is not None
+    if not resumed:
+        run_id = run_id or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + os.urandom(3).hex()
+        conn.execute(
+            "INSERT INTO normalize_runs (run_id, started_at, chunk_size) VALUES (%s, %s, %s)",
+            (run_id, datetime.now(timezone.utc).isoformat(), chunk_size),
+        )
+    else:
+        run_id = row["run_id"]
+        conn.execute("UPDATE normalize_runs SET finished_at = NULL WHERE run_id = %s", (run_id,))
+    pending = conn.execute("SELECT COUNT(*) AS n " + NORMALIZE_PENDING_SQL, (run_id,)).fetchone()["n"]
+    conn.commit()
+    return {"run_id": run_id, "resumed": resumed, "pending": pending}
+
+
+def iter_pending_session_chunks(conn, run_id: str, chunk_size: int):
+    # Server-side cursor: only session ids are streamed, payloads are read per chunk by the worker.
+    # Uses its own connection (the transaction stays open while iterating).
+    with conn.cursor(name=f"normalize_{run_id}".replace("-", "_")) as cur:
+        cur.itersize = chunk_size
+        cur.execute("SELECT s.session_id " + NORMALIZE_PENDING_SQL + " ORDER BY s.session_id", (run_id,))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [r["session_id"] for r in rows]
+    conn.rollback()
+
+
+def _normalize_one(conn, row):
+    for attempt in range(NORMALIZE_DEADLOCK_RETRIES):
+        try:
+            with conn.transaction():
+                normalize_session(conn, row["session_id"], session_payload(row), row["created_at"])
+            return None
+        except psycopg.errors.DeadlockDetected as exc:
+            # parallel chunks can insert the same new users/versions in different order
+            if attempt == NORMALIZE_DEADLOCK_RETRIES - 1:
+                return f"{type(exc).__name__}: {exc}"
+        except (psycopg.DataError, psycopg.IntegrityError, ValueError, TypeError, KeyError, AttributeError) as exc:
+            return f"{type(exc).__name__}: {exc}"
+
+
+def normalize_chunk(conn, run_id: str, session_ids: list) -> dict:
+    # One transaction per chunk; each session runs in a savepoint, so a bad payload is
+    # checkpointed as failed without rolling back the rest of the chunk.
+    ok, failures = 0, []
+    with conn.transaction():
+        rows = conn.execute(SESSION_PAYLOAD_SELECT + " WHERE s.session_id = ANY(%s)", (session_ids,)).fetchall()
+        checkpoints = []
+        for row in rows:
+            error = _normalize_one(conn, row)
+            if error is None:
+                ok += 1
+            else:
+                failures.append({"session_id": row["session_id"], "error": error})
+            checkpoints.append(
+                (run_id, row["session_id"], "ok" if error is None else "failed", error, datetime.now(timezone.utc).isoformat())
+            )
+        conn.cursor().executemany(
+            """
+            INSERT INTO normalize_checkpoints (run_id, session_id, status, error, finished_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (run_id, session_id) DO UPDATE SET
+                status = EXCLUDED.status, error = EXCLUDED.error, finished_at = EXCLUDED.finished_at
+            """,
+            checkpoints,
+        )
+    return {"processed": ok, "failed": len(failures), "failures": failures, "missing": len(session_ids) - len(rows)}
+
+
+def finish_normalize_run(conn, run_id: str) -> dict:
+    rows = conn.execute(
+        "SELECT status, COUNT(*) AS n FROM normalize_checkpoints WHERE run_id = %s GROUP BY status", (run_id,)
+    ).fetchall()
+    totals = {r["status"]: r["n"] for r in rows}
+    if not totals.get("failed"):
+        conn.execute(
+            "UPDATE normalize_runs SET finished_at = %s WHERE run_id = %s", (datetime.now(timezone.utc).isoformat(), run_id)
+        )
+    conn.commit()
+    return {"ok": totals.get("ok", 0), "failed": totals.get("failed", 0)}
+
+
+@app.post("/sessions/normalize")
+def normalize_all_sessions(chunk_size: int = 100, run_id: str | None = None, restart: bool = False):
+    chunk_size = max(1, chunk_size)
+    processed, failures = 0, []
+    with get_conn() as conn, get_conn() as stream_conn:
+        run = start_normalize_run(conn, chunk_size, run_id, restart)
+        for chunk in iter_pending_session_chunks(stream_conn, run["run_id"], chunk_size):
+            result = normalize_chunk(conn, run["run_id"], chunk)
+            processed += result["processed"]
+            failures.extend(result["failures"])
+        totals = finish_normalize_run(conn, run["run_id"])
+
+    return {
+        "ok": True,
+        "run_id": run["run_id"],
+        "resumed": run["resumed"],
+        "processed": processed,
+        "failed": len(failures),
+        "failures": failures[:100],
+        "run_totals": totals,
+    }
+
+
+def _cached_day_result(session_id: str, day: int, row) -> dict:
+    return {
+        "ok": True,
+        "session_id": session_id,
+        "day": day,
+        "comparisons": _json_load(row["comparisons"]) or [],
+        "global_deltas": _json_load(row["global_deltas"]) or {},
+        "stakeholder_deltas": _json_load(row["stakeholder_deltas"]) or {},
+        "cached": True,
+        "cache": "hit",
+        "fingerprint": row["fingerprint"],
+    }
+
+
+def _missing_expected_result(session_id: str, day: int, message: str) -> dict:
+    return {
+        "ok": False,
+        "reason": "missing_expected_actions",
+        "message": message,
+        "session_id": session_id,
+        "day": day
+    }
+
+
+# Bump when resolve_day changes what it produces for the same inputs, to invalidate stored days.
+DAY_EFFECTS_VERSION = 1
+
+
+def _day_fingerprint(rules_version: str | None, expected_hash: str, canonical_hash: str) -> str:
+    raw = f"{DAY_EFFECTS_VERSION}|{rules_version}|{expected_hash}|{canonical_hash}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _lookup_days_steps(pairs: list):
+    # One query for session existence, the daily_effects cache and the current input fingerprint
+    # of every (session_id, day). The inputs are the same row sets _compute_days_steps reads:
+    # expected actions that apply to the day and the canonical actions that can match them,
+    # summarized by their stored content hashes. A cached day is only reused while the
+    # fingerprint it was computed from (plus the rules spec version) is unchanged.
+    with metric_stage("resolve", "lookup"):
+        rows = yield _fetchall(
+            """
+            SELECT p.session_id, p.day, s.session_id IS NOT NULL AS found,
+                   de.day IS NOT NULL AS cached, de.comparisons, de.global_deltas, de.stakeholder_deltas,
+                   de.fingerprint AS stored_fingerprint,
+                   (SELECT md5(COALESCE(string_agg(e.expected_action_id || ':' || COALESCE(e.row_hash, md5(e::text)), ','
+                                                   ORDER BY e.expected_action_id), ''))
+                    FROM expected_actions e
+                    WHERE e.session_id = p.session_id AND (e.day_index IS NULL OR e.day_index = p.day_index)
+                   ) AS expected_hash,
+                   (SELECT md5(COALESCE(string_agg(c.canonical_action_id || ':' || COALESCE(c.row_hash, md5(c::text)), ','
+                                                   ORDER BY c.canonical_action_id), ''))
+                    FROM canonical_actions c
+                    WHERE c.session_id = p.session_id
+                      AND EXISTS (
+                            SELECT 1 FROM expected_actions e
+                            WHERE e.session_id = c.session_id
+                              AND e.action_type IS NOT DISTINCT FROM c.action_type
+                              AND e.target_ref IS NOT DISTINCT FROM c.target_ref
+                              AND (e.day_index IS NULL OR e.day_index = p.day_index)
+                      )
+                   ) AS canonical_hash
+            FROM unnest(%s::text[], %s::int[], %s::int[]) AS p(session_id, day, day_index)
+            LEFT JOIN sessions s ON s.session_id = p.session_id
+            LEFT JOIN daily_effects de ON de.session_id = p.session_id AND de.day = p.day
+            """,
+            (
+                [sid for sid, _ in pairs],
+                [day for _, day in pairs],
+                [_day_index_from_value(day) for _, day in pairs],
+            ),
+        )
+    rules_version = current_rules_version()
+    lookup = {}
+    for r in rows:
+        r["fingerprint"] = _day_fingerprint(rules_version, r["expected_hash"], r["canonical_hash"])
+        if not r["cached"]:
+            r["cache"] = "miss"
+        elif r["stored_fingerprint"] != r["fingerprint"]:
+            r["cache"] = "stale"
+        else:
+            r["cache"] = "hit"
+        lookup[(r["session_id"], r["day"])] = r
+    return lookup
+
+
+def _match_days(pairs: list, expected_rows: list, canonical_rows: list, with_expected: set, rules: dict,
+                lookup: dict, force: bool):
+    # Pure part of _compute_days_steps: results per (session_id, day) and the pairs to write.
+    expected_by_session = {}
+    for r in expected_rows:
+        expected_by_session.setdefault(r["session_id"], []).append(_expected_from_row(r))
+    canonical_by_session = {}
+    for r in canonical_rows:
+        canonical_by_session.setdefault(r["session_id"], []).append(_canonical_from_row(r))
+
+    results = {}
+    written = []
+    indexes = {}
+    for session_id, day in pairs:
+        if session_id not in with_expected:
+            results[(session_id, day)] = _missing_expected_result(
+                session_id, day,
+                "No expected_actions found in DB for this session. Send session payload before resolving day.",
+            )
+            continue
+        if session_id not in indexes:
+            indexes[session_id] = _build_canonical_index(canonical_by_session.get(session_id, []))
+        comparisons, global_deltas, stakeholder_deltas = resolve_day(
+            expected_by_session.get(session_id, []), indexes[session_id], day, rules
+        )
+        if len(comparisons) == 0:
+            results[(session_id, day)] = _missing_expected_result(
+                session_id, day, "No valid comparisons to persist because expected_actions are missing."
+            )
+            continue
+        results[(session_id, day)] = {
+            "ok": True,
+            "session_id": session_id,
+            "day": day,
+            "comparisons": comparisons,
+            "global_deltas": global_deltas,
+            "stakeholder_deltas": stakeholder_deltas,
+            "cached": False,
+            "cache": "forced" if force else lookup[(session_id, day)]["cache"],
+            "fingerprint": lookup[(session_id, day)]["fingerprint"],
+        }
+        written.append((session_id, day))
+    return results, written
+
+
+def _day_comparison_rows(day_comparisons) -> list:
+    # (session_id, day, comparisons) -> rows in COMPARISONS_COPY_SQL column order
+    return [
+        (
+            session_id,
+            day,
+            cmp["expected_action_id"],
+            cmp["canonical_action_id"],
+            cmp["outcome"],
+            _json_dump(cmp.get("deviation")),
+            cmp.get("rule_id"),
+        )
+        for session_id, day, comparisons in day_comparisons
+        for cmp in comparisons
+    ]
+
+
+def _day_write_rows(results: dict, written: list, created_at: str):
+    comparison_rows = _day_comparison_rows(
+        (session_id, day, results[(session_id, day)]["comparisons"]) for session_id, day in written
+    )
+    effect_rows = [
+        (
+            session_id,
+            day,
+            _json_dump(results[(session_id, day)]["comparisons"]),
+            _json_dump(results[(session_id, day)]["global_deltas"]),
+            _json_dump(results[(session_id, day)]["stakeholder_deltas"]),
+            created_at,
+            "applied",
+            results[(session_id, day)]["fingerprint"],
+        )
+        for session_id, day in written
+    ]
+    return comparison_rows, effect_rows
+
+
+def _compute_days_steps(pairs: list, lookup: dict, force: bool = False):
+    # Resolves every (session_id, day) in `pairs` (sessions must exist): expected/canonical
+    # actions are loaded once for all sessions, the canonical index is built once per session,
+    # and comparisons/daily_effects are written in bulk, replacing the previous comparisons of
+    # those days. `lookup` (from _lookup_days_steps) gives the input fingerprint stored with
+    # each day; if the inputs change in between, the next lookup just sees a stale fingerprint.
+    session_ids = list(dict.fromkeys(sid for sid, _ in pairs))
+    day_indexes = list({_day_index_from_value(day) for _, day in pairs} - {None})
+
+    # Only expected actions that apply to a requested day (no day constraint or the same weekday),
+    # and only canonical actions that can match one of them (same action_type + target_ref).
+    with metric_stage("resolve", "load_actions"):
+        expected_rows = yield _fetchall(
+            """
+            SELECT session_id, expected_action_id, source_node_id, source_option_id, action_type, target_ref,
+                   constraints, rule_id, created_at, mechanic_id, effects
+            FROM expected_actions
+            WHERE session_id = ANY(%s) AND (day_index IS NULL OR day_index = ANY(%s))
+            """,
+            (session_ids, day_indexes),
+        )
+        canonical_rows = []
+        if expected_rows:
+            canonical_rows = yield _fetchall(
+                """
+                SELECT session_id, canonical_action_id, mechanic_id, action_type, target_ref, value_final, committed_at, context
+                FROM canonical_actions c
+                WHERE session_id = ANY(%s)
+                  AND EXISTS (
+                        SELECT 1 FROM expected_actions e
+                        WHERE e.session_id = c.session_id
+                          AND e.action_type IS NOT DISTINCT FROM c.action_type
+                          AND e.target_ref IS NOT DISTINCT FROM c.target_ref
+                          AND (e.day_index IS NULL OR e.day_index = ANY(%s))
+                  )
+                """,
+                (session_ids, day_indexes),
+            )
+
+    expected_sessions = {r["session_id"] for r in expected_rows}
+    without_rows = [sid for sid in session_ids if sid not in expected_sessions]
+    with_expected = set(expected_sessions)
+    if without_rows:
+        found = yield _fetchall(
+            "SELECT DISTINCT session_id FROM expected_actions WHERE session_id = ANY(%s)", (without_rows,)
+        )
+        with_expected.update(r["session_id"] for r in found)
+
+    rules = current_rules()
+    with metric_stage("resolve", "match_rules"):
+        results, written = yield _compute(
+            _match_days, pairs, expected_rows, canonical_rows, with_expected, rules, lookup, force
+        )
+
+    if not written:
+        return results
+
+    first_days = {}
+    for session_id, day in written:
+        first_days[session_id] = min(day, first_days.get(session_id, day))
+    written_sessions = sorted(first_days)
+
+    with metric_stage("resolve", "write"):
+        created_at = datetime.now(timezone.utc).isoformat()
+        comparison_rows, effect_rows = yield _compute(_day_write_rows, results, written, created_at)
+        # Session row locks first, in id order: comparisons has no unique key per (session, day),
+        # so two resolves of the same day must not both delete and then both copy. They also
+        # serialize the derived-table refreshes below per session.
+        yield _exec(
+            "SELECT 1 FROM sessions WHERE session_id = ANY(%s) ORDER BY session_id FOR UPDATE",
+            (written_sessions,),
+        )
+        yield _executemany("DELETE FROM comparisons WHERE session_id = %s AND day = %s", written)
+        yield _copy(COMPARISONS_COPY_SQL, comparison_rows)
+        yield _executemany(
+            """
+            INSERT INTO daily_effects (session_id, day, comparisons, global_deltas, stakeholder_deltas, created_at, status, fingerprint)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (session_id, day) DO UPDATE SET
+                comparisons = EXCLUDED.comparisons,
+                global_deltas = EXCLUDED.global_deltas,
+                stakeholder_deltas = EXCLUDED.stakeholder_deltas,
+                created_at = EXCLUDED.created_at,
+                status = EXCLUDED.status,
+                fingerprint = EXCLUDED.fingerprint
+            """,
+            effect_rows,
+        )
+    metric_inc("db_rows_written_total", (("table", "comparisons"), ("op", "insert")),
+               sum(len(results[key]["comparisons"]) for key in written))
+    metric_inc("db_rows_written_total", (("table", "daily_effects"), ("op", "upsert")), len(written))
+
+    with metric_stage("resolve", "derived"):
+        yield _exec(
+            "UPDATE sessions SET revision = nextval('session_revision_seq') WHERE session_id = ANY(%s)",
+            (written_sessions,),
+        )
+        yield from _refresh_trajectory_steps(first_days)
+        yield from _refresh_analytics_steps(written_sessions, latency=False)
+    yield _commit()
+    return results
+
+
+def _resolve_day_effects_steps(session_id: str, day: int, payload: dict | None, force: bool = False):
+    lookup = yield from _lookup_days_steps([(session_id, day)])
+    row = lookup[(session_id, day)]
+    # ensure session exists
+    if not row["found"]:
+        raise HTTPException(status_code=404, detail="session not found")
+    if row["cache"] == "hit" and not force and not payload:
+        return _cached_day_result(session_id, day, row)
+
+    # Optional upsert for expected/canonical provided in payload of the day (only the ones realmente elegidas)
+    if payload:
+        expected_payload = payload.get("expected_actions") or []
+        canonical_payload = payload.get("canonical_actions") or []
+        # Upsert expected first (no deletes), then canonical actions sent for this day
+        yield from _write_table_steps(
+            session_id, "expected_actions", [_expected_action_row(action) for action in expected_payload], diff=False
+        )
+        yield from _write_table_steps(
+            session_id, "canonical_actions", [_canonical_action_row(action) for action in canonical_payload], diff=False
+        )
+        yield _exec(
+            "UPDATE sessions SET payload_hash = NULL, revision = nextval('session_revision_seq') WHERE session_id = %s",
+            (session_id,),
+        )
+        yield _commit()
+        # the upserted actions may or may not change this day's inputs
+        lookup = yield from _lookup_days_steps([(session_id, day)])
+        row = lookup[(session_id, day)]
+        if row["cache"] == "hit" and not force:
+            return _cached_day_result(session_id, day, row)
+
+    results = yield from _compute_days_steps([(session_id, day)], lookup, force)
+    return results[(session_id, day)]
+
+
+@app.post("/sessions/{session_id}/resolve_day_effects")
+async def resolve_day_effects(
+    session_id: str, day: int, payload: dict | None = Body(default=None), force: bool = False, wait_ingest: bool = False
+):
+    if day is None:
+        raise HTTPException(status_code=400, detail="day is required")
+    if wait_ingest and STORAGE_BACKEND == "postgres":
+        await wait_for_ingest([session_id])
+    if STORAGE_BACKEND == "sqlite":
+        return await run_in_threadpool(local_resolve_day, session_id, day, payload, force)
+
+    return await run_db(_resolve_day_effects_steps(session_id, day, payload, force))
+
+
+def _resolve_days_batch_steps(pairs: list, force: bool):
+    lookup = yield from _lookup_days_steps(pairs)
+    results = {}
+    pending = []
+    for session_id, day in pairs:
+        row = lookup[(session_id, day)]
+        if not row["found"]:
+            results[(session_id, day)] = {"ok": False, "reason": "session_not_found", "session_id": session_id, "day": day}
+        elif row["cache"] == "hit" and not force:
+            results[(session_id, day)] = _cached_day_result(session_id, day, row)
+        else:
+            pending.append((session_id, day))
+    if pending:
+        computed = yield from _compute_days_steps(pending, lookup, force)
+        results.update(computed)
+    return results
+
+
+@app.post("/sessions/resolve_day_effects")
+async def resolve_day_effects_batch(payload: dict = Body(...)):
+    # Body: {"items": [{"session_id", "day"}, ...], "force": false, "wait_ingest": false}
+    items = payload.get("items") or []
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="items is required")
+    if len(items) > MAX_RESOLVE_BATCH:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_RESOLVE_BATCH} items per batch")
+    pairs = []
+    for item in items:
+        session_id = item.get("session_id") if isinstance(item, dict) else None
+        day = item.get("day") if isinstance(item, dict) else None
+        if not isinstance(session_id, str) or not isinstance(day, int) or isinstance(day, bool):
+            raise HTTPException(status_code=400, detail="each item needs session_id (string) and day (int)")
+        pairs.append((session_id, day))
+    unique = list(dict.fromkeys(pairs))
+
+    if payload.get("wait_ingest") and STORAGE_BACKEND == "postgres":
+        await wait_for_ingest(list(dict.fromkeys(sid for sid, _ in unique)))
+    if STORAGE_BACKEND == "sqlite":
+        results = await run_in_threadpool(local_resolve_days, unique, bool(payload.get("force")))
+    else:
+        results = await run_db(_resolve_days_batch_steps(unique, bool(payload.get("force"))))
+    ordered = [results[pair] for pair in pairs]
+    return {
+        "ok": all(r["ok"] for r in ordered),
+        "results": ordered,
+        "counts": {
+            "cached": sum(1 for r in ordered if r.get("cached") is True),
+            "computed": sum(1 for r in ordered if r.get("cached") is False),
+            "recomputed": sum(1 for r in ordered if r.get("cache") in ("stale", "forced")),
+            "failed": sum(1 for r in ordered if not r["ok"]),
+        },
+    }
+
+
+# ---- Session trajectories ----
+# session_trajectory holds, for every resolved day, the running total of each global and
+# stakeholder attribute delta (the client's applyDailyDeltas without its clamps and base values):
+# scope 'global' (entity '') or 'stakeholder' (entity = stakeholder id). An attribute has rows
+# from the first day it changes on. When days are (re)written only the suffix from the earliest
+# of them is rebuilt, in SQL from the daily_effects rows, so nothing is replayed in Python.
+DELETE_TRAJECTORY_SUFFIX_SQL = """
+    DELETE FROM session_trajectory st
+    USING unnest(%(ids)s::text[], %(from_days)s::int[]) AS t(session_id, from_day)
+    WHERE st.session_id = t.session_id AND st.day >= t.from_day
+"""
+INSERT_TRAJECTORY_SUFFIX_SQL = """
+    WITH target AS (
+        SELECT * FROM unnest(%(ids)s::text[], %(from_days)s::int[]) AS t(session_id, from_day)
+    ), deltas AS (
+        SELECT de.session_id, de.day, 'global' AS scope, '' AS entity, g.key AS attribute,
+               g.value::text::double precision AS delta
+        FROM daily_effects de
+        JOIN target t ON t.session_id = de.session_id
+        CROSS JOIN LATERAL jsonb_each(COALESCE(de.global_deltas, '{}')::jsonb) g
+        WHERE jsonb_typeof(g.value) = 'number'
+        UNION ALL
+        SELECT de.session_id, de.day, 'stakeholder', sh.key, a.key, a.value::text::double precision
+        FROM daily_effects de
+        JOIN target t ON t.session_id = de.session_id
+        CROSS JOIN LATERAL jsonb_each(COALESCE(de.stakeholder_deltas, '{}')::jsonb) sh
+        CROSS JOIN LATERAL jsonb_each(CASE WHEN jsonb_typeof(sh.value) = 'object' THEN sh.value ELSE '{}' END) a
+        WHERE jsonb_typeof(a.value) = 'number'
+    ), keys AS (
+        SELECT session_id, scope, entity, attribute, MIN(day) AS first_day FROM deltas GROUP BY 1, 2, 3, 4
+    ), series AS (
+        SELECT k.session_id, de.day, k.scope, k.entity, k.attribute, COALESCE(x.delta, 0) AS delta,
+               SUM(COALESCE(x.delta, 0)) OVER (
+                   PARTITION BY k.session_id, k.scope, k.entity, k.attribute ORDER BY de.day
+               ) AS value
+        FROM keys k
+        JOIN daily_effects de ON de.session_id = k.session_id AND de.day >= k.first_day
+        LEFT JOIN deltas x ON x.session_id = k.session_id AND x.day = de.day AND x.scope = k.scope
+                          AND x.entity = k.entity AND x.attribute = k.attribute
+    )
+    INSERT INTO session_trajectory (session_id, day, scope, entity, attribute, delta, value)
+    SELECT s.session_id, s.day, s.scope, s.entity, s.attribute, s.delta, s.value
+    FROM series s
+    JOIN target t ON t.session_id = s.session_id
+    WHERE s.day >= t.from_day
+"""
+
+
+def _refresh_trajectory_steps(first_days: dict):
+    # first_days: {session_id: earliest rewritten day, or None to rebuild the whole series}
+    params = {
+        "ids": list(first_days),
+        "from_days": [-(2 ** 31) if day is None else day for day in first_days.values()],
+    }
+    yield _exec(DELETE_TRAJECTORY_SUFFIX_SQL, params)
+    yield _exec(INSERT_TRAJECTORY_SUFFIX_SQL, params)
+
+
+def _get_trajectory_steps(session_id: str, request: Request, day_from: int | None, day_to: int | None):
+    # One range read on the primary key (session_id, day, ...); the LEFT JOIN also tells a
+    # session without resolved days from a missing one.
+    rows = yield _fetchall(
+        """
+        SELECT s.revision, t.day, t.scope, t.entity, t.attribute, t.delta, t.value
+        FROM sessions s
+        LEFT JOIN session_trajectory t ON t.session_id = s.session_id
+            AND t.day >= COALESCE(%s, t.day) AND t.day <= COALESCE(%s, t.day)
+        WHERE s.session_id = %s
+        ORDER BY t.day, t.scope, t.entity, t.attribute
+        """,
+        (day_from, day_to, session_id),
+    )
+    if not rows:
+        raise HTTPException(status_code=404, detail="session not found")
+    etag = _etag("t", rows[0]["revision"], day_from, day_to)
+    if _etag_matches(request, etag):
+        return etag, None
+    days = {}
+    for r in rows:
+        if r["day"] is None:
+            continue
+        entry = days.setdefault(r["day"], {
+            "day": r["day"], "global": {}, "global_deltas": {}, "stakeholders": {}, "stakeholder_deltas": {},
+        })
+        if r["scope"] == "global":
+            entry["global"][r["attribute"]] = r["value"]
+            entry["global_deltas"][r["attribute"]] = r["delta"]
+        else:
+            entry["stakeholders"].setdefault(r["entity"], {})[r["attribute"]] = r["value"]
+            entry["stakeholder_deltas"].setdefault(r["entity"], {})[r["attribute"]] = r["delta"]
+    return etag, {"session_id": session_id, "days": list(days.values())}
+
+
+@app.get("/sessions/{session_id}/trajectory")
+async def get_session_trajectory(session_id: str, request: Request, day_from: int | None = None, day_to: int | None = None):
+    # Per resolved day: cumulative value and that day's delta of every attribute changed so far.
+    etag, data = await run_db(_get_trajectory_steps(session_id, request, day_from, day_to))
+    if data is None:
+        return _not_modified(etag)
+    return Response(content=_json_bytes(data), media_type="application/json", headers={"ETag": etag})
+
+
+# ---- Said vs did analytics ----
+# Comparison outcomes and decision latencies are kept as per-session contributions
+# (session_comparison_counts, session_decision_latency) and running totals over them
+# (comparison_rollup, decision_latency_rollup). Whenever a session's comparisons or
+# process_logs are rewritten its contribution is replaced and the difference is queued as
+# insert-only delta rows (comparison_rollup_deltas, decision_latency_rollup_deltas), so ingest
+# transactions never lock a shared totals row. apply_rollup_deltas folds the queue into the
+# totals in batches, one applier at a time (advisory lock), with a single upsert per table in
+# key order; reads add the pending deltas, so results are exact before they are applied.
+# Callers of the refresh must hold the session's row lock (every writer updates sessions
+# first), which serializes refreshes of one session.
+COMPLIANT_OUTCOMES = ("TRUE", "DONE_OK")
+COMPLIANCE_DIMENSIONS = ("version_id", "rule_id", "target_ref", "day")
+LATENCY_DIMENSIONS = ("version_id", "node_id")
+
+# NULL keys are stored as '' (day 0 = comparisons from the payload, not from a day resolution).
+# Each refresh is two statements: the old contribution is removed and queued negated, then the
+# new one is stored and queued (one statement cannot delete and re-insert the same keys safely).
+DROP_COMPARISON_COUNTS_SQL = """
+    WITH old AS (
+        DELETE FROM session_comparison_counts WHERE session_id = ANY(%(ids)s)
+        RETURNING version_id, rule_id, target_ref, day, outcome, n
+    )
+    INSERT INTO comparison_rollup_deltas (version_id, rule_id, target_ref, day, outcome, n)
+    SELECT version_id, rule_id, target_ref, day, outcome, -SUM(n) FROM old
+    GROUP BY 1, 2, 3, 4, 5
+"""
+ADD_COMPARISON_COUNTS_SQL = """
+    WITH new AS (
+        INSERT INTO session_comparison_counts (session_id, version_id, rule_id, target_ref, day, outcome, n)
+        SELECT c.session_id, COALESCE(s.version_id, ''), COALESCE(c.rule_id, e.rule_id, ''),
+               COALESCE(e.target_ref, ''), COALESCE(c.day, 0), COALESCE(c.outcome, ''), COUNT(*)
+        FROM comparisons c
+        JOIN sessions s ON s.session_id = c.session_id
+        LEFT JOIN expected_actions e ON e.expected_action_id = c.expected_action_id
+        WHERE c.session_id = ANY(%(ids)s)
+        GROUP BY 1, 2, 3, 4, 5, 6
+        RETURNING version_id, rule_id, target_ref, day, outcome, n
+    )
+    INSERT INTO comparison_rollup_deltas (version_id, rule_id, target_ref, day, outcome, n)
+    SELECT version_id, rule_id, target_ref, day, outcome, SUM(n) FROM new
+    GROUP BY 1, 2, 3, 4, 5
+"""
+DROP_LATENCY_SQL = """
+    WITH old AS (
+        DELETE FROM session_decision_latency WHERE session_id = ANY(%(ids)s)
+        RETURNING version_id, node_id, n, total, total_sq
+    )
+    INSERT INTO decision_latency_rollup_deltas (version_id, node_id, n, total, total_sq)
+    SELECT version_id, node_id, -SUM(n), -SUM(total), -SUM(total_sq) FROM old
+    GROUP BY 1, 2
+"""
+ADD_LATENCY_SQL = """
+    WITH new AS (
+        INSERT INTO session_decision_latency (session_id, version_id, node_id, n, total, total_sq)
+        SELECT p.session_id, COALESCE(s.version_id, ''), COALESCE(p.node_id, ''), COUNT(*),
+               SUM(p.total_duration), SUM(p.total_duration * p.total_duration)
+        FROM process_logs p
+        JOIN sessions s ON s.session_id = p.session_id
+        WHERE p.session_id = ANY(%(ids)s) AND p.total_duration IS NOT NULL
+        GROUP BY 1, 2, 3
+        RETURNING version_id, node_id, n, total, total_sq
+    )
+    INSERT INTO decision_latency_rollup_deltas (version_id, node_id, n, total, total_sq)
+    SELECT version_id, node_id, SUM(n), SUM(total), SUM(total_sq) FROM new
+    GROUP BY 1, 2
+"""
+# Takes the oldest queued deltas, nets them per key and adds them to the totals in key order.
+APPLY_COMPARISON_DELTAS_SQL = """
+    WITH batch AS (
+        DELETE FROM comparison_rollup_deltas WHERE id IN (
+            SELECT id FROM comparison_rollup_deltas ORDER BY id LIMIT %(limit)s
+        )
+        RETURNING version_id, rule_id, target_ref, day, outcome, n
+    ), applied AS (
+        INSERT INTO comparison_rollup AS r (version_id, rule_id, target_ref, day, outcome, n)
+        SELECT version_id, rule_id, target_ref, day, outcome, SUM(n) FROM batch
+        GROUP BY 1, 2, 3, 4, 5 ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (version_id, rule_id, target_ref, day, outcome) DO UPDATE SET n = r.n + EXCLUDED.n
+    )
+    SELECT COUNT(*) AS n FROM batch
+"""
+APPLY_LATENCY_DELTAS_SQL = """
+    WITH batch AS (
+        DELETE FROM decision_latency_rollup_deltas WHERE id IN (
+            SELECT id FROM decision_latency_rollup_deltas ORDER BY id LIMIT %(limit)s
+        )
+        RETURNING version_id, node_id, n, total, total_sq
+    ), applied AS (
+        INSERT INTO decision_latency_rollup AS r (version_id, node_id, n, total, total_sq)
+        SELECT version_id, node_id, SUM(n), SUM(total), SUM(total_sq) FROM batch
+        GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (version_id, node_id) DO UPDATE SET
+            n = r.n + EXCLUDED.n, total = r.total + EXCLUDED.total, total_sq = r.total_sq + EXCLUDED.total_sq
+    )
+    SELECT COUNT(*) AS n FROM batch
+"""
+
+
+def _refresh_analytics_steps(session_ids: list, latency: bool = True):
+    params = {"ids": session_ids}
+    yield _exec(DROP_COMPARISON_COUNTS_SQL, params)
+    yield _exec(ADD_COMPARISON_COUNTS_SQL, params)
+    if latency:
+        yield _exec(DROP_LATENCY_SQL, params)
+        yield _exec(ADD_LATENCY_SQL, params)
+
+
+def _apply_rollup_deltas_steps(limit: int):
+    # Another applier holding the lock is already draining the queue: nothing to do here.
+    row = yield _fetchone("SELECT pg_try_advisory_xact_lock(%s) AS locked", (ROLLUP_LOCK_KEY,))
+    if not row["locked"]:
+        yield _commit()
+        return 0
+    comparisons = yield _fetchone(APPLY_COMPARISON_DELTAS_SQL, {"limit": limit})
+    latency = yield _fetchone(APPLY_LATENCY_DELTAS_SQL, {"limit": limit})
+    yield _commit()
+    return comparisons["n"] + latency["n"]
+
+
+async def apply_rollup_deltas(limit: int = ROLLUP_APPLY_BATCH) -> int:
+    applied = await run_db(_apply_rollup_deltas_steps(limit))
+    metric_inc("rollup_deltas_applied_total", (), applied)
+    return applied
+
+
+def flush_rollup_deltas(conn, limit: int = ROLLUP_APPLY_BATCH) -> int:
+    # Synchronous drain for the CLI tools; waits for a running applier instead of skipping.
+    total = 0
+    while True:
+        conn.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_KEY,))
+        comparisons = conn.execute(APPLY_COMPARISON_DELTAS_SQL, {"limit": limit}).fetchone()
+        latency = conn.execute(APPLY_LATENCY_DELTAS_SQL, {"limit": limit}).fetchone()
+        conn.commit()
+        applied = comparisons["n"] + latency["n"]
+        total += applied
+        if not applied:
+            return total
+
+
+async def _rollup_worker():
+    # Runs in every app process; the advisory lock leaves a single active applier. Errors
+    # (e.g. the database restarting) leave the deltas queued for the next pass.
+    while True:
+        try:
+            if await apply_rollup_deltas() >= ROLLUP_APPLY_BATCH:
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("applying analytics rollup deltas failed")
+            metric_inc("background_errors_total", (("worker", "rollup"),))
+        await asyncio.sleep(ROLLUP_APPLY_INTERVAL)
+
+
+def rebuild_analytics(conn, chunk_size: int = 1000, commit: bool = True) -> int:
+    # Recomputes every contribution and total from scratch (backfill, or repair after sessions
+    # were deleted by hand). Takes the totals' table locks, so writers wait until it finishes.
+    conn.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_KEY,))
+    conn.execute(
+        "TRUNCATE session_comparison_counts, comparison_rollup, comparison_rollup_deltas, "
+        "session_decision_latency, decision_latency_rollup, decision_latency_rollup_deltas"
+    )
+    session_ids = [r["session_id"] for r in conn.execute("SELECT session_id FROM sessions ORDER BY session_id").fetchall()]
+    for start in range(0, len(session_ids), chunk_size):
+        run_sync(conn, _refresh_analytics_steps(session_ids[start:start + chunk_size]))
+    if commit:
+        conn.commit()
+        flush_rollup_deltas(conn)
+    return len(session_ids)
+
+
+def _analytics_dimensions(by: str, allowed: tuple) -> list:
+    dims = [d.strip() for d in by.split(",") if d.strip()]
+    unknown = [d for d in dims if d not in allowed]
+    if not dims or unknown:
+        raise HTTPException(status_code=400, detail=f"by must be a comma list of {', '.join(allowed)}")
+    return list(dict.fromkeys(dims))
+
+
+def _analytics_filters(filters: dict):
+    conditions, params = [], []
+    for column, value in filters.items():
+        if value is None:
+            continue
+        if column == "day_from":
+            conditions.append("day >= %s")
+        elif column == "day_to":
+            conditions.append("day <= %s")
+        else:
+            conditions.append(f"{column} = %s")
+        params.append(value)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def _compliance_steps(dims: list, filters: dict):
+    where, params = _analytics_filters(filters)
+    group = ", ".join(dims)
+    rows = yield _fetchall(
+        f"SELECT {group}, outcome, SUM(n)::bigint AS n FROM ("
+        "SELECT version_id, rule_id, target_ref, day, outcome, n FROM comparison_rollup UNION ALL "
+        f"SELECT version_id, rule_id, target_ref, day, outcome, n FROM comparison_rollup_deltas) t{where} "
+        f"GROUP BY {group}, outcome HAVING SUM(n) > 0 ORDER BY {group}, outcome",
+        params,
+    )
+    groups = {}
+    for r in rows:
+        key = tuple(r[d] for d in dims)
+        group_row = groups.setdefault(key, {**{d: r[d] for d in dims}, "total": 0, "compliant": 0, "outcomes": {}})
+        group_row["outcomes"][r["outcome"]] = r["n"]
+        group_row["total"] += r["n"]
+        if r["outcome"] in COMPLIANT_OUTCOMES:
+            group_row["compliant"] += r["n"]
+    for group_row in groups.values():
+        group_row["rate"] = group_row["compliant"] / group_row["total"] if group_row["total"] else None
+    return list(groups.values())
+
+
+@app.get("/analytics/compliance")
+async def analytics_compliance(
+    by: str = "rule_id",
+    version_id: str | None = None,
+    rule_id: str | None = None,
+    target_ref: str | None = None,
+    day_from: int | None = None,
+    day_to: int | None = None,
+):
+    # Share of comparisons with a compliant outcome (TRUE / DONE_OK), grouped by any of
+    # version_id, rule_id, target_ref, day (e.g. by=version_id,day).
+    dims = _analytics_dimensions(by, COMPLIANCE_DIMENSIONS)
+    filters = {"version_id": version_id, "rule_id": rule_id, "target_ref": target_ref, "day_from": day_from, "day_to": day_to}
+    groups = await run_db(_compliance_steps(dims, filters))
+    return {"by": dims, "compliant_outcomes": list(COMPLIANT_OUTCOMES), "groups": groups}
+
+
+def _decision_latency_steps(dims: list, filters: dict):
+    where, params = _analytics_filters(filters)
+    group = ", ".join(dims)
+    rows = yield _fetchall(
+        f"SELECT {group}, SUM(n)::bigint AS n, SUM(total) AS total, SUM(total_sq) AS total_sq "
+        "FROM (SELECT version_id, node_id, n, total, total_sq FROM decision_latency_rollup UNION ALL "
+        f"SELECT version_id, node_id, n, total, total_sq FROM decision_latency_rollup_deltas) t{where} "
+        f"GROUP BY {group} HAVING SUM(n) > 0 ORDER BY {group}",
+        params,
+    )
+    groups = []
+    for r in rows:
+        mean = r["total"] / r["n"]
+        # running sums are floats: clamp the rounding noise of repeated add/subtract
+        variance = max(r["total_sq"] / r["n"] - mean * mean, 0.0)
+        groups.append({**{d: r[d] for d in dims}, "n": r["n"], "mean": mean, "stddev": variance ** 0.5})
+    return groups
+
+
+@app.get("/analytics/decision_latency")
+async def analytics_decision_latency(by: str = "node_id", version_id: str | None = None, node_id: str | None = None):
+    # Time spent per decision node (process_logs.total_duration, client milliseconds).
+    dims = _analytics_dimensions(by, LATENCY_DIMENSIONS)
+    groups = await run_db(_decision_latency_steps(dims, {"version_id": version_id, "node_id": node_id}))
+    return {"by": dims, "groups": groups}
+
+
+# ---- Conditional reads ----
+# Every write to a session (upload, append, normalize, day resolution) gives it a new revision
+# from session_revision_seq. Read endpoints send it as a weak ETag and answer If-None-Match
+# with 304 after a single lookup of the revision, without reading payloads or child tables.
+def _etag(kind: str, *parts) -> str:
+    return 'W/"' + "-".join([kind, *(str(p) for p in parts)]) + '"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison: W/ prefixes are ignored
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+# Opaque keyset cursors: base64url JSON of the last row's sort key.
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, size: int, what: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail=f"invalid cursor for {what}")
+    return values
+
+
+_normalized_cache = OrderedDict()
+_normalized_cache_lock = threading.Lock()
+
+
+def _normalized_cache_get(key):
+    with _normalized_cache_lock:
+        body = _normalized_cache.get(key)
+        if body is not None:
+            _normalized_cache.move_to_end(key)
+        return body
+
+
+def _normalized_cache_put(key, body: bytes):
+    if NORMALIZED_CACHE_SIZE <= 0:
+        return
+    with _normalized_cache_lock:
+        _normalized_cache[key] = body
+        _normalized_cache.move_to_end(key)
+        while len(_normalized_cache) > NORMALIZED_CACHE_SIZE:
+            _normalized_cache.popitem(last=False)
+
+
+def _json_bytes(data) -> bytes:
+    # same encoding FastAPI's JSONResponse uses
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+SESSION_LIST_COLUMNS = "s.session_id, s.user_id, s.version_id, s.start_time, s.end_time, s.created_at"
+SESSION_LIST_MAX_LIMIT = 1000
+SESSION_COUNT_MODES = ("estimate", "exact", "none")
+
+
+def session_filters(version_id: str | None = None, user_id: str | None = None, estado: str | None = None,
+                    created_from: str | None = None, created_to: str | None = None):
+    # WHERE conditions on sessions (alias s); created_at is ISO 8601 UTC text, range is [from, to).
+    conditions, params = [], []
+    for column, value, op in (
+        ("version_id", version_id, "="),
+        ("user_id", user_id, "="),
+        ("estado", estado, "="),
+        ("created_at", created_from, ">="),
+        ("created_at", created_to, "<"),
+    ):
+        if value is not None:
+            conditions.append(f"s.{column} {op} %s")
+            params.append(value)
+    return conditions, params
+
+
+def _session_count_steps(conditions: list, params: list, mode: str):
+    # estimate: planner row estimate (no scan), exact: COUNT(*) over the filtered range.
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    if mode == "exact":
+        row = yield _fetchone("SELECT COUNT(*) AS n FROM sessions s" + where, params)
+        return row["n"]
+    row = yield _fetchone("EXPLAIN (FORMAT JSON) SELECT 1 FROM sessions s" + where, params)
+    return int(row["QUERY PLAN"][0]["Plan"]["Plan Rows"])
+
+
+def _list_sessions_steps(request: Request, limit: int, cursor: str | None, count: str, filters: dict):
+    # Newest first, keyset-paginated on (created_at, session_id) so every page is an index range
+    # scan (idx_sessions_created and the per-filter indexes), whatever its depth.
+    # The listing only changes when some session gets a new revision (inserts take one too) or
+    # sessions are deleted (session_deletions takes one from the same sequence).
+    state = yield _fetchone(
+        "SELECT GREATEST((SELECT MAX(revision) FROM sessions), (SELECT revision FROM session_deletions)) AS revision"
+    )
+    variant = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    etag = _etag("l", hashlib.blake2b(variant.encode("utf-8"), digest_size=6).hexdigest(), state["revision"] or 0)
+    if _etag_matches(request, etag):
+        return etag, None, {}
+
+    conditions, params = session_filters(**filters)
+    headers = {}
+    if count != "none":
+        total = yield from _session_count_steps(conditions, params, count)
+        headers["X-Total-Count"] = str(total)
+        headers["X-Total-Count-Kind"] = count
+    if cursor:
+        created_at, session_id = _decode_cursor(cursor, 2, "sessions")
+        conditions = [*conditions, "(s.created_at, s.session_id) < (%s, %s)"]
+        params = [*params, created_at, session_id]
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    rows = yield _fetchall(
+        f"SELECT {SESSION_LIST_COLUMNS} FROM sessions s{where} "
+        "ORDER BY s.created_at DESC, s.session_id DESC LIMIT %s",
+        [*params, limit + 1],
+    )
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor([rows[-1]["created_at"], rows[-1]["session_id"]])
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return etag, [dict(row) for row in rows], headers
+
+
+@app.get("/sessions")
+async def list_sessions(
+    request: Request,
+    limit: int = 100,
+    cursor: str | None = None,
+    version_id: str | None = None,
+    user_id: str | None = None,
+    estado: str | None = None,
+    created_from: str | None = None,
+    created_to: str | None = None,
+    count: str = "estimate",
+):
+    # The body stays a plain list; paging and totals travel in headers (X-Next-Cursor / Link,
+    # X-Total-Count with X-Total-Count-Kind). count=estimate|exact|none.
+    if not 1 <= limit <= SESSION_LIST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SESSION_LIST_MAX_LIMIT}")
+    if count not in SESSION_COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count must be one of {', '.join(SESSION_COUNT_MODES)}")
+    filters = {
+        "version_id": version_id,
+        "user_id": user_id,
+        "estado": estado,
+        "created_from": created_from,
+        "created_to": created_to,
+    }
+    if STORAGE_BACKEND == "sqlite":
+        rows, headers = await run_in_threadpool(local_list_sessions, request, limit, cursor, filters)
+        return Response(content=_json_bytes(rows), media_type="application/json", headers=headers)
+    etag, rows, headers = await run_db(_list_sessions_steps(request, limit, cursor, count, filters))
+    if rows is None:
+        return _not_modified(etag)
+    return Response(content=_json_bytes(rows), media_type="application/json", headers={"ETag": etag, **headers})
+
+
+def _latest_session_steps(version_id: str | None = None, user_id: str | None = None):
+    # One index probe: the first entry of idx_sessions_created (or of the per-filter index).
+    conditions, params = session_filters(version_id=version_id, user_id=user_id)
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    row = yield _fetchone(
+        f"SELECT {SESSION_LIST_COLUMNS} FROM sessions s{where} ORDER BY s.created_at DESC, s.session_id DESC LIMIT 1",
+        params,
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="session not found")
+    return row
+
+
+# The /sessions/latest routes must be registered before /sessions/{session_id}, which would
+# otherwise take "latest" as a session id.
+@app.get("/sessions/latest")
+async def get_latest_session(version_id: str | None = None, user_id: str | None = None):
+    return dict(await run_db(_latest_session_steps(version_id, user_id)))
+
+
+def _get_latest_session_normalized_steps(request: Request | None = None):
+    filters = {k: request.query_params.get(k) for k in ("version_id", "user_id")} if request is not None else {}
+    row = yield from _latest_session_steps(**filters)
+    return (yield from _get_session_normalized_steps(row["session_id"], request))
+
+
+@app.get("/sessions/latest/normalized")
+async def get_latest_session_normalized(request: Request):
+    # the ETag is per revision, and revisions are unique across sessions
+    return await _normalized_response(_get_latest_session_normalized_steps(request))
+
+
+def _get_session_steps(session_id: str, request: Request | None = None):
+    # For a conditional request the revision is checked first, so a 304 never reads the payload.
+    if request is not None and request.headers.get("if-none-match"):
+        current = yield _fetchone("SELECT revision FROM sessions WHERE session_id = %s", (session_id,))
+        if not current:
+            raise HTTPException(status_code=404, detail="session not found")
+        if _etag_matches(request, _etag("s", current["revision"])):
+            return {"revision": current["revision"], "not_modified": True}
+    row = yield _fetchone(SESSION_PAYLOAD_SELECT + " WHERE s.session_id = %s", (session_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="session not found")
+
+    return row
+
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _session_response(row, request: Request) -> Response:
+    # Without appended deltas the stored bytes are the document: they are sent as stored (with
+    # Content-Encoding when the client accepts the codec) or just decompressed, never re-parsed.
+    headers = {"Vary": "Accept-Encoding", "ETag": _etag("s", row["revision"])}
+    if row.get("deltas"):
+        content = json.dumps(session_payload(row), ensure_ascii=False).encode("utf-8")
+        return Response(content=content, media_type="application/json", headers=headers)
+    encoding = PAYLOAD_CONTENT_ENCODING.get(row.get("payload_codec"))
+    if row.get("payload_bytes") is not None and encoding and encoding in _accepted_encodings(request):
+        headers["Content-Encoding"] = encoding
+        return Response(content=bytes(row["payload_bytes"]), media_type="application/json", headers=headers)
+    return Response(content=_payload_bytes(row), media_type="application/json", headers=headers)
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str, request: Request):
+    if STORAGE_BACKEND == "sqlite":
+        row = await run_in_threadpool(local_get_session, session_id)
+        if _etag_matches(request, _etag("s", row["revision"])):
+            return _not_modified(_etag("s", row["revision"]))
+        return await run_in_threadpool(_session_response, row, request)
+    row = await run_db(_get_session_steps(session_id, request))
+    if row.get("not_modified"):
+        return _not_modified(_etag("s", row["revision"]))
+    # decompressing or merging deltas is CPU work: off the event loop
+    return await run_in_threadpool(_session_response, row, request)
+
+
+# Paged tables of the normalized view and their sort/cursor key (primary key within a session).
+NORMALIZED_VIEW_TABLES = {
+    "explicit_decisions": ("decision_id",),
+    "expected_actions": ("expected_action_id",),
+    "canonical_actions": ("canonical_action_id",),
+    "mechanic_events": ("event_id",),
+    "comparisons": ("comparison_id",),
+    "process_logs": ("process_log_id",),
+    "player_actions_log": ("player_action_id",),
+    "session_stakeholders": ("stakeholder_id",),
+}
+SESSION_VIEW_COLUMNS = ("session_id", "user_id", "version_id", "start_time", "end_time", "created_at")
+
+
+def _parse_view_spec(params) -> dict:
+    # ?include=session,mechanic_events.event_id,mechanic_events.timestamp,comparisons
+    #   tables (all fields) or table.field; default: everything.
+    # ?limit=N for every paged table, ?limit.<table>=N and ?after.<table>=<cursor> per table.
+    include = [p.strip() for p in (params.get("include") or "").split(",") if p.strip()]
+    known = ("session", *NORMALIZED_VIEW_TABLES, "session_state")
+    fields = {}
+    for item in include or known:
+        table, _, field = item.partition(".")
+        if table not in known:
+            raise HTTPException(status_code=400, detail=f"unknown table {table!r} in include")
+        if field:
+            if table == "session" and field not in SESSION_VIEW_COLUMNS:
+                raise HTTPException(status_code=400, detail=f"unknown field session.{field} in include")
+            if fields.get(table, []) is not None:
+                fields.setdefault(table, []).append(field)
+        else:
+            fields[table] = None
+
+    def _limit(raw, name):
+        if raw is None:
+            return None
+        try:
+            value = int(raw)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{name} must be an integer")
+        if value < 1:
+            raise HTTPException(status_code=400, detail=f"{name} must be >= 1")
+        return value
+
+    default_limit = _limit(params.get("limit"), "limit")
+    tables = {}
+    for table in NORMALIZED_VIEW_TABLES:
+        if table not in fields:
+            continue
+        after = params.get(f"after.{table}")
+        tables[table] = {
+            "fields": fields[table],
+            "limit": _limit(params.get(f"limit.{table}"), f"limit.{table}") or default_limit,
+            "after": _decode_cursor(after, len(NORMALIZED_VIEW_TABLES[table]), table) if after else None,
+        }
+    return {
+        "session": fields.get("session", []) if "session" in fields else False,
+        "tables": tables,
+        "session_state": fields.get("session_state", []) if "session_state" in fields else False,
+    }
+
+
+def _normalized_view_query(session_id: str, spec: dict):
+    # One statement (one round trip, one snapshot) that returns every requested table as JSON.
+    params = [session_id]
+    parts = [sql.SQL(
+        "(SELECT row_to_json(t) FROM (SELECT {}, revision FROM sessions WHERE session_id = %s) t) AS session"
+    ).format(sql.SQL(", ").join(map(sql.Identifier, SESSION_VIEW_COLUMNS)))]
+    for table, opts in spec["tables"].items():
+        keys = NORMALIZED_VIEW_TABLES[table]
+        order = sql.SQL(", ").join(map(sql.Identifier, keys))
+        if opts["fields"] is None:
+            columns = sql.SQL("*")
+        else:
+            columns = sql.SQL(", ").join(map(sql.Identifier, dict.fromkeys([*keys, *opts["fields"]])))
+        where = sql.SQL("session_id = %s")
+        params.append(session_id)
+        if opts["after"] is not None:
+            where = sql.SQL("{} AND ({}) > ({})").format(
+                where, order, sql.SQL(", ").join(sql.Placeholder() * len(keys))
+            )
+            params.extend(opts["after"])
+        # one extra row tells whether there is a next page
+        params.append(opts["limit"] + 1 if opts["limit"] else None)
+        parts.append(sql.SQL(
+            "(SELECT COALESCE(json_agg(t ORDER BY {order}), '[]'::json) FROM ("
+            "SELECT {columns} FROM {table} WHERE {where} ORDER BY {order} LIMIT %s) t) AS {table}"
+        ).format(order=order, columns=columns, table=sql.Identifier(table), where=where))
+    if spec["session_state"] is not False:
+        columns = sql.SQL(", ").join(map(sql.Identifier, spec["session_state"])) if spec["session_state"] else sql.SQL("*")
+        parts.append(sql.SQL(
+            "(SELECT row_to_json(t) FROM (SELECT {} FROM session_state WHERE session_id = %s) t) AS session_state"
+        ).format(columns))
+        params.append(session_id)
+    return sql.SQL("SELECT ") + sql.SQL(", ").join(parts), params
+
+
+def _build_normalized_view(row, spec: dict) -> dict:
+    session = dict(row["session"])
+    session.pop("revision", None)
+    data = {}
+    if spec["session"] is not False:
+        data["session"] = {k: v for k, v in session.items() if k in spec["session"]} if spec["session"] else session
+    paged = {}
+    for table, opts in spec["tables"].items():
+        rows = row[table]
+        keys = NORMALIZED_VIEW_TABLES[table]
+        if opts["limit"]:
+            paged[table] = None
+            if len(rows) > opts["limit"]:
+                rows = rows[:opts["limit"]]
+                paged[table] = _encode_cursor([rows[-1][k] for k in keys])
+        if opts["fields"] is not None:
+            rows = [{k: r[k] for k in opts["fields"]} for r in rows]
+        data[table] = rows
+    if spec["session_state"] is not False:
+        data["session_state"] = row["session_state"]
+    if paged:
+        data["next"] = paged
+    return data
+
+
+def _get_session_normalized_steps(session_id: str, request: Request | None = None):
+    # Returns (etag, body): body is None when the client's copy is current, and comes from the
+    # in-process cache when this revision (and view) was already built.
+    spec = _parse_view_spec(request.query_params if request is not None else {})
+    variant = "" if request is None else "&".join(
+        f"{k}={v}" for k, v in sorted(request.query_params.multi_items()) if k == "include" or "." in k or k == "limit"
+    )
+    suffix = (hashlib.blake2b(variant.encode("utf-8"), digest_size=6).hexdigest(),) if variant else ()
+
+    current = yield _fetchone("SELECT revision FROM sessions WHERE session_id = %s", (session_id,))
+    if not current:
+        raise HTTPException(status_code=404, detail="session not found")
+    etag = _etag("n", current["revision"], *suffix)
+    if request is not None and _etag_matches(request, etag):
+        return etag, None
+    body = _normalized_cache_get((session_id, current["revision"], variant))
+    if body is not None:
+        return etag, body
+
+    query, params = _normalized_view_query(session_id, spec)
+    row = yield _fetchone(query, params)
+    if not row or row["session"] is None:
+        raise HTTPException(status_code=404, detail="session not found")
+
+    # the view may be newer than the revision read above; tag it with its own
+    revision = row["session"]["revision"]
+    etag = _etag("n", revision, *suffix)
+    body = yield _compute(lambda: _json_bytes(_build_normalized_view(row, spec)))
+    _normalized_cache_put((session_id, revision, variant), body)
+    return etag, body
+
+
+async def _normalized_response(steps) -> Response:
+    try:
+        etag, body = await run_db(steps)
+    except (psycopg.errors.UndefinedColumn, psycopg.errors.DataError, psycopg.errors.UndefinedFunction) as exc:
+        # unknown ?include= field or a cursor that does not fit the key column
+        raise HTTPException(status_code=400, detail=exc.diag.message_primary)
+    if body is None:
+        return _not_modified(etag)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@app.get("/sessions/{session_id}/normalized")
+async def get_session_normalized(session_id: str, request: Request):
+    return await _normalized_response(_get_session_normalized_steps(session_id, request))
+
+
+# ---- Streaming export (GET /export/{kind}, python -m backend.export) ----
+# Rows are read through a server-side cursor and written out as NDJSON in batches, so memory
+# stays flat whatever the number of rows. `sessions` exports the merged session payload; every
+# other kind is a normalized table (raw columns, as in /sessions/{id}/normalized).
+EXPORT_TABLES = (
+    "explicit_decisions",
+    "expected_actions",
+    "canonical_actions",
+    "mechanic_events",
+    "comparisons",
+    "process_logs",
+    "player_actions_log",
+    "session_stakeholders",
+    "session_state",
+    "daily_effects",
+)
+EXPORT_KINDS = ("sessions",) + EXPORT_TABLES
+EXPORT_BATCH_SIZE = 2000
+EXPORT_FLUSH_BYTES = 1 << 16
+
+
+def export_query(kind: str, version_id: str | None = None, user_id: str | None = None,
+                 created_from: str | None = None, created_to: str | None = None, columns: list | None = None):
+    if kind not in EXPORT_KINDS:
+        raise HTTPException(status_code=404, detail=f"unknown export kind {kind!r}")
+    conditions, params = session_filters(version_id=version_id, user_id=user_id,
+                                         created_from=created_from, created_to=created_to)
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    if kind == "sessions":
+        return SESSION_PAYLOAD_SELECT + where, params
+    select = ", ".join(f"t.{c}" for c in columns) if columns else "t.*"
+    return f"SELECT {select} FROM {kind} t JOIN sessions s ON s.session_id = t.session_id" + where, params
+
+
+def _export_record(kind: str, row) -> dict:
+    if kind == "sessions":
+        return {"session_id": row["session_id"], "created_at": row["created_at"], "session": session_payload(row)}
+    return dict(row)
+
+
+def iter_export(conn, kind: str, version_id: str | None = None, user_id: str | None = None,
+                created_from: str | None = None, created_to: str | None = None, batch_size: int = EXPORT_BATCH_SIZE):
+    # Yields NDJSON bytes in ~64KB blocks. Needs a connection of its own while iterating.
+    sql, params = export_query(kind, version_id, user_id, created_from, created_to)
+    buffer = []
+    size = 0
+    with conn.cursor(name=f"export_{kind}") as cur:
+        cur.itersize = batch_size
+        cur.execute(sql, params)
+        for row in cur:
+            line = (json.dumps(_export_record(kind, row), ensure_ascii=False, default=str) + "\n").encode("utf-8")
+            buffer.append(line)
+            size += len(line)
+            if size >= EXPORT_FLUSH_BYTES:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+    conn.rollback()
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_gzip(chunks, level: int = 6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _export_stream(kind: str, filters: dict, compress: bool):
+    with get_conn() as conn:
+        chunks = iter_export(conn, kind, **filters)
+        yield from (iter_gzip(chunks) if compress else chunks)
+
+
+@app.get("/export/{kind}")
+def export_ndjson(
+    kind: str,
+    version_id: str | None = None,
+    user_id: str | None = None,
+    created_from: str | None = None,
+    created_to: str | None = None,
+    gzip: bool = False,
+):
+    # created_from/created_to compare against sessions.created_at (ISO 8601 UTC, [from, to)).
+    filters = {"version_id": version_id, "user_id": user_id, "created_from": created_from, "created_to": created_to}
+    export_query(kind, **filters)
+    # before the response starts: once streaming, an error can no longer become a status code
+    _require_postgres()
+    headers = {"Content-Disposition": f'attachment; filename="{kind}.ndjson{".gz" if gzip else ""}"'}
+    if gzip:
+        # Served as a .gz file, not as Content-Encoding, so clients keep the compressed bytes.
+        return StreamingResponse(_export_stream(kind, filters, True), media_type="application/gzip", headers=headers)
+    return StreamingResponse(_export_stream(kind, filters, False), media_type="application/x-ndjson", headers=headers)
+
+
+# ---- Embedded SQLite storage (STORAGE_BACKEND=sqlite, python -m backend.sync_local) ----
+# Single-node / offline deployments keep sessions in one SQLite file (SQLITE_PATH). Uploads
+# and day resolution go through the same row builders (_child_rows, _expected_action_row,
+# _canonical_action_row), row-hash diff, rules and resolve_day as Postgres, and write the same
+# comparisons/daily_effects rows; the data path served is POST /sessions, GET
+# /sessions[/{id}] and resolve_day_effects (single and batch), the rest of the API answers 501. Catalogs (users, versions, mechanics, questions) and the derived tables
+# are only built in Postgres, when backend/sync_local.py pushes the sessions there.
+# Tuned for writes: WAL with synchronous=NORMAL (a commit is one WAL append, readers do not
+# block the writer), one BEGIN IMMEDIATE transaction per batch, executemany with fixed SQL
+# text so sqlite3's statement cache prepares every statement once per connection.
+LOCAL_SCHEMA_VERSION = 2
+LOCAL_TABLES = tuple(table for table in CHILD_TABLES if table != "session_stakeholders")
+
+_local_db: sqlite3.Connection | None = None
+_local_lock = threading.Lock()
+
+
+def _local_dict_row(cursor, row) -> dict:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _local_schema() -> list:
+    statements = [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            version_id TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            created_at TEXT NOT NULL,
+            estado TEXT,
+            payload_bytes BLOB NOT NULL,
+            payload_codec TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            synced_revision INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions(created_at, session_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_revision ON sessions(revision)",
+        """
+        CREATE TABLE IF NOT EXISTS session_state (
+            session_id TEXT PRIMARY KEY,
+            stakeholders TEXT,
+            global_state TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_effects (
+            session_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            comparisons TEXT,
+            global_deltas TEXT,
+            stakeholder_deltas TEXT,
+            created_at TEXT,
+            status TEXT,
+            fingerprint TEXT,
+            PRIMARY KEY (session_id, day)
+        )
+        """,
+    ]
+    for table in LOCAL_TABLES:
+        key_col, columns, _ = CHILD_TABLES[table]
+        if table == "comparisons":
+            # As in Postgres, day resolution also writes comparisons (day set, row_key NULL), so
+            # the payload rows are kept unique by an index instead of the primary key.
+            statements += [
+                f"CREATE TABLE IF NOT EXISTS comparisons (comparison_id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, "
+                f"day INTEGER, {key_col} TEXT, {', '.join(columns)}, row_hash TEXT)",
+                f"CREATE UNIQUE INDEX IF NOT EXISTS idx_comparisons_key ON comparisons(session_id, {key_col})",
+                "CREATE INDEX IF NOT EXISTS idx_comparisons_session_day ON comparisons(session_id, day)",
+            ]
+            continue
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS {table} (session_id TEXT NOT NULL, {key_col} TEXT, "
+            f"{', '.join(columns)}, row_hash TEXT, PRIMARY KEY (session_id, {key_col}))"
+        )
+    return statements
+
+
+def _local_comparisons_v2(conn):
+    # Version 1 kept resolved days only in daily_effects.comparisons: the payload rows move to the
+    # new table and every resolved day gets its comparison rows, as a resolution writes them now.
+    key_col, columns, _ = CHILD_TABLES["comparisons"]
+    copied = ", ".join(("session_id", key_col, *columns, "row_hash"))
+    conn.execute(f"INSERT INTO comparisons ({copied}) SELECT {copied} FROM comparisons_v1")
+    conn.execute("DROP TABLE comparisons_v1")
+    days = conn.execute("SELECT session_id, day, comparisons FROM daily_effects").fetchall()
+    conn.executemany(
+        LOCAL_COMPARISONS_INSERT,
+        _day_comparison_rows((r["session_id"], r["day"], _json_load(r["comparisons"]) or []) for r in days),
+    )
+
+
+def local_connect(path: str) -> sqlite3.Connection:
+    # isolation_level=None: transactions are opened explicitly by _local_transaction.
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=256)
+    conn.row_factory = _local_dict_row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+    version = conn.execute("PRAGMA user_version").fetchone()["user_version"]
+    if version < LOCAL_SCHEMA_VERSION:
+        with _local_transaction(conn):
+            if version == 1:
+                # comparisons gained the day column: rebuilt with the version 2 shape
+                conn.execute("ALTER TABLE comparisons RENAME TO comparisons_v1")
+            for statement in _local_schema():
+                conn.execute(statement)
+            if version == 1:
+                _local_comparisons_v2(conn)
+            conn.execute(f"PRAGMA user_version = {LOCAL_SCHEMA_VERSION}")
+    return conn
+
+
+@contextmanager
+def _local_transaction(conn):
+    # IMMEDIATE takes the write lock up front, so concurrent writers wait on busy_timeout
+    # instead of failing when a read transaction tries to upgrade.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def open_local_db() -> sqlite3.Connection:
+    global _local_db
+    if _local_db is None:
+        _local_db = local_connect(SQLITE_PATH)
+    return _local_db
+
+
+def close_local_db():
+    global _local_db
+    if _local_db is not None:
+        _local_db.close()
+        _local_db = None
+
+
+@lru_cache(maxsize=None)
+def _local_upsert_sql(table: str) -> str:
+    key_col, columns, _ = CHILD_TABLES[table]
+    placeholders = ", ".join(["?"] * (len(columns) + 3))
+    return f"INSERT OR REPLACE INTO {table} (session_id, {key_col}, {', '.join(columns)}, row_hash) VALUES ({placeholders})"
+
+
+LOCAL_COMPARISONS_INSERT = (
+    "INSERT INTO comparisons (session_id, day, expected_action_id, canonical_action_id, outcome, deviation, rule_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _local_write_table(conn, session_id: str, table: str, rows: list, diff: bool = True, prune: bool = True) -> dict:
+    # _write_table_steps on the local file: the same row hashes and diff, in SQLite statements.
+    key_col = CHILD_TABLES[table][0]
+    wanted = _hashed_rows(rows)
+    existing = {}
+    if diff:
+        found = conn.execute(f"SELECT {key_col} AS key, row_hash FROM {table} WHERE session_id = ?", (session_id,))
+        existing = {r["key"]: r["row_hash"] for r in found}
+    inserts, updates, stale = _diff_rows(wanted, existing, prune)
+
+    deleted = 0
+    stale_keys = [key for key in stale if key is not None]
+    if stale_keys:
+        deleted += conn.executemany(
+            f"DELETE FROM {table} WHERE session_id = ? AND {key_col} = ?", [(session_id, key) for key in stale_keys]
+        ).rowcount
+    if len(stale_keys) != len(stale):
+        deleted += conn.execute(f"DELETE FROM {table} WHERE session_id = ? AND {key_col} IS NULL", (session_id,)).rowcount
+    conn.executemany(
+        _local_upsert_sql(table), [(session_id, key, *wanted[key][0], wanted[key][1]) for key in inserts + updates]
+    )
+    return _diff_changes(wanted, inserts, updates, deleted)
+
+
+def _local_next_revision(conn) -> int:
+    return conn.execute("SELECT COALESCE(MAX(revision), 0) + 1 AS revision FROM sessions").fetchone()["revision"]
+
+
+def _local_write_session(conn, session: dict, created_at: str, revision: int) -> dict:
+    metadata = session.get("session_metadata") or {}
+    session_id = metadata.get("session_id")
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_metadata.session_id missing")
+    payload_codec, payload_bytes = encode_payload(json.dumps(session, ensure_ascii=False).encode("utf-8"))
+    conn.execute(
+        """
+        INSERT INTO sessions (session_id, user_id, version_id, start_time, end_time, created_at,
+                              payload_bytes, payload_codec, revision)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (session_id) DO UPDATE SET
+            user_id = excluded.user_id,
+            version_id = excluded.version_id,
+            start_time = excluded.start_time,
+            end_time = excluded.end_time,
+            created_at = excluded.created_at,
+            payload_bytes = excluded.payload_bytes,
+            payload_codec = excluded.payload_codec,
+            revision = excluded.revision
+        """,
+        (
+            session_id, metadata.get("user_id"), metadata.get("simulator_version_id"), metadata.get("start_time"),
+            metadata.get("end_time"), created_at, payload_bytes, payload_codec, revision,
+        ),
+    )
+    expected_ids = {
+        action.get("expected_action_id")
+        for action in session.get("expected_actions") or []
+        if action.get("expected_action_id")
+    }
+    # A full upload replaces the session's rows through the row-hash diff (unchanged rows are not
+    # rewritten); expected_actions are only upserted, as in Postgres.
+    changes = {
+        table: _local_write_table(conn, session_id, table, rows, prune=table != "expected_actions")
+        for table, rows in _child_rows(session, expected_ids).items()
+    }
+    final_state = session.get("final_state") or {}
+    if isinstance(final_state, dict) and final_state:
+        conn.execute(
+            "INSERT OR REPLACE INTO session_state (session_id, stakeholders, global_state) VALUES (?, ?, ?)",
+            (session_id, _json_dump(final_state.get("stakeholders")), _json_dump(final_state.get("global"))),
+        )
+    else:
+        conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+    conn.execute("DELETE FROM daily_effects WHERE session_id = ?", (session_id,))
+    # no cursor: /append is Postgres-only, so clients keep sending full payloads
+    return {"ok": True, "session_id": session_id, "counts": _ingest_counts(session), "changes": changes}
+
+
+def local_save_sessions(conn, sessions: list) -> list:
+    # All sessions in one transaction: bulk imports pay for one WAL commit per batch.
+    created_at = datetime.now(timezone.utc).isoformat()
+    with _local_transaction(conn):
+        revision = _local_next_revision(conn)
+        return [_local_write_session(conn, session, created_at, revision + n) for n, session in enumerate(sessions)]
+
+
+def local_save_session(session: dict) -> dict:
+    with _local_lock:
+        return local_save_sessions(open_local_db(), [session])[0]
+
+
+def local_get_session(session_id: str) -> dict:
+    with _local_lock:
+        row = open_local_db().execute(
+            "SELECT session_id, payload_bytes, payload_codec, created_at, revision FROM sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="session not found")
+    return row
+
+
+def local_list_sessions(request: Request, limit: int, cursor: str | None, filters: dict):
+    conditions, params = session_filters(**filters)
+    conditions = [condition.replace("%s", "?") for condition in conditions]
+    if cursor:
+        created_at, session_id = _decode_cursor(cursor, 2, "sessions")
+        conditions.append("(s.created_at, s.session_id) < (?, ?)")
+        params = [*params, created_at, session_id]
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    with _local_lock:
+        rows = open_local_db().execute(
+            f"SELECT {SESSION_LIST_COLUMNS} FROM sessions s{where} "
+            "ORDER BY s.created_at DESC, s.session_id DESC LIMIT ?",
+            [*params, limit + 1],
+        ).fetchall()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor([rows[-1]["created_at"], rows[-1]["session_id"]])
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return rows, headers
+
+
+def _local_inputs_hash(rows: list, key: str) -> str:
+    # Same summary as the md5(string_agg(id:row_hash)) of _lookup_days_steps.
+    joined = ",".join(f"{r[key]}:{r['row_hash']}" for r in sorted(rows, key=lambda r: r[key] or ""))
+    return hashlib.md5(joined.encode("utf-8")).hexdigest()
+
+
+def _local_resolve_session_days(conn, session_id: str, days: list, force: bool, rules: dict, rules_version) -> dict:
+    results = {}
+    if not conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone():
+        for day in days:
+            results[(session_id, day)] = {"ok": False, "reason": "session_not_found", "session_id": session_id, "day": day}
+        return results
+    expected_rows = conn.execute(
+        """
+        SELECT expected_action_id, source_node_id, source_option_id, action_type, target_ref, constraints,
+               rule_id, created_at, mechanic_id, effects, day_index, row_hash
+        FROM expected_actions WHERE session_id = ?
+        """,
+        (session_id,),
+    ).fetchall()
+    canonical_rows = conn.execute(
+        """
+        SELECT canonical_action_id, mechanic_id, action_type, target_ref, value_final, committed_at, context, row_hash
+        FROM canonical_actions WHERE session_id = ?
+        """,
+        (session_id,),
+    ).fetchall()
+    expected = [_expected_from_row(r) for r in expected_rows]
+    index = _build_canonical_index([_canonical_from_row(r) for r in canonical_rows])
+    written = []
+    for day in dict.fromkeys(days):
+        day_index = _day_index_from_value(day)
+        applicable = [r for r in expected_rows if r["day_index"] is None or r["day_index"] == day_index]
+        targets = {(r["action_type"], r["target_ref"]) for r in applicable}
+        matchable = [r for r in canonical_rows if (r["action_type"], r["target_ref"]) in targets]
+        fingerprint = _day_fingerprint(
+            rules_version, _local_inputs_hash(applicable, "expected_action_id"),
+            _local_inputs_hash(matchable, "canonical_action_id"),
+        )
+        stored = conn.execute(
+            "SELECT comparisons, global_deltas, stakeholder_deltas, fingerprint FROM daily_effects "
+            "WHERE session_id = ? AND day = ?",
+            (session_id, day),
+        ).fetchone()
+        if stored and stored["fingerprint"] == fingerprint and not force:
+            results[(session_id, day)] = _cached_day_result(session_id, day, stored)
+            continue
+        if not expected_rows:
+            results[(session_id, day)] = _missing_expected_result(
+                session_id, day,
+                "No expected_actions found in DB for this session. Send session payload before resolving day.",
+            )
+            continue
+        comparisons, global_deltas, stakeholder_deltas = resolve_day(expected, index, day, rules)
+        if not comparisons:
+            results[(session_id, day)] = _missing_expected_result(
+                session_id, day, "No valid comparisons to persist because expected_actions are missing."
+            )
+            continue
+        written.append((session_id, day))
+        results[(session_id, day)] = {
+            "ok": True,
+            "session_id": session_id,
+            "day": day,
+            "comparisons": comparisons,
+            "global_deltas": global_deltas,
+            "stakeholder_deltas": stakeholder_deltas,
+            "cached": False,
+            "cache": "forced" if force else ("stale" if stored else "miss"),
+            "fingerprint": fingerprint,
+        }
+    if written:
+        # same rows as _compute_days_steps: the day's comparisons are replaced, not appended to
+        comparison_rows, effect_rows = _day_write_rows(results, written, datetime.now(timezone.utc).isoformat())
+        conn.executemany("DELETE FROM comparisons WHERE session_id = ? AND day = ?", written)
+        conn.executemany(LOCAL_COMPARISONS_INSERT, comparison_rows)
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO daily_effects
+                (session_id, day, comparisons, global_deltas, stakeholder_deltas, created_at, status, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            effect_rows,
+        )
+        # resolved days are pushed with the session, so they mark it as changed for sync_local
+        conn.execute(
+            "UPDATE sessions SET revision = ? WHERE session_id = ?", (_local_next_revision(conn), session_id)
+        )
+    return results
+
+
+def local_resolve_days(pairs: list, force: bool = False) -> dict:
+    days_by_session = {}
+    for session_id, day in pairs:
+        days_by_session.setdefault(session_id, []).append(day)
+    rules = current_rules()
+    rules_version = current_rules_version()
+    results = {}
+    with _local_lock:
+        conn = open_local_db()
+        with _local_transaction(conn):
+            for session_id, days in days_by_session.items():
+                results.update(_local_resolve_session_days(conn, session_id, days, force, rules, rules_version))
+    return results
+
+
+def local_resolve_day(session_id: str, day: int, payload: dict | None, force: bool = False) -> dict:
+    with _local_lock:
+        conn = open_local_db()
+        with _local_transaction(conn):
+            if not conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone():
+                raise HTTPException(status_code=404, detail="session not found")
+            if payload:
+                # expected/canonical actions sent with the day are upserted, never pruned
+                for table, rows in (
+                    ("expected_actions", [_expected_action_row(a) for a in payload.get("expected_actions") or []]),
+                    ("canonical_actions", [_canonical_action_row(a) for a in payload.get("canonical_actions") or []]),
+                ):
+                    _local_write_table(conn, session_id, table, rows, diff=False)
+            results = _local_resolve_session_days(
+                conn, session_id, [day], force, current_rules(), current_rules_version()
+            )
+    return results[(session_id, day)]
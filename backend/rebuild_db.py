@@ -1,42 +1,157 @@
 import argparse
-import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from typing import Optional
 
-from backend.main import create_schema, get_conn, normalize_session
+from backend.main import (
+    SESSION_PAYLOAD_SELECT,
+    close_pool,
+    finish_normalize_run,
+    flush_rollup_deltas,
+    get_conn,
+    iter_pending_session_chunks,
+    migrate_schema,
+    normalize_chunk,
+    normalize_session,
+    rebuild_analytics,
+    session_payload,
+    start_normalize_run,
+)
 
 
-def normalize_sessions(session_id: Optional[str]) -> int:
+def normalize_single(session_id: str) -> int:
     with get_conn() as conn:
-        create_schema(conn)
-        if session_id:
-            rows = conn.execute(
-                "SELECT session_id, payload, created_at FROM sessions WHERE session_id = %s",
-                (session_id,),
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                "SELECT session_id, payload, created_at FROM sessions"
-            ).fetchall()
-
-        if not rows:
+        migrate_schema(conn)
+        row = conn.execute(SESSION_PAYLOAD_SELECT + " WHERE s.session_id = %s", (session_id,)).fetchone()
+        if not row:
             print("No sessions found to normalize.")
             return 1
-
-        conn.execute("BEGIN")
-        for row in rows:
-            session = json.loads(row["payload"])
-            normalize_session(conn, row["session_id"], session, row["created_at"])
+        normalize_session(conn, row["session_id"], session_payload(row), row["created_at"])
         conn.commit()
+        flush_rollup_deltas(conn)
 
-    print(f"Normalized {len(rows)} session(s).")
+    print("Normalized 1 session(s).")
+    return 0
+
+
+def _normalize_chunk_worker(run_id: str, session_ids: list) -> dict:
+    # Runs in a worker process: each worker keeps its own connection pool.
+    with get_conn() as conn:
+        return normalize_chunk(conn, run_id, session_ids)
+
+
+class _Progress:
+    def __init__(self, total: int, quiet: bool):
+        self.total = total
+        self.quiet = quiet
+        self.done = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+
+    def update(self, result: dict):
+        self.done += result["processed"] + result["failed"] + result["missing"]
+        self.failed += result["failed"]
+        for failure in result["failures"]:
+            print(f"  failed {failure['session_id']}: {failure['error']}", file=sys.stderr)
+        if self.quiet:
+            return
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        pct = 100.0 * self.done / self.total if self.total else 100.0
+        print(
+            f"{self.done}/{self.total} sessions ({pct:.1f}%), {self.failed} failed, "
+            f"{rate:.1f} sessions/s, eta {eta:.0f}s",
+            file=sys.stderr,
+        )
+
+
+def normalize_sessions(workers: int, chunk_size: int, run_id: Optional[str], restart: bool, quiet: bool) -> int:
+    with get_conn() as conn:
+        migrate_schema(conn)
+        run = start_normalize_run(conn, chunk_size, run_id, restart)
+    run_id = run["run_id"]
+    verb = "Resuming" if run["resumed"] else "Starting"
+    print(f"{verb} normalize run {run_id}: {run['pending']} session(s) pending, {workers} worker(s), chunks of {chunk_size}.")
+    if run["pending"] == 0 and not run["resumed"]:
+        print("No sessions found to normalize.")
+        return 1
+
+    progress = _Progress(run["pending"], quiet)
+    with get_conn() as stream_conn:
+        chunks = iter_pending_session_chunks(stream_conn, run_id, chunk_size)
+        if workers <= 1:
+            with get_conn() as conn:
+                for chunk in chunks:
+                    progress.update(normalize_chunk(conn, run_id, chunk))
+        else:
+            # spawn: workers must not inherit the parent's connection pool
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                in_flight = set()
+                for chunk in chunks:
+                    in_flight.add(executor.submit(_normalize_chunk_worker, run_id, chunk))
+                    # keep a bounded number of chunks queued so ids are not all pulled into memory
+                    if len(in_flight) >= workers * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            progress.update(future.result())
+                for future in wait(in_flight).done:
+                    progress.update(future.result())
+
+    with get_conn() as conn:
+        totals = finish_normalize_run(conn, run_id)
+        # fold the analytics deltas queued by the pass (the app's applier may not be running)
+        flush_rollup_deltas(conn)
+    print(f"Normalized {progress.done - progress.failed} session(s) in this pass; run {run_id} totals: "
+          f"{totals['ok']} ok, {totals['failed']} failed.")
+    if totals["failed"]:
+        print(f"Run left open: rerun to retry the failed sessions (--run-id {run_id}).")
+        return 2
+    return 0
+
+
+def migrate() -> int:
+    with get_conn() as conn:
+        applied = migrate_schema(conn)
+    if applied:
+        print(f"Applied schema migration(s): {', '.join(str(v) for v in applied)}.")
+    else:
+        print("Schema is up to date.")
+    return 0
+
+
+def rebuild_rollups() -> int:
+    with get_conn() as conn:
+        migrate_schema(conn)
+        count = rebuild_analytics(conn)
+    print(f"Rebuilt analytics rollups from {count} session(s).")
     return 0
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Normalize existing sessions in Postgres.")
     parser.add_argument("--session-id", help="Normalize a single session")
+    parser.add_argument("--migrate-only", action="store_true", help="Apply pending schema migrations and exit")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (default 1: normalize in this process)")
+    parser.add_argument("--chunk-size", type=int, default=100, help="Sessions per transaction")
+    parser.add_argument("--run-id", help="Resume this run instead of the latest unfinished one")
+    parser.add_argument("--restart", action="store_true", help="Start a new run even if one is unfinished")
+    parser.add_argument("--quiet", action="store_true", help="Only report failures and the final summary")
+    parser.add_argument("--rebuild-analytics", action="store_true", help="Recompute the analytics rollups and exit")
     args = parser.parse_args()
-    return normalize_sessions(args.session_id)
+    try:
+        if args.migrate_only:
+            return migrate()
+        if args.rebuild_analytics:
+            return rebuild_rollups()
+        if args.session_id:
+            return normalize_single(args.session_id)
+        return normalize_sessions(max(1, args.workers), max(1, args.chunk_size), args.run_id, args.restart, args.quiet)
+    finally:
+        close_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+
+# The local files are read directly; this tool always writes to the Postgres in DATABASE_URL,
+# even when the environment (or .env) of a kiosk selects the SQLite backend.
+os.environ["STORAGE_BACKEND"] = "postgres"
+
+from backend.main import (  # noqa: E402
+    _local_transaction,
+    _resolve_days_batch_steps,
+    close_pool,
+    get_conn,
+    local_connect,
+    migrate_schema,
+    normalize_session,
+    run_sync,
+    session_payload,
+)
+
+LOCAL_PENDING_SELECT = """
+    SELECT session_id, payload_bytes, payload_codec, created_at, revision
+    FROM sessions
+    WHERE ? OR synced_revision IS NULL OR synced_revision < revision
+    ORDER BY revision
+"""
+
+
+def _central_created_at(conn, session_ids: list) -> dict:
+    rows = conn.execute(
+        "SELECT session_id, created_at FROM sessions WHERE session_id = ANY(%s)", (session_ids,)
+    ).fetchall()
+    return {r["session_id"]: r["created_at"] for r in rows}
+
+
+def sync_file(path: str, batch_size: int, resend: bool, overwrite: bool, dry_run: bool) -> dict:
+    # Each session is uploaded as a full payload (same as POST /sessions) and the days it had
+    # resolved locally are resolved again in Postgres; one Postgres transaction per batch.
+    # A session that is newer in Postgres (later created_at) is skipped unless `overwrite`.
+    local = local_connect(path)
+    totals = {"synced": 0, "skipped": 0, "days": 0}
+    try:
+        pending = local.execute(LOCAL_PENDING_SELECT, (resend,)).fetchall()
+        with get_conn() as conn:
+            migrate_schema(conn)
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                central = _central_created_at(conn, [row["session_id"] for row in batch])
+                synced = []
+                pairs = []
+                for row in batch:
+                    session_id = row["session_id"]
+                    if not overwrite and (central.get(session_id) or "") > row["created_at"]:
+                        totals["skipped"] += 1
+                        print(f"  skipped {session_id}: newer in Postgres", file=sys.stderr)
+                        continue
+                    synced.append(row)
+                    pairs.extend(
+                        (session_id, r["day"])
+                        for r in local.execute("SELECT day FROM daily_effects WHERE session_id = ?", (session_id,))
+                    )
+                    if not dry_run:
+                        normalize_session(conn, session_id, session_payload(row), row["created_at"])
+                if dry_run:
+                    totals["synced"] += len(synced)
+                    totals["days"] += len(pairs)
+                    continue
+                conn.commit()
+                if pairs:
+                    # commits on its own once the days are written
+                    run_sync(conn, _resolve_days_batch_steps(pairs, False))
+                with _local_transaction(local):
+                    # a session changed locally since it was read stays pending
+                    local.executemany(
+                        "UPDATE sessions SET synced_revision = ? WHERE session_id = ? AND revision = ?",
+                        [(row["revision"], row["session_id"], row["revision"]) for row in synced],
+                    )
+                totals["synced"] += len(synced)
+                totals["days"] += len(pairs)
+                print(f"{path}: {totals['synced']}/{len(pending)} session(s) synced", file=sys.stderr)
+    finally:
+        local.close()
+    return totals
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Push sessions from local SQLite databases (STORAGE_BACKEND=sqlite) to Postgres.")
+    parser.add_argument("paths", nargs="+", help="SQLite files to sync")
+    parser.add_argument("--batch-size", type=int, default=50, help="Sessions per Postgres transaction")
+    parser.add_argument("--all", action="store_true", help="Resend every session, not only the ones changed since the last sync")
+    parser.add_argument("--overwrite", action="store_true", help="Replace sessions even if Postgres has a newer upload")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be synced")
+    args = parser.parse_args()
+    missing = [path for path in args.paths if not os.path.exists(path)]
+    if missing:
+        parser.error(f"file(s) not found: {', '.join(missing)}")
+    try:
+        for path in args.paths:
+            totals = sync_file(path, max(1, args.batch_size), args.all, args.overwrite, args.dry_run)
+            verb = "Would sync" if args.dry_run else "Synced"
+            print(f"{verb} {totals['synced']} session(s) and {totals['days']} resolved day(s) from {path}; "
+                  f"{totals['skipped']} skipped (newer in Postgres).")
+    finally:
+        close_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
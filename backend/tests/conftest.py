@@ -0,0 +1,68 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is run as a package from the repository root (python -m backend.rebuild_db).
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+# Database tests only run against TEST_DATABASE_URL: each one drops and recreates its public
+# schema, so it must never be the DATABASE_URL of a real deployment.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+os.environ["INGEST_MODE"] = "sync"
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ["STORAGE_BACKEND"] = "postgres"
+elif not os.getenv("DATABASE_URL"):
+    # backend.main needs a storage backend to import; the pure tests never open it
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+
+
+@pytest.fixture
+def main():
+    import backend.main
+
+    return backend.main
+
+
+def _drive_steps(steps, answer):
+    # Minimal steps driver: compute steps run inline, every database op is answered by
+    # answer(kind, sql, params). Returns the steps' result and the ops they issued.
+    ops, result = [], None
+    while True:
+        try:
+            kind, sql, params = steps.send(result)
+        except StopIteration as stop:
+            return stop.value, ops
+        if kind == "compute":
+            result = sql(*params)
+            continue
+        ops.append((kind, sql, params))
+        result = answer(kind, sql, params)
+
+
+@pytest.fixture
+def drive_steps():
+    return _drive_steps
+
+
+@pytest.fixture
+def rules(main):
+    # the shipped spec, read directly so tests do not depend on the hot-reload state
+    return main._load_rules_spec(main.RULES_SPEC_PATH)["rules"]
+
+
+@pytest.fixture
+def client(main):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    import psycopg
+    from fastapi.testclient import TestClient
+
+    with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as conn:
+        conn.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    # revisions restart with the schema, so cached documents would look current
+    main._normalized_cache.clear()
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,28 @@
+from backend.benchmarks.synthetic import make_session
+
+
+def test_analytics_include_pending_rollup_deltas(client, main):
+    for i in range(3):
+        client.post("/sessions", json=make_session(f"db-rollup-{i}", days=2, seed=i))
+        client.post(f"/sessions/db-rollup-{i}/resolve_day_effects?day=1")
+    client.post("/sessions", json=make_session("db-rollup-1", days=2, seed=7))
+
+    def read():
+        return (
+            client.get("/analytics/compliance?by=rule_id,day").json(),
+            client.get("/analytics/decision_latency?by=version_id,node_id").json(),
+        )
+
+    before = read()
+    assert before[0]["groups"]
+    with main.get_conn() as conn:
+        main.flush_rollup_deltas(conn)
+        pending = conn.execute("SELECT COUNT(*) AS n FROM comparison_rollup_deltas").fetchone()["n"]
+    assert pending == 0
+    after = read()
+    assert after[0] == before[0]
+    assert [g["n"] for g in after[1]["groups"]] == [g["n"] for g in before[1]["groups"]]
+
+    with main.get_conn() as conn:
+        main.rebuild_analytics(conn)
+    assert read()[0] == before[0]
@@ -0,0 +1,46 @@
+import copy
+
+from backend.benchmarks.synthetic import make_session
+
+
+def test_payload_deltas_merge_and_cursor(main):
+    session = make_session("h4", days=1, seed=4)
+    cursor = main._payload_cursor(session)
+    deltas = [
+        {"player_actions_log": [{"event": "x"}], "final_state": {"day": 2}},
+        '{"process_log": [{"nodeId": "n"}], "session_metadata": {"end_time": 42}}',
+    ]
+    merged = main._merge_payload_deltas(copy.deepcopy(session), deltas)
+    after = main._payload_cursor(merged)
+    assert after["player_actions_log"] == cursor["player_actions_log"] + 1
+    assert after["process_log"] == cursor["process_log"] + 1
+    assert {k: v for k, v in after.items() if k not in ("player_actions_log", "process_log")} == \
+        {k: v for k, v in cursor.items() if k not in ("player_actions_log", "process_log")}
+    assert merged["final_state"] == {"day": 2}
+    assert merged["session_metadata"]["end_time"] == 42
+
+
+def test_append_follows_the_cursor(client):
+    session = make_session("db-append", days=2, seed=1)
+    created = client.post("/sessions", json=session).json()
+    cursor = created["cursor"]
+
+    stale = {**cursor, "player_actions_log": cursor["player_actions_log"] - 1}
+    response = client.post("/sessions/db-append/append", json={"cursor": stale, "player_actions_log": [{"event": "x"}]})
+    assert response.status_code == 409 and response.json()["detail"]["reason"] == "cursor_mismatch"
+    assert response.json()["detail"]["cursor"] == cursor
+
+    delta = {"cursor": cursor, "player_actions_log": [{"event": "late", "day": 2}], "process_log": [{"nodeId": "n9"}]}
+    appended = client.post("/sessions/db-append/append", json=delta).json()
+    assert appended["cursor"]["player_actions_log"] == cursor["player_actions_log"] + 1
+    assert appended["cursor"]["process_log"] == cursor["process_log"] + 1
+    assert appended["counts"]["player_actions_log"] == 1
+
+    # a retried append carries the old cursor and is refused instead of duplicating rows
+    assert client.post("/sessions/db-append/append", json=delta).status_code == 409
+    stored = client.get("/sessions/db-append").json()
+    assert len(stored["player_actions_log"]) == cursor["player_actions_log"] + 1
+    assert stored["player_actions_log"][-1]["event"] == "late"
+
+    assert client.post("/sessions/db-append/append", json={"player_actions_log": []}).status_code == 400
+    assert client.post("/sessions/nope/append", json={"cursor": cursor}).status_code == 404
@@ -0,0 +1,32 @@
+from backend.benchmarks.synthetic import make_session
+
+
+def test_day_cache_follows_its_fingerprint(client, main, monkeypatch):
+    session = make_session("db-fp", days=2, seed=5)
+    client.post("/sessions", json=session)
+    url = "/sessions/db-fp/resolve_day_effects?day=1"
+
+    miss = client.post(url).json()
+    assert miss["cache"] == "miss"
+    hit = client.post(url).json()
+    assert hit["cache"] == "hit" and hit["fingerprint"] == miss["fingerprint"]
+    assert hit["stakeholder_deltas"] == miss["stakeholder_deltas"]
+    assert client.post(url + "&force=true").json()["cache"] == "forced"
+
+    # a new canonical action that can match a day-1 expected action changes the inputs
+    expected = next(a for a in session["expected_actions"] if a["constraints"].get("day") == 1)
+    extra = {
+        "canonical_action_id": "db-fp:extra",
+        "mechanic_id": expected["mechanic_id"],
+        "action_type": expected["action_type"],
+        "target_ref": expected["target_ref"],
+        "value_final": {"day": 1},
+        "committed_at": expected["created_at"] - 1,
+    }
+    stale = client.post(url, json={"canonical_actions": [extra]}).json()
+    assert stale["cache"] == "stale" and stale["fingerprint"] != miss["fingerprint"]
+    assert client.post(url).json()["cache"] == "hit"
+
+    # so does another rules version
+    monkeypatch.setitem(main._rules_state, "version", "other-rules")
+    assert client.post(url).json()["cache"] == "stale"
@@ -0,0 +1,165 @@
+import copy
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from backend.benchmarks.synthetic import make_session
+
+
+def _reason(response):
+    return response.json()["detail"]["reason"]
+
+
+def test_payload_hash_ignores_key_order_only(main):
+    session = make_session("h1", days=2, seed=3)
+    reordered = {key: session[key] for key in reversed(list(session))}
+    reordered["session_metadata"] = dict(reversed(list(session["session_metadata"].items())))
+    assert main._payload_hash(reordered) == main._payload_hash(session)
+    changed = copy.deepcopy(session)
+    changed["canonical_actions"][0]["value_final"]["day"] = 5
+    assert main._payload_hash(changed) != main._payload_hash(session)
+    dropped = copy.deepcopy(session)
+    dropped["player_actions_log"].pop()
+    assert main._payload_hash(dropped) != main._payload_hash(session)
+
+
+@pytest.fixture
+def precheck(main, drive_steps, monkeypatch):
+    # POST /sessions against a fake database: the precheck query is answered with `row`, any
+    # other step generator (the write path) is only recorded. No lifespan, so no pool is opened.
+    from fastapi.testclient import TestClient
+
+    state = {"row": None, "queries": [], "writes": []}
+
+    async def fake_run_db(steps):
+        if steps.__name__ != "_upload_precheck_steps":
+            state["writes"].append(steps.__name__)
+            steps.close()
+            return {"ok": True, "written": True}
+        result, ops = drive_steps(steps, lambda kind, sql, params: state["row"])
+        state["queries"].extend(params for _, _, params in ops)
+        return result
+
+    monkeypatch.setattr(main, "STORAGE_BACKEND", "postgres")
+    monkeypatch.setattr(main, "INGEST_MODE", "sync")
+    monkeypatch.setattr(main, "run_db", fake_run_db)
+    state["client"] = TestClient(main.app)
+    return state
+
+
+def _check_row(**values):
+    row = dict.fromkeys((
+        "payload_hash", "ingest_counts", "queued_hash", "queued_failed", "queued_uploads",
+        "key_session_id", "key_payload_hash", "status_code", "response",
+    ))
+    row.update(values)
+    return row
+
+
+def test_precheck_answers_a_stored_hash_without_writing(main, precheck):
+    session = make_session("pre-hash", days=1, seed=1)
+    payload_hash = main._payload_hash(session)
+    precheck["row"] = _check_row(payload_hash=payload_hash, ingest_counts={"canonical_actions": 3})
+
+    body = precheck["client"].post("/sessions", json=session).json()
+    assert body["deduplicated"] is True and body["counts"] == {"canonical_actions": 3}
+    assert body["cursor"] == main._payload_cursor(session)
+    assert precheck["queries"] == [("pre-hash", None, main.IDEMPOTENCY_KEY_TTL_HOURS)]
+    assert precheck["writes"] == []
+
+    # another document for the session goes on to the write path
+    precheck["row"] = _check_row(payload_hash="older")
+    assert precheck["client"].post("/sessions", json=session).json()["written"] is True
+    # so does one whose queued copy has failed
+    precheck["row"] = _check_row(payload_hash=payload_hash, queued_hash=payload_hash, queued_failed=True, queued_uploads=1)
+    precheck["client"].post("/sessions", json=session)
+    assert precheck["writes"] == ["_create_session_steps", "_create_session_steps"]
+
+
+def test_precheck_answers_a_queued_hash(main, precheck):
+    session = make_session("pre-queued", days=1, seed=2)
+    precheck["row"] = _check_row(queued_hash=main._payload_hash(session), queued_failed=False, queued_uploads=2)
+    response = precheck["client"].post("/sessions", json=session)
+    assert response.status_code == 202
+    assert response.json()["deduplicated"] is True and response.json()["uploads"] == 2
+    assert precheck["writes"] == []
+
+
+def test_precheck_replays_and_refuses_idempotency_keys(main, precheck):
+    session = make_session("pre-idem", days=1, seed=3)
+    payload_hash = main._payload_hash(session)
+    stored = {"ok": True, "session_id": "pre-idem", "counts": {"process_logs": 1}}
+    precheck["row"] = _check_row(
+        key_session_id="pre-idem", key_payload_hash=payload_hash, status_code=202, response=stored,
+        # the key wins over the content hash
+        payload_hash=payload_hash,
+    )
+    replay = precheck["client"].post("/sessions", json=session, headers={"Idempotency-Key": "k1"})
+    assert replay.status_code == 202
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert replay.json() == stored
+    assert precheck["queries"][-1] == ("pre-idem", "k1", main.IDEMPOTENCY_KEY_TTL_HOURS)
+
+    # the same key with another body, or for another session, is refused
+    precheck["row"] = _check_row(key_session_id="pre-idem", key_payload_hash="other", status_code=200, response=stored)
+    reused = precheck["client"].post("/sessions", json=session, headers={"Idempotency-Key": "k1"})
+    assert reused.status_code == 422 and _reason(reused) == "idempotency_key_reused"
+    precheck["row"] = _check_row(key_session_id="elsewhere", key_payload_hash=payload_hash, status_code=200, response=stored)
+    assert precheck["client"].post("/sessions", json=session, headers={"Idempotency-Key": "k1"}).status_code == 422
+
+    # an unknown (or expired) key is no answer: the upload is written
+    precheck["row"] = _check_row()
+    assert precheck["client"].post("/sessions", json=session, headers={"Idempotency-Key": "k2"}).json()["written"] is True
+    assert precheck["writes"] == ["_create_session_steps"]
+
+    queries = len(precheck["queries"])
+    assert precheck["client"].post("/sessions", json=session, headers={"Idempotency-Key": ""}).status_code == 400
+    assert len(precheck["queries"]) == queries
+
+
+def test_identical_upload_is_skipped_until_the_session_changes(client):
+    session = make_session("db-dedupe", days=2, seed=3)
+    first = client.post("/sessions", json=session).json()
+    etag = client.get("/sessions/db-dedupe").headers["etag"]
+
+    again = client.post("/sessions", json=session).json()
+    assert again["deduplicated"] is True
+    assert again["counts"] == first["counts"]
+    assert client.get("/sessions/db-dedupe", headers={"If-None-Match": etag}).status_code == 304
+
+    # after an append the stored rows no longer come from that document
+    client.post("/sessions/db-dedupe/append", json={"cursor": first["cursor"], "player_actions_log": [{"event": "x"}]})
+    assert "deduplicated" not in client.post("/sessions", json=session).json()
+
+    # a resolve payload with new canonical actions clears the hash as well
+    assert client.post("/sessions", json=session).json()["deduplicated"] is True
+    extra = {**session["canonical_actions"][0], "canonical_action_id": "db-dedupe:extra"}
+    client.post("/sessions/db-dedupe/resolve_day_effects?day=1", json={"canonical_actions": [extra]})
+    assert "deduplicated" not in client.post("/sessions", json=session).json()
+
+
+def test_idempotency_keys(client, main):
+    session = make_session("db-idem", days=1, seed=4)
+    first = client.post("/sessions", json=session, headers={"Idempotency-Key": "k1"})
+    assert first.status_code == 200
+
+    replay = client.post("/sessions", json=session, headers={"Idempotency-Key": "k1"})
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert replay.json() == first.json()
+
+    other = copy.deepcopy(session)
+    other["player_actions_log"].append({"event": "x"})
+    reused = client.post("/sessions", json=other, headers={"Idempotency-Key": "k1"})
+    assert reused.status_code == 422 and _reason(reused) == "idempotency_key_reused"
+    assert client.post("/sessions", json=session, headers={"Idempotency-Key": ""}).status_code == 400
+
+    # expired keys are neither replayed nor kept: the next keyed upload purges them
+    expired = datetime.now(timezone.utc) - timedelta(hours=main.IDEMPOTENCY_KEY_TTL_HOURS + 1)
+    with main.get_conn() as conn:
+        conn.execute("UPDATE idempotency_keys SET created_at = %s WHERE idempotency_key = 'k1'", (expired,))
+        conn.commit()
+    assert client.post("/sessions", json=other, headers={"Idempotency-Key": "k1"}).status_code == 200
+    client.post("/sessions", json=session, headers={"Idempotency-Key": "k2"})
+    with main.get_conn() as conn:
+        keys = {r["idempotency_key"]: r["session_id"] for r in conn.execute("SELECT * FROM idempotency_keys").fetchall()}
+    assert keys == {"k1": "db-idem", "k2": "db-idem"}
@@ -0,0 +1,31 @@
+import pytest
+
+from backend.benchmarks.synthetic import make_session
+
+
+def _queue_row(conn):
+    return conn.execute("SELECT seq, attempts, claim_token FROM ingest_queue WHERE session_id = 'db-lease'").fetchone()
+
+
+def test_a_job_that_outlived_its_lease_is_dropped(client, main, monkeypatch):
+    session = make_session("db-lease", days=1, seed=6)
+    with main.get_conn() as conn:
+        main.run_sync(conn, main._enqueue_session_steps("db-lease", session, "2026-01-01T00:00:00+00:00", None))
+        monkeypatch.setattr(main, "INGEST_LEASE_SECONDS", 0)
+        stale, = main.run_sync(conn, main._claim_ingest_steps(1))
+        monkeypatch.setattr(main, "INGEST_LEASE_SECONDS", 300)
+        current, = main.run_sync(conn, main._claim_ingest_steps(1))
+        assert stale["claim_token"] != current["claim_token"]
+
+        # the first job finishes after the row was claimed again: nothing it wrote is kept
+        with pytest.raises(main.IngestLeaseLost):
+            main.run_sync(conn, main._process_ingest_steps(stale))
+        conn.rollback()
+        assert conn.execute("SELECT 1 FROM sessions WHERE session_id = 'db-lease'").fetchone() is None
+        # nor does its failure touch the new claim
+        main.run_sync(conn, main._fail_ingest_steps(stale, "late"))
+        assert _queue_row(conn) == {"seq": current["seq"], "attempts": 0, "claim_token": current["claim_token"]}
+
+        main.run_sync(conn, main._process_ingest_steps(current))
+        assert _queue_row(conn) is None
+        assert conn.execute("SELECT 1 FROM sessions WHERE session_id = 'db-lease'").fetchone() is not None
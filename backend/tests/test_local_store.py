@@ -0,0 +1,97 @@
+import copy
+import json
+import sqlite3
+
+import pytest
+
+from backend.benchmarks.synthetic import make_session
+
+
+@pytest.fixture
+def local(main, tmp_path):
+    conn = main.local_connect(str(tmp_path / "kiosk.sqlite3"))
+    yield conn
+    conn.close()
+
+
+def _comparison_days(conn, session_id):
+    rows = conn.execute("SELECT day, row_key FROM comparisons WHERE session_id = ?", (session_id,)).fetchall()
+    return sorted((r["day"] is not None, r["day"] or 0) for r in rows)
+
+
+def test_local_upload_uses_the_row_diff(main, local):
+    session = make_session("k-diff", days=2, seed=2)
+    first, = main.local_save_sessions(local, [session])
+    assert first["changes"]["canonical_actions"]["inserted"] == len(session["canonical_actions"])
+
+    changed = copy.deepcopy(session)
+    changed["canonical_actions"][0]["value_final"]["day"] = 4
+    changed["process_log"].pop()
+    changes = main.local_save_sessions(local, [changed])[0]["changes"]
+    assert changes["canonical_actions"] == {
+        "inserted": 0, "updated": 1, "deleted": 0, "unchanged": len(session["canonical_actions"]) - 1,
+    }
+    assert changes["process_logs"]["deleted"] == 1
+    assert changes["mechanic_events"]["unchanged"] == len(session["mechanic_events"])
+    stored = local.execute("SELECT COUNT(*) AS n FROM process_logs WHERE session_id = 'k-diff'").fetchone()["n"]
+    assert stored == len(changed["process_log"])
+
+
+def test_local_resolve_writes_comparison_rows(main, local, rules):
+    session = make_session("k-days", days=3, seed=5)
+    session["comparisons"] = [{"expected_action_id": session["expected_actions"][0]["expected_action_id"], "outcome": "TRUE"}]
+    main.local_save_sessions(local, [session])
+
+    def resolve(days, force=False):
+        with main._local_transaction(local):
+            return main._local_resolve_session_days(local, "k-days", days, force, rules, "v")
+
+    results = resolve([1, 2, 2])
+    resolved = {day: len(results[("k-days", day)]["comparisons"]) for day in (1, 2)}
+    assert all(resolved.values())
+    expected_rows = [(False, 0)] + sorted((True, day) for day, n in resolved.items() for _ in range(n))
+    assert _comparison_days(local, "k-days") == expected_rows
+
+    # a forced resolve replaces the day's rows instead of adding to them
+    resolve([1], force=True)
+    assert _comparison_days(local, "k-days") == expected_rows
+
+    # a new upload drops the resolved days with their comparisons, as normalize does
+    changes = main.local_save_sessions(local, [session])[0]["changes"]
+    assert changes["comparisons"] == {"inserted": 0, "updated": 0, "deleted": sum(resolved.values()), "unchanged": 1}
+    assert _comparison_days(local, "k-days") == [(False, 0)]
+    assert local.execute("SELECT COUNT(*) AS n FROM daily_effects").fetchone()["n"] == 0
+
+
+def test_version_1_files_get_the_resolved_comparisons(main, tmp_path):
+    path = str(tmp_path / "v1.sqlite3")
+    old = sqlite3.connect(path)
+    old.executescript(
+        """
+        CREATE TABLE comparisons (session_id TEXT NOT NULL, row_key TEXT, expected_action_id TEXT,
+            canonical_action_id TEXT, outcome TEXT, deviation TEXT, rule_id TEXT, row_hash TEXT,
+            PRIMARY KEY (session_id, row_key));
+        CREATE TABLE daily_effects (session_id TEXT NOT NULL, day INTEGER NOT NULL, comparisons TEXT,
+            global_deltas TEXT, stakeholder_deltas TEXT, created_at TEXT, status TEXT, fingerprint TEXT,
+            PRIMARY KEY (session_id, day));
+        INSERT INTO comparisons VALUES ('s', '0', 'e0', NULL, 'TRUE', NULL, NULL, 'h');
+        PRAGMA user_version = 1;
+        """
+    )
+    day = [{"expected_action_id": "e1", "canonical_action_id": "c1", "outcome": "FALSE", "deviation": {"days": 1}, "rule_id": "r"}]
+    old.execute("INSERT INTO daily_effects (session_id, day, comparisons) VALUES ('s', 2, ?)", (json.dumps(day),))
+    old.commit()
+    old.close()
+
+    conn = main.local_connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()["user_version"] == main.LOCAL_SCHEMA_VERSION
+        rows = conn.execute(
+            "SELECT day, row_key, expected_action_id, deviation FROM comparisons ORDER BY comparison_id"
+        ).fetchall()
+        assert rows == [
+            {"day": None, "row_key": "0", "expected_action_id": "e0", "deviation": None},
+            {"day": 2, "row_key": None, "expected_action_id": "e1", "deviation": '{"days": 1}'},
+        ]
+    finally:
+        conn.close()
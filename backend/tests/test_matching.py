@@ -0,0 +1,65 @@
+from backend.benchmarks.matching import _linear_match, make_actions
+
+DAY_MS = 86_400_000
+
+
+def test_find_best_match_agrees_with_linear_scan(main):
+    for seed in range(3):
+        expected, canonical = make_actions(400, 1500, targets=60, days=5, seed=seed)
+        index = main._build_canonical_index(canonical)
+        for exp in expected:
+            reference = _linear_match(exp, canonical)
+            found = main._find_best_match(index, exp)
+            assert (found and found["canonical_action_id"]) == (reference and reference["canonical_action_id"])
+
+
+def test_find_best_match_picks_first_commit_at_or_after_creation(main):
+    def canonical(cid, committed_at, mechanic_id="map"):
+        return {"canonical_action_id": cid, "action_type": "visit", "target_ref": "t", "mechanic_id": mechanic_id, "committed_at": committed_at}
+
+    index = main._build_canonical_index([
+        canonical("late", 300), canonical("early", 100), canonical("tie-a", 200), canonical("tie-b", 200, "inbox"),
+    ])
+    expected = {"action_type": "visit", "target_ref": "t", "mechanic_id": "map"}
+    assert main._find_best_match(index, {**expected, "created_at": 150})["canonical_action_id"] == "tie-a"
+    assert main._find_best_match(index, {**expected, "created_at": 200})["canonical_action_id"] == "tie-a"
+    # nothing committed after creation: the earliest one
+    assert main._find_best_match(index, {**expected, "created_at": 999})["canonical_action_id"] == "early"
+    # without mechanic_id every mechanic is a candidate (ties keep input order)
+    no_mechanic = {"action_type": "visit", "target_ref": "t", "created_at": 201}
+    assert main._find_best_match(index, no_mechanic)["canonical_action_id"] == "late"
+    assert main._find_best_match(index, {**expected, "mechanic_id": "calendar"}) is None
+    assert main._find_best_match(index, {**expected, "target_ref": "other"}) is None
+
+
+def test_resolve_day_outcomes_and_effects(main, rules):
+    expected = [
+        {"expected_action_id": "e1", "action_type": "visit_stakeholder", "target_ref": "stakeholder:director",
+         "mechanic_id": "map", "constraints": {"day": 1, "time_window": "mañana"},
+         "rule_id": "visit_stakeholder_rule_v1", "created_at": DAY_MS},
+        {"expected_action_id": "e2", "action_type": "schedule_meeting", "target_ref": "meeting:board",
+         "mechanic_id": "calendar", "constraints": {"day": 1}, "rule_id": "meeting_time_rule_v1", "created_at": DAY_MS},
+        {"expected_action_id": "e3", "action_type": "visit_stakeholder", "target_ref": "stakeholder:comunidad",
+         "mechanic_id": "map", "constraints": {"day": 1}, "rule_id": "visit_stakeholder_rule_v1", "created_at": DAY_MS,
+         "effects": {"FALSE": {"stakeholder": {"trust": -3}}}},
+        {"expected_action_id": "e4", "action_type": "visit_stakeholder", "target_ref": "stakeholder:director",
+         "mechanic_id": "map", "constraints": {"day": 2}, "rule_id": "visit_stakeholder_rule_v1", "created_at": DAY_MS},
+    ]
+    canonical = [
+        {"canonical_action_id": "c1", "action_type": "visit_stakeholder", "target_ref": "stakeholder:director",
+         "mechanic_id": "map", "value_final": {"day": 1, "time_slot": "mañana"}, "committed_at": DAY_MS + 60_000},
+        {"canonical_action_id": "c2", "action_type": "schedule_meeting", "target_ref": "meeting:board",
+         "mechanic_id": "calendar", "value_final": {"day": 2}, "committed_at": DAY_MS + 120_000},
+    ]
+    comparisons, global_deltas, stakeholder_deltas = main.resolve_day(
+        expected, main._build_canonical_index(canonical), 1, rules
+    )
+    by_expected = {c["expected_action_id"]: c for c in comparisons}
+    # e4 constrains another day and is not evaluated
+    assert set(by_expected) == {"e1", "e2", "e3"}
+    assert (by_expected["e1"]["canonical_action_id"], by_expected["e1"]["outcome"]) == ("c1", "TRUE")
+    assert (by_expected["e2"]["canonical_action_id"], by_expected["e2"]["outcome"]) == ("c2", "FALSE")
+    assert (by_expected["e3"]["canonical_action_id"], by_expected["e3"]["outcome"]) == (None, "FALSE")
+    assert global_deltas == {"budget": 0, "reputation": -10}
+    # the expected action's own effects replace the rule defaults
+    assert stakeholder_deltas == {"director": {"trust": 10}, "comunidad": {"trust": -3}}
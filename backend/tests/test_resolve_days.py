@@ -0,0 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.benchmarks.synthetic import make_session
+
+
+def test_concurrent_resolves_of_a_day_do_not_duplicate_comparisons(client, main):
+    client.post("/sessions", json=make_session("db-race", days=3, seed=1))
+    expected = len(client.post("/sessions/db-race/resolve_day_effects?day=1").json()["comparisons"])
+    assert expected
+
+    url = "/sessions/db-race/resolve_day_effects?day=1&force=true"
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(lambda _: client.post(url).status_code, range(16)))
+    assert statuses == [200] * 16
+    with main.get_conn() as conn:
+        stored = conn.execute(
+            "SELECT COUNT(*) AS n FROM comparisons WHERE session_id = 'db-race' AND day = 1"
+        ).fetchone()["n"]
+    assert stored == expected
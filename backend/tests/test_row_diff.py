@@ -0,0 +1,97 @@
+import copy
+
+from backend.benchmarks.synthetic import make_session
+
+
+def _table_db(existing):
+    # answers a table write: reads return the stored (key, row_hash) rows, and the only exec,
+    # the stale-row DELETE, reports what it was asked to delete
+    def answer(kind, sql, params):
+        if kind == "all":
+            return list(existing)
+        if kind == "exec":
+            return len(params[1]) + bool(params[2])
+        return None
+    return answer
+
+
+def _decision(node: str, text: str):
+    return (node, "opt", text, None, 1, "AM", None)
+
+
+def test_child_rows_identities(main):
+    session = make_session("h2", days=2, seed=1)
+    session["comparisons"] = [
+        {"expected_action_id": session["expected_actions"][0]["expected_action_id"], "outcome": "TRUE"},
+        {"expected_action_id": "gone", "outcome": "FALSE"},
+    ]
+    expected_ids = {a["expected_action_id"] for a in session["expected_actions"]}
+    rows = main._child_rows(session, expected_ids)
+    assert [key for key, _ in rows["explicit_decisions"]] == [str(i) for i in range(len(session["explicit_decisions"]))]
+    assert [key for key, _ in rows["canonical_actions"]] == [a["canonical_action_id"] for a in session["canonical_actions"]]
+    # comparisons referencing an unknown expected action keep the row without the FK
+    assert [values[0] for _, values in rows["comparisons"]] == [session["comparisons"][0]["expected_action_id"], None]
+
+    # appended items continue the positional keys after what is already stored
+    shifted = main._child_rows(session, expected_ids, {"process_logs": 10, "player_actions_log": 4})
+    assert shifted["process_logs"][0][0] == "10"
+    assert shifted["player_actions_log"][0][0] == "4"
+    assert shifted["explicit_decisions"] == rows["explicit_decisions"]
+    # same content, same row hash
+    assert main._hashed_rows(rows["mechanic_events"]) == main._hashed_rows(shifted["mechanic_events"])
+
+
+def test_write_table_diff_applies_only_changes(main, drive_steps):
+    stored = [("0", _decision("n0", "a")), ("1", _decision("n1", "b")), ("3", _decision("n3", "d"))]
+    existing = [{"key": key, "row_hash": main._row_hash(values)} for key, values in stored]
+    wanted = [("0", _decision("n0", "a")), ("1", _decision("n1", "changed")), ("2", _decision("n2", "c"))]
+
+    counts, ops = drive_steps(main._write_table_steps("s", "explicit_decisions", wanted), _table_db(existing))
+    assert counts == {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 1}
+    by_kind = {kind: params for kind, _, params in ops}
+    assert by_kind["exec"][1] == ["3"]
+    assert [row[1] for row in by_kind["copy"]] == ["2"]
+    assert [row[-1] for row in by_kind["many"]] == ["1"]
+
+    counts, ops = drive_steps(main._write_table_steps("s", "explicit_decisions", wanted, prune=False), _table_db(existing))
+    assert counts == {"inserted": 1, "updated": 1, "deleted": 0, "unchanged": 1}
+    assert "exec" not in {kind for kind, _, _ in ops}
+
+    # without diff nothing is read and every row is written as new
+    counts, ops = drive_steps(main._write_table_steps("s", "explicit_decisions", wanted, diff=False), _table_db(existing))
+    assert counts == {"inserted": 3, "updated": 0, "deleted": 0, "unchanged": 0}
+    assert "all" not in {kind for kind, _, _ in ops}
+
+
+def test_write_table_diff_upserts_keyed_tables(main, drive_steps):
+    session = make_session("h3", days=1, seed=2)
+    rows = main._child_rows(session, set())["canonical_actions"]
+    existing = [{"key": key, "row_hash": main._row_hash(values)} for key, values in rows]
+    counts, ops = drive_steps(main._write_table_steps("s", "canonical_actions", rows), _table_db(existing))
+    assert counts == {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": len(rows)}
+    assert all(not params for kind, _, params in ops if kind != "all")
+
+    session["canonical_actions"][0]["value_final"] = {"day": 9}
+    changed = main._child_rows(session, set())["canonical_actions"]
+    counts, ops = drive_steps(main._write_table_steps("s", "canonical_actions", changed), _table_db(existing))
+    assert counts["updated"] == 1
+    (kind, _, params), = [op for op in ops if op[0] != "all" and op[2]]
+    assert kind == "many" and params[0][0] == session["canonical_actions"][0]["canonical_action_id"]
+
+
+def test_reupload_reports_row_changes(client):
+    session = make_session("db-diff", days=2, seed=2)
+    first = client.post("/sessions", json=session).json()
+    assert first["changes"]["canonical_actions"]["inserted"] == len(session["canonical_actions"])
+
+    changed = copy.deepcopy(session)
+    changed["canonical_actions"][0]["value_final"]["day"] = 4
+    changed["process_log"].pop()
+    changes = client.post("/sessions", json=changed).json()["changes"]
+    assert changes["canonical_actions"] == {
+        "inserted": 0, "updated": 1, "deleted": 0, "unchanged": len(session["canonical_actions"]) - 1,
+    }
+    assert changes["process_logs"]["deleted"] == 1
+    assert changes["mechanic_events"] == {
+        "inserted": 0, "updated": 0, "deleted": 0, "unchanged": len(session["mechanic_events"]),
+    }
@@ -0,0 +1,145 @@
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+
+# Behaviour of the per-evaluation handlers the compiled rules replaced (RULE_HANDLERS /
+# RULE_EFFECTS), kept here as the reference the compiled predicates must agree with.
+def _reference_time_and_day(main, expected: dict, actual: dict) -> str:
+    constraints = expected.get("constraints") or {}
+    exp_day = main._day_index_from_value(constraints.get("day"))
+    exp_window = main._parse_time_window(constraints.get("time_window"))
+    grace_days = int(constraints.get("grace_days") or 0)
+    info = main._extract_actual_time_info(actual)
+    actual_day = info.get("weekday_index")
+    if exp_day is not None:
+        if actual_day is None:
+            return "FALSE"
+        delta = actual_day - exp_day
+        if delta < 0 or delta > grace_days:
+            return "FALSE"
+    if exp_window and exp_day is not None and actual_day == exp_day:
+        if "slot" in exp_window:
+            if info.get("slot") != exp_window["slot"]:
+                return "FALSE"
+        else:
+            m = info.get("minute_of_day")
+            if m is None or not (exp_window["start"] <= m <= exp_window["end"]):
+                return "FALSE"
+    return "TRUE"
+
+
+def _reference_default(main, expected: dict, actual: dict) -> str:
+    constraints = expected.get("constraints") or {}
+    merged = {**(main._json_load(actual.get("context")) or {}), **(main._json_load(actual.get("value_final")) or {})}
+    return "TRUE" if all(merged.get(k) == v for k, v in constraints.items()) else "FALSE"
+
+
+REFERENCE_TIME_RULES = ("meeting_time_rule_v1", "visit_stakeholder_rule_v1", "research_hours_rule_v1")
+REFERENCE_EFFECTS = {
+    "meeting_time_rule_v1": {"TRUE": {"global": {"reputation": 10}}, "FALSE": {"global": {"reputation": -10}}},
+    "visit_stakeholder_rule_v1": {"TRUE": {"stakeholder": {"trust": 10}}, "FALSE": {"stakeholder": {"trust": -10}}},
+    "research_hours_rule_v1": {"TRUE": {"global": {"reputation": 10}}, "FALSE": {"global": {"reputation": -10}}},
+    "default_rule": {"TRUE": {}, "FALSE": {}},
+}
+
+CONSTRAINTS = [
+    {},
+    {"day": 1},
+    {"day": "Lunes"},
+    {"day": "miércoles", "grace_days": 1},
+    {"day": 2, "time_window": "mañana"},
+    {"day": 2, "time_window": "PM"},
+    {"day": "3", "time_window": "09:00-11:30"},
+    {"day": 3, "time_window": "1400-1600", "grace_days": 2},
+    {"time_window": "tarde"},
+    {"location_id": "box_1"},
+]
+ACTUALS = [
+    {"value_final": {}},
+    {"value_final": {"day": 1, "time_slot": "mañana"}},
+    {"value_final": {"day": "martes", "slot": "pm"}},
+    {"value_final": {"day": 2, "time_slot": "AM", "location_id": "box_1"}},
+    {"value_final": json.dumps({"day": 3, "scheduled_at": "2026-03-04T10:15:00Z"})},
+    {"value_final": {"day": 3, "scheduled_at": "2026-03-04T15:00:00Z"}},
+    {"value_final": {"arrived_at": 1772442060000}},
+    {"value_final": {"day": 4}, "context": {"location_id": "box_1"}},
+    {"value_final": None, "context": json.dumps({"day": "Miercoles", "time_slot": "tarde"})},
+]
+
+
+def test_compiled_rules_agree_with_reference_handlers(main, rules):
+    for rule_id in sorted(rules):
+        for constraints in CONSTRAINTS:
+            expected = {"rule_id": rule_id, "constraints": constraints}
+            predicate, _ = main.compile_expected_rule(expected, rules)
+            for actual in ACTUALS:
+                if rule_id in REFERENCE_TIME_RULES:
+                    reference = _reference_time_and_day(main, expected, actual)
+                else:
+                    reference = _reference_default(main, expected, actual)
+                outcome = "TRUE" if predicate(actual) else "FALSE"
+                assert outcome == reference, (rule_id, constraints, actual)
+
+
+def test_spec_default_effects_match_previous_table(main, rules):
+    for rule_id in rules:
+        _, effects = main.compile_expected_rule({"rule_id": rule_id}, rules)
+        for outcome in ("TRUE", "FALSE"):
+            assert effects.get(outcome) == REFERENCE_EFFECTS.get(rule_id, {}).get(outcome), (rule_id, outcome)
+
+
+def test_unknown_rule_falls_back_to_constraints_match(main, rules):
+    predicate, effects = main.compile_expected_rule({"rule_id": "not_in_spec", "constraints": {"k": 1}}, rules)
+    assert predicate({"value_final": {"k": 1}}) and not predicate({"value_final": {"k": 2}})
+    assert effects == {}
+    predicate, _ = main.compile_expected_rule({"rule_id": None}, rules)
+    assert predicate({"value_final": {}})
+
+
+def test_frontend_rule_ids_are_in_spec(rules):
+    source = (REPO_ROOT / "services" / "comparisonRules.ts").read_text(encoding="utf-8")
+    frontend = set(re.findall(r"^\s+(\w+_rule(?:_v\d+)?)\s*:", source, re.MULTILINE))
+    assert frontend
+    assert frontend <= set(rules)
+
+
+def test_explicit_zero_grace_days_overrides_the_rule_default(main):
+    rules = {"late_ok": {"kind": "time_and_day", "params": {"grace_days": 2}, "effects": {}}}
+    next_day = {"value_final": {"day": 2}}
+    predicate, _ = main.compile_expected_rule({"rule_id": "late_ok", "constraints": {"day": 1}}, rules)
+    assert predicate(next_day)
+    predicate, _ = main.compile_expected_rule({"rule_id": "late_ok", "constraints": {"day": 1, "grace_days": 0}}, rules)
+    assert not predicate(next_day)
+    predicate, _ = main.compile_expected_rule({"rule_id": "late_ok", "constraints": {"day": 1, "grace_days": None}}, rules)
+    assert not predicate(next_day)
+
+
+def test_current_rules_refuses_to_run_without_a_good_load(main, monkeypatch, tmp_path):
+    path = tmp_path / "rules.json"
+    monkeypatch.setattr(main, "RULES_SPEC_PATH", path)
+    monkeypatch.setattr(main, "_rules_state", {"mtime": None, "version": None, "rules": {}, "error": None})
+    with pytest.raises(RuntimeError):
+        main.current_rules()
+    path.write_text("[]", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        main.current_rules(force=True)
+
+    path.write_text(json.dumps({"rules": {"only_rule": {"kind": "pass"}}}), encoding="utf-8")
+    loaded = main.current_rules(force=True)
+    version = main.current_rules_version()
+    assert set(loaded) == {"only_rule"} and version
+
+    # a broken edit keeps the last good rules and reports the error
+    path.write_text("{broken", encoding="utf-8")
+    assert set(main.current_rules(force=True)) == {"only_rule"}
+    assert main.current_rules_version() == version
+    assert main._rules_state["error"]
+
+    path.write_text(json.dumps({"rules": {"bad": {"kind": "nope"}}}), encoding="utf-8")
+    assert set(main.current_rules(force=True)) == {"only_rule"}
+    assert "unknown kind" in main._rules_state["error"]
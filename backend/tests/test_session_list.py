@@ -0,0 +1,16 @@
+from backend.benchmarks.synthetic import make_session
+
+
+def test_list_etag_changes_on_delete(client, main):
+    for i in range(2):
+        client.post("/sessions", json=make_session(f"db-list-{i}", days=1, seed=i))
+    etag = client.get("/sessions").headers["etag"]
+    assert client.get("/sessions", headers={"If-None-Match": etag}).status_code == 304
+
+    # the older session: MAX(revision) alone would not move
+    with main.get_conn() as conn:
+        conn.execute("DELETE FROM sessions WHERE session_id = 'db-list-0'")
+        conn.commit()
+    response = client.get("/sessions", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [row["session_id"] for row in response.json()] == ["db-list-1"]
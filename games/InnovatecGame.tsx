@@ -6,7 +6,7 @@ import { EMAIL_TEMPLATES } from '../data/innovatec/emails';
 import { startLogging, finalizeLogging } from '../services/Timelogger';
 import { mechanicEngine } from '../services/MechanicEngine';
 import { compareExpectedVsActual } from '../services/ComparisonEngine';
-import { buildSessionExport } from '../services/sessionExport';
+import { buildSessionExport, pushSessionSnapshot, SessionSyncState } from '../services/sessionExport';
 import { clampReputation, resolveGlobalEffects } from '../services/globalEffects';
 import type { DailyEffectSummary } from '../types';
 import { INNOVATEC_REGISTRY } from '../mechanics/innovatecRegistry';
@@ -84,6 +84,7 @@ const getInitialSecretaryActions = (): PlayerAction[] => [
 export default function InnovatecGame({ onExitToHome }: InnovatecGameProps): React.ReactElement {
   const sessionIdRef = useRef<string>(crypto.randomUUID());
   const sessionStartRef = useRef<number | null>(null);
+  const sessionSyncRef = useRef<SessionSyncState | null>(null);
   const sessionEndRef = useRef<number | null>(null);
   const config = SIMULATOR_CONFIGS.INNOVATEC;
   const [isGameStarted, setIsGameStarted] = useState(false);
@@ -407,7 +408,7 @@ export default function InnovatecGame({ onExitToHome }: InnovatecGameProps): Rea
   const syncDayWithBackend = useCallback(
     async (completedDay: number, snapshot: GameState) => {
       try {
-        // 1) Persist snapshot
+        // 1) Persist snapshot (only what is new since the last sync)
         const exportPayload = buildSessionExport({
           gameState: snapshot,
           config,
@@ -415,15 +416,12 @@ export default function InnovatecGame({ onExitToHome }: InnovatecGameProps): Rea
           startedAt: sessionStartRef.current ?? Date.now(),
           endedAt: Date.now(),
         });
-        await fetch(`${API_BASE_URL.replace(/\/$/, '')}/sessions`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(exportPayload),
-        });
+        const syncResp = await pushSessionSnapshot(API_BASE_URL, exportPayload, sessionSyncRef.current);
+        sessionSyncRef.current = syncResp.syncState;
 
         // 2) Resolve daily effects
         const resp = await fetch(
-          `${API_BASE_URL.replace(/\/$/, '')}/sessions/${exportPayload.session_metadata.session_id}/resolve_day_effects?day=${completedDay}`,
+          `${API_BASE_URL.replace(/\/$/, '')}/sessions/${exportPayload.session_metadata.session_id}/resolve_day_effects?day=${completedDay}&wait_ingest=true`,
           { method: 'POST' }
         );
         if (!resp.ok) {
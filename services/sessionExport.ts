@@ -95,3 +95,78 @@ export const buildSessionExport = ({
     }
   };
 };
+
+// Lists that only grow during a session; the backend tracks how many items of each it
+// already stored (the ingest cursor) so daily syncs only send what is new.
+export const APPEND_LISTS = [
+  'explicit_decisions',
+  'expected_actions',
+  'canonical_actions',
+  'mechanic_events',
+  'process_log',
+  'player_actions_log',
+  'question_log'
+] as const;
+
+export type AppendList = typeof APPEND_LISTS[number];
+export type SessionCursor = Record<AppendList, number>;
+
+export type SessionDelta = Partial<Pick<SessionExport, AppendList>> & {
+  cursor: SessionCursor;
+  session_metadata: Pick<SessionExport['session_metadata'], 'end_time'>;
+  final_state: SessionExport['final_state'];
+};
+
+export interface SessionSyncState {
+  sessionId: string;
+  cursor: SessionCursor;
+}
+
+export const buildSessionDelta = (exportPayload: SessionExport, cursor: SessionCursor): SessionDelta => {
+  const delta: SessionDelta = {
+    cursor,
+    session_metadata: { end_time: exportPayload.session_metadata.end_time },
+    final_state: exportPayload.final_state
+  };
+  APPEND_LISTS.forEach((key) => {
+    (delta as any)[key] = (exportPayload[key] as unknown[]).slice(cursor[key] ?? 0);
+  });
+  return delta;
+};
+
+// Sends only the new items when we hold a cursor for this session; falls back to the
+// full payload on the first sync or when the backend rejects the cursor (409/404).
+export const pushSessionSnapshot = async (
+  apiBaseUrl: string,
+  exportPayload: SessionExport,
+  syncState: SessionSyncState | null
+): Promise<{ ok: boolean; status: number; syncState: SessionSyncState | null }> => {
+  const baseUrl = apiBaseUrl.replace(/\/$/, '');
+  const sessionId = exportPayload.session_metadata.session_id;
+
+  if (syncState && syncState.sessionId === sessionId) {
+    const appendResp = await fetch(`${baseUrl}/sessions/${sessionId}/append`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(buildSessionDelta(exportPayload, syncState.cursor))
+    });
+    if (appendResp.ok) {
+      const data = await appendResp.json();
+      return { ok: true, status: appendResp.status, syncState: { sessionId, cursor: data.cursor } };
+    }
+    if (appendResp.status !== 409 && appendResp.status !== 404) {
+      return { ok: false, status: appendResp.status, syncState };
+    }
+  }
+
+  const resp = await fetch(`${baseUrl}/sessions`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(exportPayload)
+  });
+  if (!resp.ok) {
+    return { ok: false, status: resp.status, syncState: null };
+  }
+  const data = await resp.json();
+  return { ok: true, status: resp.status, syncState: data.cursor ? { sessionId, cursor: data.cursor } : null };
+};